@@ -0,0 +1,93 @@
+"""
+Stand-in for the Go market microservice, for benchmarking without live market data.
+
+Serves /stocks, /check-alert and /health with synthetic but deterministic data. Every response
+is delayed by FAKE_MARKET_LATENCY seconds plus up to FAKE_MARKET_JITTER seconds of random jitter,
+to mimic upstream latency. Run from the repository root:
+
+uvicorn benchmarks.fake_market:app --port 8102
+"""
+
+import asyncio
+import math
+import os
+import random
+import zlib
+from datetime import date, datetime, timedelta, timezone
+from fastapi import FastAPI, HTTPException
+
+LATENCY = float(os.getenv("FAKE_MARKET_LATENCY", "0.02"))  # Seconds
+JITTER = float(os.getenv("FAKE_MARKET_JITTER", "0.01"))  # Seconds
+
+# Bar spacing for each supported interval
+INTERVALS = {
+    "1m": timedelta(minutes=1),
+    "5m": timedelta(minutes=5),
+    "15m": timedelta(minutes=15),
+    "1h": timedelta(hours=1),
+    "1d": timedelta(days=1),
+    "1wk": timedelta(weeks=1),
+}
+MAX_BARS = 100_000
+
+app = FastAPI()
+
+
+async def delay() -> None:
+    await asyncio.sleep(LATENCY + random.uniform(0, JITTER))
+
+
+def base_price(ticker: str) -> float:
+    # Stable per-ticker price level between 10 and 510
+    return 10 + zlib.crc32(ticker.encode()) % 500
+
+
+def price_at(base: float, moment: datetime) -> float:
+    # Slow and fast cycles plus a little hashed noise around the base price
+    seconds = moment.timestamp()
+    noise = zlib.crc32(str(seconds).encode()) % 1000 / 100_000
+    trend = math.sin(seconds / 2_600_000) * 0.2 + math.sin(seconds / 260_000) * 0.05
+    return round(base * (1 + trend + noise), 2)
+
+
+@app.get("/health")
+async def health() -> dict:
+    await delay()
+    return {"status": "ok"}
+
+
+@app.get("/stocks")
+async def stocks(ticker: str, startDate: str, interval: str) -> list:
+    await delay()
+    if interval not in INTERVALS:
+        raise HTTPException(status_code=400, detail="Unsupported interval")
+    try:
+        start = datetime.combine(date.fromisoformat(startDate), datetime.min.time())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid startDate")
+    start = start.replace(tzinfo=timezone.utc)
+
+    step = INTERVALS[interval]
+    now = datetime.now(timezone.utc)
+    bars = min(MAX_BARS, max(0, int((now - start) / step)) + 1)
+    # Prices depend only on the ticker and bar time, so overlapping ranges agree
+    base = base_price(ticker)
+    history = []
+    for bar in range(bars):
+        moment = start + bar * step
+        history.append({"date": moment.isoformat(), "price": price_at(base, moment)})
+    return history
+
+
+@app.get("/check-alert")
+async def check_alert(ticker: str, price: float, direction: str) -> dict:
+    await delay()
+    current = base_price(ticker)
+    valid = (direction == "above" and price > current) or (
+        direction == "below" and price < current
+    )
+    return {
+        "valid": valid,
+        "currentPrice": current,
+        "message": "ok" if valid else f"price must be {direction} {current}",
+    }
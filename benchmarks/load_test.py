@@ -0,0 +1,408 @@
+"""
+Reproducible load test of the backend against local stand-ins.
+
+Loads the schema from sql/ into a local PostgreSQL database (given by the usual DATABASE_*
+environment variables), seeds it with synthetic users and alerts, starts the fake market service
+and the FastAPI app with uvicorn, then drives a weighted mix of requests from concurrent
+virtual users. Throughput and p50/p95/p99 latency per route are printed and saved as JSON, so
+results can be compared between commits. Run from the repository root:
+
+python -m benchmarks.load_test --users 100 --alerts 100000 --duration 30
+python -m benchmarks.load_test --baseline benchmarks/results/<previous>.json
+
+WARNING: the target database's users and alerts tables are dropped and recreated.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import httpx
+import numpy as np
+import psycopg as postgres
+from dotenv import load_dotenv
+
+ROOT = Path(__file__).resolve().parent.parent
+SQL_DIR = ROOT / "sql"
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+
+# Default request mix, as relative weights per route
+MIX = {
+    "POST /login": 2,
+    "GET /alerts": 40,
+    "POST /alerts": 10,
+    "DELETE /alerts": 5,
+    "GET /stocks": 38,
+    "GET /health/deep": 5,
+}
+TICKERS = [f"T{index:03d}" for index in range(500)]
+INTERVALS = ["1d", "1d", "1d", "1h", "15m"]
+PASSWORD = "benchmark"
+
+
+def conninfo() -> str:
+    return (
+        f"host={os.getenv('DATABASE_HOST')} port={os.getenv('DATABASE_PORT')} "
+        f"dbname={os.getenv('DATABASE_NAME')} user={os.getenv('DATABASE_USERNAME')} "
+        f"password={os.getenv('DATABASE_PASSWORD')}"
+    )
+
+
+def sql_statements(path: Path) -> List[str]:
+    """
+    Split a SQL script into statements, dropping comment lines.
+    Statements are run one at a time, since CREATE INDEX CONCURRENTLY cannot share a
+    transaction block with other statements.
+    """
+    lines = [
+        line
+        for line in path.read_text().splitlines()
+        if not line.strip().startswith("--")
+    ]
+    return [statement for statement in "\n".join(lines).split(";") if statement.strip()]
+
+
+def seed(users: int, alerts: int) -> None:
+    """
+    Recreate the schema from sql/ and load synthetic users and alerts.
+    """
+    print(f"Seeding {users} users and {alerts} alerts...")
+    rng = random.Random(0)
+    now = datetime.now(timezone.utc)
+    with postgres.connect(conninfo(), autocommit=True) as conn:
+        conn.execute("DROP TABLE IF EXISTS alerts, users")
+        scripts = [
+            SQL_DIR / "create_users_table.sql",
+            SQL_DIR / "create_alerts_table.sql",
+        ]
+        scripts += sorted((SQL_DIR / "migrations").glob("*.sql"))
+        for script in scripts:
+            for statement in sql_statements(script):
+                conn.execute(statement)
+
+        with conn.cursor() as cur:
+            with cur.copy("COPY users (username, password) FROM STDIN") as copy:
+                for index in range(users):
+                    copy.write_row((f"user{index}", PASSWORD))
+            cur.execute("SELECT id FROM users ORDER BY id")
+            user_ids = [row[0] for row in cur.fetchall()]
+
+            columns = (
+                "user_id, ticker, price, direction, triggered, expired, expiration_time"
+            )
+            with cur.copy(f"COPY alerts ({columns}) FROM STDIN") as copy:
+                for _ in range(alerts):
+                    state = rng.random()
+                    expiration = None
+                    if state < 0.7:  # Active
+                        triggered, expired = False, None
+                        if rng.random() < 0.3:
+                            expired = False
+                            expiration = now + timedelta(days=rng.randint(1, 90))
+                    elif state < 0.9:  # Triggered
+                        triggered, expired = True, None
+                    else:  # Expired
+                        triggered, expired = False, True
+                        expiration = now - timedelta(days=rng.randint(1, 90))
+                    copy.write_row(
+                        (
+                            rng.choice(user_ids),
+                            rng.choice(TICKERS),
+                            round(rng.uniform(10, 510), 2),
+                            rng.choice(("above", "below")),
+                            triggered,
+                            expired,
+                            expiration,
+                        )
+                    )
+        # VACUUM sets the visibility map, so index-only scans are planned as in production
+        conn.execute("VACUUM ANALYZE users")
+        conn.execute("VACUUM ANALYZE alerts")
+
+
+def start(args: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", *args, "--log-level", "warning"],
+        cwd=ROOT,
+        env={**os.environ, **env},
+    )
+
+
+async def wait_until_ready(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready within {timeout}s")
+
+
+class Recorder:
+    """
+    Collects latency samples and status codes per route.
+    """
+
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = {route: [] for route in MIX}
+        self.errors: Dict[str, int] = {route: 0 for route in MIX}
+
+    def record(self, route: str, started: float, response: Optional[httpx.Response]):
+        self.latencies[route].append(time.perf_counter() - started)
+        if response is None or response.status_code >= 400:
+            self.errors[route] += 1
+
+
+async def virtual_user(
+    client: httpx.AsyncClient,
+    recorder: Recorder,
+    username: str,
+    deadline: float,
+    rng: random.Random,
+) -> None:
+    """
+    Log in, then send requests drawn from the mix until the deadline.
+    """
+    routes, weights = list(MIX), list(MIX.values())
+    token = None
+    created: List[int] = []
+    while time.monotonic() < deadline:
+        route = "POST /login" if token is None else rng.choices(routes, weights)[0]
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        started = time.perf_counter()
+        response = None
+        try:
+            if route == "POST /login":
+                response = await client.post(
+                    "/login", data={"username": username, "password": PASSWORD}
+                )
+                if response.status_code == 200:
+                    token = response.json()["access_token"]
+            elif route == "GET /alerts":
+                term = rng.choice(["", "", "T1", "T0", "T2"])
+                response = await client.get(
+                    "/alerts", params={"search_term": term}, headers=headers
+                )
+            elif route == "POST /alerts":
+                response = await client.post(
+                    "/alerts",
+                    json={
+                        "ticker": rng.choice(TICKERS),
+                        "price": round(rng.uniform(10, 510), 2),
+                        "direction": rng.choice(("above", "below")),
+                        "expiration_time": None,
+                    },
+                    headers=headers,
+                )
+                if response.status_code == 201:
+                    created.append(response.json()["new_alert_id"])
+            elif route == "DELETE /alerts":
+                if not created:
+                    continue
+                response = await client.delete(
+                    "/alerts", params={"id": created.pop()}, headers=headers
+                )
+            elif route == "GET /stocks":
+                start = date.today() - timedelta(days=rng.choice((7, 30, 365, 1825)))
+                response = await client.get(
+                    "/stocks",
+                    params={
+                        "ticker": rng.choice(TICKERS[:50]),  # Popular tickers
+                        "startDate": start.isoformat(),
+                        "interval": rng.choice(INTERVALS),
+                    },
+                )
+            elif route == "GET /health/deep":
+                response = await client.get("/health/deep")
+        except httpx.HTTPError:
+            response = None
+        recorder.record(route, started, response)
+
+
+async def drive(
+    base_url: str, users: int, concurrency: int, duration: float
+) -> Dict[str, Any]:
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=30.0
+    ) as client:
+        # Warm up connections and caches before measuring
+        await asyncio.gather(
+            *(
+                virtual_user(
+                    client,
+                    Recorder(),
+                    f"user{index % users}",
+                    time.monotonic() + 2,
+                    random.Random(-index),
+                )
+                for index in range(concurrency)
+            )
+        )
+        started = time.monotonic()
+        await asyncio.gather(
+            *(
+                virtual_user(
+                    client,
+                    recorder,
+                    f"user{index % users}",
+                    started + duration,
+                    random.Random(index),
+                )
+                for index in range(concurrency)
+            )
+        )
+        elapsed = time.monotonic() - started
+
+    routes = {}
+    for route, samples in recorder.latencies.items():
+        if not samples:
+            continue
+        latencies = np.array(samples) * 1000
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        routes[route] = {
+            "requests": len(samples),
+            "errors": recorder.errors[route],
+            "throughput": len(samples) / elapsed,
+            "mean_ms": float(latencies.mean()),
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99),
+        }
+    total = sum(route["requests"] for route in routes.values())
+    return {
+        "elapsed": elapsed,
+        "throughput": total / elapsed,
+        "errors": sum(route["errors"] for route in routes.values()),
+        "routes": routes,
+    }
+
+
+def print_report(result: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> None:
+    header = f"{'route':<18}{'req/s':>10}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for route, stats in result["routes"].items():
+        line = (
+            f"{route:<18}{stats['throughput']:>10.1f}{stats['errors']:>8}"
+            f"{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}"
+        )
+        previous = (baseline or {}).get("routes", {}).get(route)
+        if previous:
+            change = (stats["p95_ms"] / previous["p95_ms"] - 1) * 100
+            line += f"   p95 {change:+.1f}% vs baseline"
+        print(line)
+    print(f"\nTotal: {result['throughput']:.1f} req/s, {result['errors']} errors")
+    if baseline:
+        change = (result["throughput"] / baseline["throughput"] - 1) * 100
+        print(f"Throughput {change:+.1f}% vs baseline")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--alerts", type=int, default=100_000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--market-latency", type=float, default=0.02, help="Seconds")
+    parser.add_argument("--market-jitter", type=float, default=0.01, help="Seconds")
+    parser.add_argument("--app-port", type=int, default=8101)
+    parser.add_argument("--market-port", type=int, default=8102)
+    parser.add_argument("--skip-seed", action="store_true")
+    parser.add_argument("--baseline", type=Path, help="Previous result to compare")
+    parser.add_argument("--output", type=Path, help="Where to save the JSON result")
+    args = parser.parse_args()
+
+    load_dotenv(ROOT / ".env")
+    if not args.skip_seed:
+        seed(args.users, args.alerts)
+
+    market_url = f"http://127.0.0.1:{args.market_port}"
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    market = start(
+        ["benchmarks.fake_market:app", "--port", str(args.market_port)],
+        {
+            "FAKE_MARKET_LATENCY": str(args.market_latency),
+            "FAKE_MARKET_JITTER": str(args.market_jitter),
+        },
+    )
+    app = start(
+        [
+            "src.server:app",
+            "--port",
+            str(args.app_port),
+            "--workers",
+            str(args.workers),
+        ],
+        {
+            "GO_API_URL": market_url,
+            "CORS_ORIGINS": app_url,
+            "JWT_SECRET_KEY": os.getenv("JWT_SECRET_KEY", "benchmark-secret"),
+            "EVALUATION_ENABLED": "false",
+        },
+    )
+    try:
+        asyncio.run(wait_until_ready(market_url + "/health"))
+        asyncio.run(wait_until_ready(app_url + "/health"))
+        print(
+            f"Driving {args.concurrency} virtual users for {args.duration:.0f}s "
+            f"(market latency {args.market_latency * 1000:.0f}"
+            f"+{args.market_jitter * 1000:.0f}ms)..."
+        )
+        result = asyncio.run(
+            drive(app_url, args.users, args.concurrency, args.duration)
+        )
+    finally:
+        app.terminate()
+        market.terminate()
+        app.wait()
+        market.wait()
+
+    commit = git_commit()
+    result = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            key: str(value) if isinstance(value, Path) else value
+            for key, value in vars(args).items()
+        },
+        **result,
+    }
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else None
+    print_report(result, baseline)
+
+    output = (
+        args.output or RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2) + "\n")
+    print(f"Saved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Query plan regression check for the hot alert queries.
+
+Seeds a local PostgreSQL database the same way as the load test (given by the usual DATABASE_*
+environment variables), then runs EXPLAIN (FORMAT JSON) on every hot query in src/alerts.py,
+src/alert_index.py, src/expiry.py and src/shards.py, using the query text the application itself
+runs. The check fails, with a non-zero exit status, if any plan reads a large table with a
+sequential scan or if its estimated total cost is over the query's budget. It also fails if a
+failed CREATE INDEX CONCURRENTLY left an index on the alerts table INVALID, since re-running
+the migration skips it (see sql/migrations/). Run from the repository root:
+
+python -m benchmarks.query_plans --alerts 1000000
+python -m benchmarks.query_plans --skip-seed
+
+Budgets are in planner cost units, set from the plans PostgreSQL 16 chose for 100k, 1M and 3M
+seeded alerts, with about 1.5x headroom over the largest cost measured. Queries that must read
+every active alert get a budget per seeded alert, the expiry sweep one per alert in its batch,
+and all others a fixed budget well below the cost of a full scan. Re-measure them with
+--verbose after changing the seed data, the schema or the planner settings.
+
+WARNING: unless --skip-seed is given, the target database's users and alerts tables are dropped
+and recreated.
+"""
+
+import argparse
+import json
+import sys
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+import psycopg as postgres
+from psycopg import sql
+from dotenv import load_dotenv
+from benchmarks.load_test import ROOT, conninfo, seed
+from src import alert_index, alerts, expiry, shards
+
+# Sequential scans are only flagged on tables estimated to hold more rows than this
+SEQ_SCAN_MIN_ROWS = 10_000
+# Queries for which a sequential scan is the right plan: each shard reads all active alerts
+# whose ticker hashes to it, which no index can narrow down, and a sequential scan of the
+# table measured cheaper than an index-only scan of every active alert. Shards load once per
+# EVALUATION_SHARD_RELOAD_INTERVAL and receive changes incrementally in between
+SEQ_SCAN_ALLOWED = {"shards.load"}
+PAGE_SIZE = 100
+
+# Indexes left unusable by a failed or cancelled concurrent build
+INVALID_INDEXES = """
+    SELECT indexrelid::regclass::text FROM pg_index
+    WHERE indrelid = 'alerts'::regclass AND NOT indisvalid;
+    """
+
+
+def page(alert_count: int) -> float:
+    # Index lookups of a page of rows, independent of table size (measured up to 3,438)
+    return 5_000
+
+
+def batch(alert_count: int) -> float:
+    # Index lookups of an expiry batch (measured up to 6,254 for 10,000 alerts)
+    return 0.9 * expiry.BATCH_SIZE + 1_000
+
+
+def full(alert_count: int) -> float:
+    # Reads of every active alert (measured up to 0.031 per seeded alert)
+    return 0.045 * alert_count + 5_000
+
+
+def checks(
+    user_id: int, alert_ids: List[int]
+) -> List[Tuple[str, Any, List[Any], Callable[[int], float]]]:
+    """
+    The hot queries as (name, query, params, budget for a given alert count).
+    """
+    return [
+        ("alerts.search", *alerts.search_query(user_id, "", PAGE_SIZE)[:2], page),
+        ("alerts.search_json", *alerts.search_json_query(user_id, "", PAGE_SIZE), page),
+        (
+            "alerts.search after",
+            *alerts.search_query(user_id, "", PAGE_SIZE, after=alert_ids[-1])[:2],
+            page,
+        ),
+        (
+            "alerts.search ticker",
+            *alerts.search_query(user_id, "T01", PAGE_SIZE)[:2],
+            page,
+        ),
+        (
+            "alerts.search active",
+            *alerts.search_query(user_id, "", PAGE_SIZE, status="active")[:2],
+            page,
+        ),
+        (
+            "alerts.search triggered",
+            *alerts.search_query(user_id, "", PAGE_SIZE, status="triggered")[:2],
+            page,
+        ),
+        ("alerts.delete_many", alerts.DELETE_ALERTS, [alert_ids, user_id], page),
+        (
+            "alerts.trigger_many",
+            alerts.TRIGGER_ALERTS,
+            [datetime.now(timezone.utc), alert_ids],
+            page,
+        ),
+        ("alerts.evaluate", alerts.EVALUATE_ALERTS, [], full),
+        ("alert_index.load", alert_index.LOAD_ALERTS, [], full),
+        ("shards.load", shards.SHARD_ALERTS, [4, 0], full),
+        (
+            "expiry.sweep",
+            expiry.EXPIRE_DUE,
+            [datetime.now(timezone.utc), expiry.BATCH_SIZE],
+            batch,
+        ),
+        ("expiry.load", expiry.UPCOMING_DEADLINES, [expiry.HEAP_SIZE], page),
+    ]
+
+
+def plan_nodes(node: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--alerts", type=int, default=1_000_000)
+    parser.add_argument("--skip-seed", action="store_true")
+    parser.add_argument(
+        "--verbose", action="store_true", help="Print every plan as JSON"
+    )
+    args = parser.parse_args()
+
+    load_dotenv(ROOT / ".env")
+    if not args.skip_seed:
+        seed(args.users, args.alerts)
+
+    failures = 0
+    # Client-side binding, so EXPLAIN sees the literal parameters
+    with postgres.connect(
+        conninfo(), autocommit=True, cursor_factory=postgres.ClientCursor
+    ) as conn:
+        alert_count = conn.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE relname = 'alerts'"
+        ).fetchone()[0]
+        table_rows = dict(
+            conn.execute(
+                "SELECT relname, reltuples FROM pg_class WHERE relkind = 'r'"
+            ).fetchall()
+        )
+        # The user with the most alerts, and a page of their alert ids
+        user_id = conn.execute(
+            "SELECT user_id FROM alerts GROUP BY user_id ORDER BY count(*) DESC LIMIT 1"
+        ).fetchone()[0]
+        alert_ids = [
+            row[0]
+            for row in conn.execute(
+                "SELECT alert_id FROM alerts WHERE user_id = %s ORDER BY alert_id LIMIT %s",
+                (user_id, PAGE_SIZE),
+            )
+        ]
+
+        for (index,) in conn.execute(INVALID_INDEXES):
+            failures += 1
+            print(f"FAIL  index {index} is INVALID: drop it and re-run its migration")
+
+        print(f"Checking query plans against {alert_count} alerts...")
+        for name, query, params, budget in checks(user_id, alert_ids):
+            explain = sql.SQL("EXPLAIN (FORMAT JSON) ") + (
+                sql.SQL(query) if isinstance(query, str) else query
+            )
+            plan = conn.execute(explain, params).fetchone()[0][0]["Plan"]
+            if args.verbose:
+                print(json.dumps(plan, indent=2))
+
+            problems = [
+                f"sequential scan on {node['Relation Name']}"
+                for node in plan_nodes(plan)
+                if node["Node Type"] in ("Seq Scan", "Parallel Seq Scan")
+                and name not in SEQ_SCAN_ALLOWED
+                and table_rows.get(node["Relation Name"], 0) > SEQ_SCAN_MIN_ROWS
+            ]
+            limit = budget(alert_count)
+            if plan["Total Cost"] > limit:
+                problems.append(
+                    f"cost {plan['Total Cost']:.0f} over budget {limit:.0f}"
+                )
+            failures += bool(problems)
+            status = "FAIL" if problems else "ok"
+            print(
+                f"{status:>4}  {name:<24} cost {plan['Total Cost']:>10.0f}  "
+                f"budget {limit:>10.0f}  {'; '.join(problems)}"
+            )
+
+    if failures:
+        print(f"{failures} check(s) failed")
+        sys.exit(1)
+    print("All query plans within budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Benchmark of the cost of turning alert rows into a GET /alerts response body.
+
+Compares, per 10k alerts:
+
+* rows: psycopg tuples zipped into dicts, validated against the List[Dict] response model and
+  encoded with the standard library, as FastAPI's default JSONResponse does
+* orjson: the same dicts and validation, encoded by ORJSONResponse
+* database: the query wrapped by alerts.search_json_query, where PostgreSQL builds the JSON
+  array and the backend passes its bytes through
+
+The first two run on synthetic rows. With --database, all three are also timed end to end,
+query included, against the local PostgreSQL database (given by the usual DATABASE_*
+environment variables) for the user with the most alerts. Seed it with the load test first.
+Run from the repository root:
+
+python -m benchmarks.serialization
+python -m benchmarks.serialization --database
+
+Each figure is the best of --repeat runs, in milliseconds per 10k alerts.
+"""
+
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Tuple
+
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret")
+
+import psycopg as postgres
+from dotenv import load_dotenv
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import TypeAdapter
+from benchmarks.load_test import ROOT, conninfo
+from src import alerts
+
+ALERTS = 10_000
+# Validates and converts to JSON-compatible values like FastAPI's List[Dict] response model
+RESPONSE_MODEL = TypeAdapter(List[Dict])
+
+
+def synthetic_rows(count: int) -> List[Tuple[Any, ...]]:
+    """
+    Rows shaped like those psycopg returns for every column in alerts.ALERT_FIELDS.
+    """
+    rng = random.Random(0)
+    now = datetime.now(timezone.utc)
+    rows = []
+    for alert_id in range(1, count + 1):
+        triggered = rng.random() < 0.2
+        expiration = now + timedelta(days=rng.randint(1, 30))
+        rows.append(
+            (
+                alert_id,
+                1,
+                f"T{rng.randrange(500):03d}",
+                Decimal(f"{rng.uniform(1, 1000):.2f}"),
+                rng.choice(("above", "below")),
+                now - timedelta(seconds=rng.randrange(86400 * 30)),
+                None,
+                triggered,
+                now if triggered else None,
+                None if triggered else False,
+                None if triggered else expiration,
+            )
+        )
+    return rows
+
+
+def encode(response_class: type) -> Callable[[List[Tuple[Any, ...]]], bytes]:
+    def render(rows: List[Tuple[Any, ...]]) -> bytes:
+        results = [dict(zip(alerts.ALERT_FIELDS, row)) for row in rows]
+        content = RESPONSE_MODEL.dump_python(
+            RESPONSE_MODEL.validate_python(results), mode="json"
+        )
+        return response_class(content).body
+
+    return render
+
+
+def best(run: Callable[[], Any], repeat: int) -> float:
+    """
+    Fastest of repeat runs, in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings)
+
+
+def report(label: str, milliseconds: float, count: int, baseline: float) -> None:
+    per_10k = milliseconds * ALERTS / count
+    print(f"{label:<10} {per_10k:9.2f} ms/10k alerts  {baseline / milliseconds:6.1f}x")
+
+
+def measure_encoding(repeat: int) -> None:
+    rows = synthetic_rows(ALERTS)
+    print(f"Encoding {ALERTS} synthetic alerts:")
+    rows_ms = best(lambda: encode(JSONResponse)(rows), repeat)
+    report("rows", rows_ms, ALERTS, rows_ms)
+    report(
+        "orjson", best(lambda: encode(ORJSONResponse)(rows), repeat), ALERTS, rows_ms
+    )
+
+
+def measure_database(repeat: int) -> None:
+    load_dotenv(ROOT / ".env")
+    with postgres.connect(conninfo(), autocommit=True) as conn:
+        user_id, count = conn.execute(
+            "SELECT user_id, count(*) FROM alerts GROUP BY user_id ORDER BY 2 DESC LIMIT 1"
+        ).fetchone()
+        query, params, _ = alerts.search_query(user_id, "")
+        json_query, json_params = alerts.search_json_query(user_id, "")
+        cur = conn.cursor()
+        cur.adapters.register_loader("json", alerts.JsonBytesLoader)
+
+        def query_rows(render: Callable[[List[Tuple[Any, ...]]], bytes]) -> bytes:
+            return render(cur.execute(query, params).fetchall())
+
+        print(f"Querying and encoding {count} alerts of user #{user_id}:")
+        rows_ms = best(lambda: query_rows(encode(JSONResponse)), repeat)
+        report("rows", rows_ms, count, rows_ms)
+        orjson_ms = best(lambda: query_rows(encode(ORJSONResponse)), repeat)
+        report("orjson", orjson_ms, count, rows_ms)
+        database_ms = best(
+            lambda: cur.execute(json_query, json_params).fetchone()[0], repeat
+        )
+        report("database", database_ms, count, rows_ms)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--database", action="store_true", help="Also time queries end to end"
+    )
+    args = parser.parse_args()
+
+    measure_encoding(args.repeat)
+    if args.database:
+        print()
+        measure_database(args.repeat)
+
+
+if __name__ == "__main__":
+    main()
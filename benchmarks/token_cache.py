@@ -0,0 +1,54 @@
+"""
+Microbenchmark of per-request authentication cost in users.get_user_from_token.
+
+Compares full JWT verification (cache cleared before every call) with verified-token cache
+hits. Run from the repository root:
+
+python -m benchmarks.token_cache
+"""
+
+import asyncio
+import os
+import time
+
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret")
+
+from starlette.requests import Request
+from src import users
+from src.schemas import UserResponse
+
+ITERATIONS = 20000
+
+
+def make_request(token: str) -> Request:
+    headers = [(b"authorization", f"Bearer {token}".encode())]
+    return Request({"type": "http", "headers": headers})
+
+
+async def measure(request: Request, clear_cache: bool) -> float:
+    """
+    Return the mean cost of one get_user_from_token call in microseconds.
+    """
+    started = time.perf_counter()
+    for _ in range(ITERATIONS):
+        if clear_cache:
+            users.token_cache.clear()
+        await users.get_user_from_token(request)
+    return (time.perf_counter() - started) / ITERATIONS * 1e6
+
+
+async def main() -> None:
+    token = users.create_access_token(
+        UserResponse(user_id=1, username="benchmark", created_at=0)
+    )
+    request = make_request(token)
+    uncached = await measure(request, clear_cache=True)
+    cached = await measure(request, clear_cache=False)
+    print(f"verify every request: {uncached:8.2f} us/request")
+    print(f"cached token:         {cached:8.2f} us/request")
+    print(f"speedup:              {uncached / cached:8.1f}x")
+    print(f"cache stats:          {users.token_cache.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
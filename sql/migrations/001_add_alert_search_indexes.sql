@@ -0,0 +1,31 @@
+-- Adds the indexes backing `GET /alerts` searches in `alerts.search`.
+--
+-- `alerts_user_id_alert_id_idx` serves the per-user keyset pagination
+-- (`WHERE user_id = ... AND alert_id > ... ORDER BY alert_id LIMIT ...`).
+-- `alerts_ticker_trgm_idx` lets `ticker ILIKE '%term%'` substring searches
+-- use a trigram GIN index instead of scanning every alert.
+--
+-- Indexes are built CONCURRENTLY so the migration does not block writes,
+-- which means this file must not be run inside a transaction block:
+--
+--   psql -f sql/migrations/001_add_alert_search_indexes.sql
+--
+-- Re-running the file skips indexes that already exist, including one left
+-- INVALID by a failed or cancelled concurrent build, which the planner never
+-- uses. List invalid indexes with:
+--
+--   SELECT indexrelid::regclass FROM pg_index
+--   WHERE indrelid = 'alerts'::regclass AND NOT indisvalid;
+--
+-- then drop them before re-running the file:
+--
+--   DROP INDEX CONCURRENTLY IF EXISTS alerts_user_id_alert_id_idx;
+--   DROP INDEX CONCURRENTLY IF EXISTS alerts_ticker_trgm_idx;
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS alerts_user_id_alert_id_idx
+    ON alerts (user_id, alert_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS alerts_ticker_trgm_idx
+    ON alerts USING GIN (ticker gin_trgm_ops);
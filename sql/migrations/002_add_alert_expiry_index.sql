@@ -0,0 +1,28 @@
+-- Adds the partial index backing the alert expiry sweeper in `src/expiry.py`.
+--
+-- `alerts_pending_expiry_idx` only holds alerts that have an expiration time
+-- and are neither triggered nor expired yet (`expired` is NULL for alerts
+-- without an expiration time, and triggering resets it to NULL). Finding the
+-- alerts due for expiry, and the next upcoming expiration times, is then a
+-- short range scan of a small index instead of a scan of the alerts table,
+-- and expired or triggered alerts drop out of the index as they are updated.
+--
+-- The index is built CONCURRENTLY so the migration does not block writes,
+-- which means this file must not be run inside a transaction block:
+--
+--   psql -f sql/migrations/002_add_alert_expiry_index.sql
+--
+-- Re-running the file skips indexes that already exist, including one left
+-- INVALID by a failed or cancelled concurrent build, which the planner never
+-- uses. List invalid indexes with:
+--
+--   SELECT indexrelid::regclass FROM pg_index
+--   WHERE indrelid = 'alerts'::regclass AND NOT indisvalid;
+--
+-- then drop them before re-running the file:
+--
+--   DROP INDEX CONCURRENTLY IF EXISTS alerts_pending_expiry_idx;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS alerts_pending_expiry_idx
+    ON alerts (expiration_time)
+    WHERE expired = false AND triggered = false;
@@ -0,0 +1,40 @@
+-- Adds partial indexes over active alerts (not triggered, not expired), the
+-- subset read by alert evaluation and by most `GET /alerts` requests.
+--
+-- `alerts_active_user_id_alert_id_idx` serves per-user keyset pagination
+-- with `status=active`, without visiting the user's triggered and expired
+-- alerts the way `alerts_user_id_alert_id_idx` would.
+-- `alerts_active_ticker_idx` covers the evaluation query in
+-- `alerts.evaluate` (grouped by ticker) and the alert index load in
+-- `alert_index.load` (ordered by ticker, direction and price), so both are
+-- answered with an index-only scan in the order they need, instead of a
+-- sequential scan of the alerts table followed by a sort or hash.
+--
+-- The predicates must match the queries' `triggered = false AND expired IS
+-- NOT TRUE` exactly for the planner to use these indexes; see
+-- `benchmarks/query_plans.py`, which checks that it does.
+--
+-- Indexes are built CONCURRENTLY so the migration does not block writes,
+-- which means this file must not be run inside a transaction block:
+--
+--   psql -f sql/migrations/003_add_active_alert_indexes.sql
+--
+-- Re-running the file skips indexes that already exist, including one left
+-- INVALID by a failed or cancelled concurrent build, which the planner never
+-- uses. List invalid indexes with:
+--
+--   SELECT indexrelid::regclass FROM pg_index
+--   WHERE indrelid = 'alerts'::regclass AND NOT indisvalid;
+--
+-- then drop them before re-running the file:
+--
+--   DROP INDEX CONCURRENTLY IF EXISTS alerts_active_user_id_alert_id_idx;
+--   DROP INDEX CONCURRENTLY IF EXISTS alerts_active_ticker_idx;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS alerts_active_user_id_alert_id_idx
+    ON alerts (user_id, alert_id)
+    WHERE triggered = false AND expired IS NOT TRUE;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS alerts_active_ticker_idx
+    ON alerts (ticker, direction, price) INCLUDE (alert_id)
+    WHERE triggered = false AND expired IS NOT TRUE;
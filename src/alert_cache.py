@@ -0,0 +1,130 @@
+"""
+Per-user cache of serialized GET /alerts responses, with strong ETags for conditional requests.
+Listings are cached as the JSON bytes rendered by PostgreSQL (see alerts.search_json).
+
+Every user has a version number, bumped whenever their alerts are created, deleted, triggered
+or expired. Responses are cached under the user's current version together with the query
+parameters, so a change makes all of the user's earlier entries unreachable without searching
+for them; they age out of the LRU. The version is read before the query runs, so a listing
+that raced with a change is stored under the old version and never served.
+
+Changes made by this worker bump the version once their transaction commits. Changes made by
+other workers arrive as alert event notifications (see src/events.py), which every worker
+relays here. If the notification connection drops, updates may have been missed, so the whole
+cache is discarded when it reconnects. ALERTS_CACHE_TTL bounds how long any entry can be served
+regardless, e.g. after alerts are edited directly in the database.
+
+The ETag is a hash of the response body, so it stays valid across cache entries and workers:
+a client revalidating with If-None-Match gets a 304 even if its listing had to be rebuilt.
+
+See: https://www.rfc-editor.org/rfc/rfc9110#name-etag
+"""
+
+import hashlib
+import os
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+from src import metrics
+from src.cache import TTLCache
+
+MAX_ENTRIES = int(os.getenv("ALERTS_CACHE_MAX_ENTRIES", "1000"))
+# Listings vary from a few bytes to megabytes, so the cache is also bounded by their total size
+MAX_BYTES = int(os.getenv("ALERTS_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+TTL = float(os.getenv("ALERTS_CACHE_TTL", "60"))  # Seconds, 0 disables caching
+
+
+class Listing(NamedTuple):
+    """
+    A serialized alert listing with its ETag and pagination cursor.
+    """
+
+    body: bytes
+    etag: str
+    next_cursor: Optional[int]
+
+
+def listing_bytes(listing: Listing) -> int:
+    return len(listing.body)
+
+
+listings = TTLCache(MAX_ENTRIES, max_weight=MAX_BYTES, weigh=listing_bytes)
+
+# Incremented when the cache is discarded, so entries built before then are never matched
+epoch = 0
+# Keyed by user id; users missing here have not changed since the last discard
+versions: Dict[int, int] = {}
+counters = {"invalidations": 0, "discards": 0, "not_modified": 0}
+
+
+def version(user_id: int) -> Tuple[int, int]:
+    return epoch, versions.get(user_id, 0)
+
+
+def invalidate(user_id: int) -> None:
+    """
+    Bump a user's version after their alerts changed.
+    """
+    versions[user_id] = versions.get(user_id, 0) + 1
+    counters["invalidations"] += 1
+
+
+def invalidate_many(user_ids: Iterable[int]) -> None:
+    for user_id in set(user_ids):
+        invalidate(user_id)
+
+
+def discard() -> None:
+    """
+    Invalidate every user at once, when change notifications may have been missed.
+    """
+    global epoch
+    epoch += 1
+    versions.clear()
+    listings.clear()
+    counters["discards"] += 1
+
+
+def prepare(body: bytes, next_cursor: Optional[int]) -> Listing:
+    etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+    return Listing(body, etag, next_cursor)
+
+
+async def get_or_render(
+    user_id: int, params: Hashable, fetch: Callable[[], Awaitable[Listing]]
+) -> Listing:
+    """
+    Return the cached listing for a user's query parameters, or await fetch() to build it.
+    Concurrent identical requests share one fetch.
+    """
+    return await listings.get_or_fetch((user_id, version(user_id), params), fetch, TTL)
+
+
+def not_modified(listing: Listing, if_none_match: Optional[str]) -> bool:
+    """
+    Whether an If-None-Match header matches the listing, so a 304 can be sent instead.
+    If-None-Match uses weak comparison, so W/ prefixes are ignored.
+    """
+    if not if_none_match:
+        return False
+    tags = (tag.strip() for tag in if_none_match.split(","))
+    matched = any(tag == "*" or tag.removeprefix("W/") == listing.etag for tag in tags)
+    counters["not_modified"] += matched
+    return matched
+
+
+def stats() -> Dict[str, int]:
+    """
+    Report cache counters and occupancy.
+    """
+    return {**listings.stats(), "users": len(versions), "epoch": epoch, **counters}
+
+
+metrics.CallbackGauge("alerts_cache", "Alert listing cache counters", "stat", stats)
@@ -0,0 +1,260 @@
+"""
+In-memory price-crossing index of active stock price alerts.
+
+For each ticker, alert thresholds are kept in sorted, array-backed columns (one pair for "above"
+alerts and one for "below" alerts) with parallel alert-id columns. Matching a price against a
+ticker's alerts is then a bisect plus a slice, O(log n + k), instead of a scan of the alerts
+table. Each alert costs 16 bytes (an 8-byte float threshold and an 8-byte id), so millions of
+alerts fit comfortably in memory.
+
+The index is loaded from the alerts table and kept up to date incrementally by alerts.create,
+alerts.delete and alerts.trigger. It is per-process state: with several uvicorn workers, each
+worker only sees changes made through its own requests. Only the evaluation leader (see
+src/scheduler.py) matches against it, so it is loaded on the leader's first evaluation rather
+than in every worker, and rebuilt every ALERT_INDEX_RELOAD_INTERVAL seconds, which bounds how
+long an alert created through another worker goes unevaluated.
+"""
+
+import os
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Any, Callable, Collection, Dict, Iterable, List, Optional, Tuple
+from src import database, metrics
+from src.logging import logger
+
+ENABLED = os.getenv("ALERT_INDEX_ENABLED", "false").lower() in ("1", "true", "yes")
+RELOAD_INTERVAL = float(os.getenv("ALERT_INDEX_RELOAD_INTERVAL", "300"))  # Seconds
+
+# Whether the index has been loaded and is safe to match against
+loaded = False
+loaded_at: Optional[float] = None
+# Changes made while a load is in progress, as (function, arguments) to replay onto it
+pending: Optional[List[Tuple[Callable[..., None], Tuple]]] = None
+
+LOAD_QUERY = metrics.db_query("alert_index.load")
+
+
+class ThresholdColumn:
+    """
+    Sorted thresholds with a parallel column of alert ids.
+    """
+
+    __slots__ = ("thresholds", "ids")
+
+    def __init__(self) -> None:
+        self.thresholds = array("d")
+        self.ids = array("q")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, alert_id: int, threshold: float) -> None:
+        start = bisect_left(self.thresholds, threshold)
+        position = bisect_right(self.thresholds, threshold, lo=start)
+        # Already present if created during a load whose query also returned it
+        if alert_id in self.ids[start:position]:
+            return
+        self.thresholds.insert(position, threshold)
+        self.ids.insert(position, alert_id)
+
+    def remove(self, alert_id: int, threshold: float) -> bool:
+        # Only the run of equal thresholds needs to be searched for the id
+        start = bisect_left(self.thresholds, threshold)
+        end = bisect_right(self.thresholds, threshold, lo=start)
+        for position in range(start, end):
+            if self.ids[position] == alert_id:
+                del self.thresholds[position]
+                del self.ids[position]
+                return True
+        return False
+
+    def remove_ids(self, ids: Collection[int]) -> None:
+        keep = [
+            position
+            for position, alert_id in enumerate(self.ids)
+            if alert_id not in ids
+        ]
+        if len(keep) < len(self.ids):
+            self.thresholds = array("d", (self.thresholds[p] for p in keep))
+            self.ids = array("q", (self.ids[p] for p in keep))
+
+
+class TickerAlerts:
+    """
+    Active alerts for a single ticker, split by direction.
+    """
+
+    __slots__ = ("above", "below")
+
+    def __init__(self) -> None:
+        self.above = ThresholdColumn()
+        self.below = ThresholdColumn()
+
+    def __len__(self) -> int:
+        return len(self.above) + len(self.below)
+
+    def column(self, direction: str) -> ThresholdColumn:
+        return self.above if direction == "above" else self.below
+
+    def crossed(self, price: float) -> List[int]:
+        """
+        Ids of alerts that fire at this price: "above" alerts with a threshold below the
+        price, and "below" alerts with a threshold above it.
+        """
+        above = self.above.ids[: bisect_left(self.above.thresholds, price)]
+        below = self.below.ids[bisect_right(self.below.thresholds, price) :]
+        return above.tolist() + below.tolist()
+
+
+# Keyed by ticker
+tickers: Dict[str, TickerAlerts] = {}
+
+
+# alerts.price is qualified so the sort is on the column, in alerts_active_ticker_idx order,
+# rather than on the float8 output column of the same name, which forces an extra sort
+LOAD_ALERTS = """
+    SELECT ticker, direction, price::float8, alert_id
+    FROM alerts
+    WHERE triggered = false AND expired IS NOT TRUE
+    ORDER BY ticker, direction, alerts.price;
+    """
+
+
+async def load() -> None:
+    """
+    Build the index from all active alerts in the database.
+    The new index replaces the old one only once complete, so matching keeps working meanwhile.
+    Changes made while the load query runs are applied to both, so none are lost at the swap.
+    """
+    global tickers, loaded, loaded_at, pending
+    logger.info("Loading alert index...")
+    index: Dict[str, TickerAlerts] = {}
+    pending = []
+    try:
+        async with database.pool.connection() as conn, conn.cursor() as cur:
+            # Rows arrive sorted, so columns can be built by appending
+            with LOAD_QUERY.time():
+                await cur.execute(LOAD_ALERTS)
+            count = 0
+            async for ticker, direction, threshold, alert_id in cur:
+                alerts = index.get(ticker)
+                if alerts is None:
+                    alerts = index[ticker] = TickerAlerts()
+                column = alerts.column(direction)
+                column.thresholds.append(threshold)
+                column.ids.append(alert_id)
+                count += 1
+        # In order, as an alert can be added and removed again during the load
+        for change, args in pending:
+            change(index, *args)
+    finally:
+        pending = None
+    tickers = index
+    loaded = True
+    loaded_at = time.monotonic()
+    logger.info("Alert index loaded %d alerts across %d tickers", count, len(tickers))
+
+
+def apply(change: Callable[..., None], *args: Any) -> None:
+    """
+    Apply a change to the loaded index, and record it for an index being loaded.
+    """
+    if pending is not None:
+        pending.append((change, args))
+    if loaded:
+        change(tickers, *args)
+
+
+def add_to(
+    index: Dict[str, TickerAlerts],
+    alert_id: int,
+    ticker: str,
+    direction: str,
+    threshold: float,
+) -> None:
+    alerts = index.get(ticker)
+    if alerts is None:
+        alerts = index[ticker] = TickerAlerts()
+    alerts.column(direction).add(alert_id, threshold)
+
+
+def remove_from(
+    index: Dict[str, TickerAlerts],
+    alert_id: int,
+    ticker: str,
+    direction: str,
+    threshold: float,
+) -> None:
+    alerts = index.get(ticker)
+    if alerts is None:
+        return
+    alerts.column(direction).remove(alert_id, threshold)
+    if not alerts:
+        del index[ticker]
+
+
+def remove_ids_from(
+    index: Dict[str, TickerAlerts], ticker: str, ids: Collection[int]
+) -> None:
+    alerts = index.get(ticker)
+    if alerts is None:
+        return
+    alerts.above.remove_ids(ids)
+    alerts.below.remove_ids(ids)
+    if not alerts:
+        del index[ticker]
+
+
+def add(alert_id: int, ticker: str, direction: str, threshold: float) -> None:
+    """
+    Add a newly created active alert to the index.
+    """
+    apply(add_to, alert_id, ticker, direction, threshold)
+
+
+def remove(alert_id: int, ticker: str, direction: str, threshold: float) -> None:
+    """
+    Remove an alert from the index once it is deleted, triggered or expired.
+    """
+    apply(remove_from, alert_id, ticker, direction, threshold)
+
+
+def remove_many(rows: Iterable[Tuple]) -> None:
+    """
+    Remove rows starting with (alert_id, ticker, direction, threshold) from the index.
+    """
+    for alert_id, ticker, direction, threshold, *_ in rows:
+        remove(alert_id, ticker, direction, threshold)
+
+
+def remove_fired(ticker: str, ids: Collection[int]) -> None:
+    """
+    Remove alerts matched on a ticker by id, once they are triggered or found inactive.
+    """
+    apply(remove_ids_from, ticker, ids)
+
+
+def reload_due() -> bool:
+    return loaded_at is None or time.monotonic() - loaded_at >= RELOAD_INTERVAL
+
+
+def match(ticker: str, price: float) -> List[int]:
+    """
+    Find the ids of all active alerts on a ticker that are crossed by a price.
+    """
+    alerts = tickers.get(ticker)
+    if alerts is None:
+        return []
+    return alerts.crossed(price)
+
+
+def stats() -> Dict[str, int]:
+    """
+    Report index occupancy.
+    """
+    alerts = sum(len(entry) for entry in tickers.values())
+    return {"tickers": len(tickers), "alerts": alerts, "bytes": alerts * 16}
+
+
+metrics.CallbackGauge("alert_index", "Alert index occupancy", "stat", stats)
@@ -2,124 +2,553 @@
 Manage stock price alerts through interaction with the PostgreSQL database.
 """
 
-from src import database
+import numpy as np
+import psycopg as postgres
+from psycopg import sql
+from psycopg.abc import Buffer
+from psycopg.adapt import Loader
+from src import (
+    alert_cache,
+    alert_index,
+    database,
+    events,
+    expiry,
+    market,
+    metrics,
+    shards,
+)
 from src.schemas import Alert
 from src.logging import logger
 from datetime import datetime, timezone
-from typing import List, Dict, Any
+from itertools import chain
+from typing import List, Dict, Any, Optional, Tuple
 
 
-def search(user_id: int, search_term: str) -> List[Dict[str, Any]]:
+# Latency histograms for each database query
+SEARCH_QUERY = metrics.db_query("alerts.search")
+CREATE_QUERY = metrics.db_query("alerts.create")
+CREATE_MANY_QUERY = metrics.db_query("alerts.create_many")
+DELETE_QUERY = metrics.db_query("alerts.delete")
+DELETE_MANY_QUERY = metrics.db_query("alerts.delete_many")
+EVALUATE_QUERY = metrics.db_query("alerts.evaluate")
+TRIGGER_QUERY = metrics.db_query("alerts.trigger")
+TRIGGER_MANY_QUERY = metrics.db_query("alerts.trigger_many")
+
+# Columns of the alerts table that can be selected through the fields parameter
+ALERT_FIELDS = (
+    "alert_id",
+    "user_id",
+    "ticker",
+    "price",
+    "direction",
+    "creation_time",
+    "update_time",
+    "triggered",
+    "triggered_time",
+    "expired",
+    "expiration_time",
+)
+
+# Conditions matching each alert status
+# expired is NULL for alerts without an expiration time, so test IS NOT TRUE
+STATUS_FILTERS = {
+    "active": sql.SQL("triggered = false AND expired IS NOT TRUE"),
+    "triggered": sql.SQL("triggered = true"),
+    "expired": sql.SQL("expired = true"),
+}
+
+
+def search_query(
+    user_id: int,
+    search_term: str,
+    limit: Optional[int] = None,
+    after: Optional[int] = None,
+    fields: Optional[List[str]] = None,
+    status: Optional[str] = None,
+) -> Tuple[sql.Composed, List[Any], List[str]]:
+    """
+    Build the query for search, returning it with its parameters and selected columns.
+    Raises ValueError for unknown fields or statuses.
+    """
+    if fields:
+        unknown = set(fields) - set(ALERT_FIELDS)
+        if unknown:
+            raise ValueError(f"unknown alert fields: {', '.join(sorted(unknown))}")
+        columns = ["alert_id"] + [field for field in fields if field != "alert_id"]
+    else:
+        columns = list(ALERT_FIELDS)
+    if status is not None and status not in STATUS_FILTERS:
+        raise ValueError(f"unknown alert status: {status}")
+
+    # Use wildcards (%) to match prefix, suffix, or substring
+    ilike_argument = "%" + search_term + "%"
+    conditions = [sql.SQL("user_id = %s"), sql.SQL("ticker ILIKE %s")]
+    params: List[Any] = [user_id, ilike_argument]
+    if status is not None:
+        conditions.append(STATUS_FILTERS[status])
+    if after is not None:
+        conditions.append(sql.SQL("alert_id > %s"))
+        params.append(after)
+    query = sql.SQL("SELECT {} FROM alerts WHERE {} ORDER BY alert_id").format(
+        sql.SQL(", ").join(map(sql.Identifier, columns)),
+        sql.SQL(" AND ").join(conditions),
+    )
+    if limit is not None:
+        query += sql.SQL(" LIMIT %s")
+        params.append(limit)
+    return query, params, columns
+
+
+async def search(
+    user_id: int,
+    search_term: str,
+    limit: Optional[int] = None,
+    after: Optional[int] = None,
+    fields: Optional[List[str]] = None,
+    status: Optional[str] = None,
+) -> List[Dict[str, Any]]:
     """
     Search stock price alerts by a search term.
+    Results are ordered by alert id. Pass limit, and the last alert id of the previous page as
+    after, to page through them with a keyset cursor. fields restricts the returned columns
+    (alert_id is always included, since it is the cursor), and status filters by alert status.
+    Raises ValueError for unknown fields or statuses.
     """
     logger.debug(
         "Fetching alerts for user #%s and search_term: %s", user_id, search_term
     )
-    # Use wildcards (%) to match prefix, suffix, or substring
-    ilike_argument = "%" + search_term + "%"
-    with database.connection.cursor() as cur:
-        cur.execute(
-            "SELECT * FROM alerts WHERE ticker ILIKE %s AND user_id = %s;",
-            (ilike_argument, user_id),
-        )
-        # Extract column names from the result metadata
-        keys = [column[0] for column in cur.description]
-        all_alerts = cur.fetchall()
-        logger.info("Retrieved %d alerts", len(all_alerts))
+    query, params, columns = search_query(
+        user_id, search_term, limit, after, fields, status
+    )
+
+    async with database.pool.connection() as conn, conn.cursor() as cur:
+        with SEARCH_QUERY.time():
+            await cur.execute(query, params)
+            all_alerts = await cur.fetchall()
+        logger.debug("Retrieved %d alerts", len(all_alerts))
         # Format results as list of dictionaries for JSON compatibility
-        return [dict(zip(keys, row)) for row in all_alerts]
+        return [dict(zip(columns, row)) for row in all_alerts]
+
+
+# Columns rendered differently from PostgreSQL's own JSON encoding, to keep the format of
+# responses encoded in Python: DECIMAL prices are sent as strings, not numbers
+JSON_COLUMNS = {"price": sql.SQL("price::text")}
+
+
+def search_json_query(
+    user_id: int,
+    search_term: str,
+    limit: Optional[int] = None,
+    after: Optional[int] = None,
+    fields: Optional[List[str]] = None,
+    status: Optional[str] = None,
+) -> Tuple[sql.Composed, List[Any]]:
+    """
+    Wrap the query for search so that it returns a single row: the results as a JSON array,
+    their count, and the last alert id.
+    """
+    query, params, columns = search_query(
+        user_id, search_term, limit, after, fields, status
+    )
+    select = sql.SQL(", ").join(
+        sql.SQL("{} AS {}").format(
+            JSON_COLUMNS.get(column, sql.Identifier(column)), sql.Identifier(column)
+        )
+        for column in columns
+    )
+    query = sql.SQL(
+        "SELECT coalesce(json_agg(page ORDER BY page.alert_id), '[]'), count(*), "
+        "max(page.alert_id) FROM (SELECT {} FROM ({}) AS matches) AS page"
+    ).format(select, query)
+    return query, params
 
 
-def create(alert: Alert, user_id: int) -> int:
+class JsonBytesLoader(Loader):
+    """
+    Loads json values as the bytes sent by the server, instead of parsing them.
+    """
+
+    def load(self, data: Buffer) -> bytes:
+        return bytes(data)
+
+
+async def search_json(
+    user_id: int,
+    search_term: str,
+    limit: Optional[int] = None,
+    after: Optional[int] = None,
+    fields: Optional[List[str]] = None,
+    status: Optional[str] = None,
+) -> Tuple[bytes, int, Optional[int]]:
+    """
+    Search stock price alerts like search, but have PostgreSQL encode the results.
+    Returns the JSON array as bytes, ready to send, with the number of alerts in it and the
+    last alert id. No row is converted to Python objects.
+    Raises ValueError for unknown fields or statuses.
+    """
+    logger.debug(
+        "Fetching alerts as JSON for user #%s and search_term: %s", user_id, search_term
+    )
+    query, params = search_json_query(
+        user_id, search_term, limit, after, fields, status
+    )
+
+    async with database.pool.connection() as conn, conn.cursor() as cur:
+        cur.adapters.register_loader("json", JsonBytesLoader)
+        with SEARCH_QUERY.time():
+            await cur.execute(query, params)
+            body, count, last_alert_id = await cur.fetchone()
+        logger.debug("Retrieved %d alerts", count)
+        return body, count, last_alert_id
+
+
+INSERT_ALERT = """
+    INSERT INTO alerts (user_id, ticker, price, direction, expired, expiration_time)
+    VALUES (%(user_id)s, %(ticker)s, %(price)s, %(direction)s, %(expired)s, %(expiration_time)s) RETURNING alert_id, price::float8;
+    """
+
+
+def to_row(alert: Alert, user_id: int) -> Dict[str, Any]:
+    """
+    Convert an alert Pydantic model to the plain dict of INSERT_ALERT parameters.
+    """
+    # Convert Pydantic model to plain dict and set 'expired' status
+    row = alert.model_dump()
+    row["user_id"] = user_id
+    if row["expiration_time"]:
+        row["expired"] = False
+    else:
+        row["expired"] = None
+    return row
+
+
+async def create(alert: Alert, user_id: int) -> int:
     """
     Create a new stock price alert.
     Note that the alert id will be automatically created in the database using SERIAL.
     """
     logger.debug("Creating alert...")
-
-    # Convert Pydantic model to plain dict and set 'expired' status
     logger.debug("Transforming alert Pydantic model to plain dict...")
-    alert = alert.model_dump()
-    alert["user_id"] = user_id
-    if alert["expiration_time"]:
-        alert["expired"] = False
-    else:
-        alert["expired"] = None
+    alert = to_row(alert, user_id)
 
     # Insert alert into the database
-    with database.connection.cursor() as cur:
-        cur.execute(
-            """
-                INSERT INTO alerts (user_id, ticker, price, direction, expired, expiration_time)
-                VALUES (%(user_id)s, %(ticker)s, %(price)s, %(direction)s, %(expired)s, %(expiration_time)s) RETURNING alert_id;
-                """,
-            alert,
-        )
-        database.connection.commit()
-        new_alert_id = cur.fetchone()[0]
+    async with database.pool.connection() as conn, conn.cursor() as cur:
+        with CREATE_QUERY.time():
+            await cur.execute(INSERT_ALERT, alert)
+            new_alert_id, stored_price = await cur.fetchone()
+            await events.publish(cur, "created", [(new_alert_id, user_id)])
+            await conn.commit()
         logger.debug("Created alert #%s for user %s", new_alert_id, user_id)
-        return new_alert_id
+    alert_cache.invalidate(user_id)
+    # Index the price as stored, since the database rounds it to two decimals
+    alert_index.add(new_alert_id, alert["ticker"], alert["direction"], stored_price)
+    shards.add(new_alert_id, alert["ticker"], alert["direction"], stored_price)
+    if alert["expiration_time"]:
+        expiry.schedule(alert["expiration_time"])
+    return new_alert_id
+
+
+async def create_many(
+    alerts: List[Alert], user_id: int, atomic: bool = True
+) -> Tuple[List[Optional[int]], Dict[int, str]]:
+    """
+    Create a batch of stock price alerts in a single transaction.
+    Rows are sent with a pipelined executemany, so the cost is one round trip per batch rather
+    than per alert. Returns the new alert ids in input order, and errors keyed by input index.
+    If atomic, a database error rolls back the whole batch and is raised as ValueError.
+    Otherwise the batch is retried row by row under savepoints, so that only failing rows are
+    skipped; their ids are None and their errors are reported.
+    """
+    logger.debug("Creating %d alerts...", len(alerts))
+    rows = [to_row(alert, user_id) for alert in alerts]
+    results: List[Optional[Tuple[int, float]]] = [None] * len(rows)
+    errors: Dict[int, str] = {}
+    if not rows:
+        return [], errors
+
+    async with database.pool.connection() as conn:
+        try:
+            async with conn.transaction(), conn.cursor() as cur:
+                with CREATE_MANY_QUERY.time():
+                    await cur.executemany(INSERT_ALERT, rows, returning=True)
+                    # executemany leaves one result set per row, in input order
+                    for index in range(len(rows)):
+                        results[index] = await cur.fetchone()
+                        cur.nextset()
+                await events.publish(cur, "created", ((r[0], user_id) for r in results))
+        except (postgres.errors.DataError, postgres.errors.IntegrityError) as e:
+            if atomic:
+                raise ValueError(e.diag.message_primary or str(e))
+            logger.debug("Batch insert failed, retrying row by row: %s", e)
+            results = [None] * len(rows)
+            async with conn.transaction(), conn.cursor() as cur:
+                for index, row in enumerate(rows):
+                    try:
+                        async with conn.transaction():
+                            await cur.execute(INSERT_ALERT, row)
+                            results[index] = await cur.fetchone()
+                    except (
+                        postgres.errors.DataError,
+                        postgres.errors.IntegrityError,
+                    ) as row_error:
+                        errors[index] = row_error.diag.message_primary or str(row_error)
+                await events.publish(
+                    cur, "created", ((r[0], user_id) for r in results if r is not None)
+                )
 
+    new_alert_ids: List[Optional[int]] = []
+    created = []
+    for row, result in zip(rows, results):
+        if result is None:
+            new_alert_ids.append(None)
+            continue
+        new_alert_id, stored_price = result
+        alert_index.add(new_alert_id, row["ticker"], row["direction"], stored_price)
+        created.append((new_alert_id, row["ticker"], row["direction"], stored_price))
+        if row["expiration_time"]:
+            expiry.schedule(row["expiration_time"])
+        new_alert_ids.append(new_alert_id)
+    shards.add_many(created)
+    if len(errors) < len(rows):
+        alert_cache.invalidate(user_id)
+    logger.debug("Created %d alerts for user %s", len(rows) - len(errors), user_id)
+    return new_alert_ids, errors
 
-def delete(id: int) -> None:
+
+async def delete(id: int) -> None:
     """
     Delete a stock price alert by id.
     """
     logger.debug("Deleting alert #%s...", id)
-    with database.connection.cursor() as cur:
-        cur.execute("DELETE FROM alerts WHERE alert_id = %s RETURNING alert_id;", (id,))
-        database.connection.commit()
+    async with database.pool.connection() as conn, conn.cursor() as cur:
+        with DELETE_QUERY.time():
+            await cur.execute(
+                "DELETE FROM alerts WHERE alert_id = %s RETURNING alert_id, ticker, direction, price::float8, user_id;",
+                (id,),
+            )
+            deleted = await cur.fetchall()
+            await events.publish(cur, "deleted", ((r[0], r[4]) for r in deleted))
+            await conn.commit()
+    alert_index.remove_many(deleted)
+    shards.remove_many(deleted)
+    alert_cache.invalidate_many(r[4] for r in deleted)
     logger.debug("Deletion successful")
 
 
-# THE EVALUATE FUNCTION WILL NOT WORK BECAUSE IT HAS NOT YET BEEN REFACTORED TO CONNECT TO MAIN.GO INSTEAD OF MARKET.PY
-def evaluate() -> None:
+DELETE_ALERTS = """
+    DELETE FROM alerts
+    WHERE alert_id = ANY(%s) AND user_id = %s
+    RETURNING alert_id, ticker, direction, price::float8;
+    """
+
+
+async def delete_many(
+    ids: List[int], user_id: int, atomic: bool = True
+) -> Tuple[List[int], Dict[int, str]]:
+    """
+    Delete a batch of a user's stock price alerts with a single set-based DELETE.
+    Returns the deleted ids in input order, and errors keyed by input index for ids that do not
+    exist or belong to another user. If atomic and any id fails, nothing is deleted and the
+    errors are raised as ValueError.
+    """
+    logger.debug("Deleting %d alerts...", len(ids))
+    errors: Dict[int, str] = {}
+    if not ids:
+        return [], errors
+
+    async with database.pool.connection() as conn, conn.cursor() as cur:
+        async with conn.transaction():
+            with DELETE_MANY_QUERY.time():
+                await cur.execute(DELETE_ALERTS, (ids, user_id))
+                deleted = await cur.fetchall()
+            deleted_ids = {row[0] for row in deleted}
+            for index, alert_id in enumerate(ids):
+                if alert_id not in deleted_ids:
+                    errors[index] = f"alert #{alert_id} not found"
+            # Raising inside the transaction block rolls back the deletions
+            if errors and atomic:
+                raise ValueError("; ".join(errors.values()))
+            await events.publish(cur, "deleted", ((r[0], user_id) for r in deleted))
+
+    alert_index.remove_many(deleted)
+    shards.remove_many(deleted)
+    if deleted:
+        alert_cache.invalidate(user_id)
+    logger.debug("Deleted %d alerts", len(deleted))
+    return [alert_id for alert_id in ids if alert_id in deleted_ids], errors
+
+
+# expired is NULL for alerts without an expiration time, so test IS NOT TRUE
+EVALUATE_ALERTS = """
+    SELECT ticker, array_agg(alert_id), array_agg(price::float8), array_agg(direction = 'above')
+    FROM alerts
+    WHERE triggered = false AND expired IS NOT TRUE
+    GROUP BY ticker;
+    """
+
+
+async def evaluate() -> Dict[str, int]:
     """
     Evaluate all alerts against stock prices to determine if alert should be triggered.
+    Prices for every distinct ticker are fetched concurrently, thresholds are compared in a
+    single vectorized pass, and all fired alerts are triggered with one set-based UPDATE.
+    Returns the number of alerts evaluated and triggered.
     """
-    # Fetch active, untriggered alerts from the database
-    with database.connection.cursor() as cur:
-        cur.execute(
-            """
-                SELECT alert_id, ticker, price, direction
-                FROM alerts
-                WHERE triggered = false AND expired = false;
-                """
-        )
-        alerts = cur.fetchall()
+    if shards.ENABLED:
+        return await evaluate_sharded()
+    if alert_index.ENABLED:
+        return await evaluate_indexed()
+
+    # Fetch active, untriggered alerts grouped by ticker, as one array per column
+    async with database.pool.connection() as conn, conn.cursor() as cur:
+        with EVALUATE_QUERY.time():
+            await cur.execute(EVALUATE_ALERTS)
+            groups = await cur.fetchall()
+
+    if not groups:
+        return {"alerts": 0, "triggered": 0}
 
-    # Avoid redundant API calls by caching stock prices
-    cache = {}
-    for id, ticker, price, direction in alerts:
-        # Get stock price (use cached value if available)
-        if ticker in cache:
-            stock_price = cache[ticker]
-        else:
-            stock_price = market.stock_price(ticker)
-            cache[ticker] = stock_price
+    # Flatten the per-ticker arrays into contiguous column arrays
+    tickers = [group[0] for group in groups]
+    counts = np.fromiter((len(group[1]) for group in groups), np.intp, len(groups))
+    total = int(counts.sum())
+    ids = np.fromiter(chain.from_iterable(g[1] for g in groups), np.int64, total)
+    thresholds = np.fromiter(
+        chain.from_iterable(g[2] for g in groups), np.float64, total
+    )
+    above = np.fromiter(chain.from_iterable(g[3] for g in groups), bool, total)
 
-        # Trigger alert if stock price meets condition
-        if (direction == "below" and price > stock_price) or (
-            direction == "above" and price < stock_price
-        ):
-            trigger(id)
+    # Look up each distinct ticker once, then broadcast prices back to every alert
+    quotes = await market.get_prices(tickers)
+    current = np.repeat(
+        np.array([quotes.get(ticker, np.nan) for ticker in tickers], np.float64),
+        counts,
+    )
 
+    # Trigger alert if stock price meets condition (comparisons against NaN are False,
+    # so alerts on tickers whose price could not be fetched never fire)
+    fired = np.where(above, current > thresholds, current < thresholds)
+    fired_ids = ids[fired].tolist()
+    logger.info(
+        "Evaluated %d alerts across %d tickers, %d fired",
+        len(ids),
+        len(tickers),
+        len(fired_ids),
+    )
 
-def trigger(id: int) -> None:
+    triggered = await trigger_many(fired_ids) if fired_ids else 0
+    return {"alerts": len(ids), "triggered": triggered}
+
+
+async def evaluate_indexed() -> Dict[str, int]:
+    """
+    Evaluate alerts through the in-memory price-crossing index instead of scanning the table.
+    The index is rebuilt when due, to pick up alerts created or deleted by other workers.
+    """
+    if alert_index.reload_due():
+        await alert_index.load()
+    tickers = list(alert_index.tickers)
+    if not tickers:
+        return {"alerts": 0, "triggered": 0}
+    evaluated = alert_index.stats()["alerts"]
+
+    quotes = await market.get_prices(tickers)
+    fired = {
+        ticker: alert_index.match(ticker, price) for ticker, price in quotes.items()
+    }
+    fired_ids = [alert_id for ids in fired.values() for alert_id in ids]
+    logger.info(
+        "Evaluated %d indexed alerts across %d tickers, %d fired",
+        evaluated,
+        len(tickers),
+        len(fired_ids),
+    )
+
+    triggered = await trigger_many(fired_ids) if fired_ids else 0
+    # Fired alerts are either triggered now or were already inactive, so none can fire again
+    for ticker, ids in fired.items():
+        if ids:
+            alert_index.remove_fired(ticker, set(ids))
+    return {"alerts": evaluated, "triggered": triggered}
+
+
+async def evaluate_sharded() -> Dict[str, int]:
+    """
+    Evaluate alerts in the shard processes (see src/shards.py), triggering what they fire.
+    """
+    await shards.ensure_started()
+    if shards.reload_due():
+        await shards.load()
+    tickers = shards.all_tickers()
+    if not tickers:
+        return {"alerts": 0, "triggered": 0}
+    evaluated = shards.stats()["alerts"]
+
+    quotes = await market.get_prices(tickers)
+    fired_ids = await shards.evaluate(quotes)
+    logger.info(
+        "Evaluated %d sharded alerts across %d tickers, %d fired",
+        evaluated,
+        len(tickers),
+        len(fired_ids),
+    )
+
+    # Fired alerts are either triggered now or were already inactive, so none can fire again
+    triggered = await trigger_many(fired_ids.tolist()) if len(fired_ids) else 0
+    shards.drop(fired_ids)
+    return {"alerts": evaluated, "triggered": triggered}
+
+
+TRIGGER_ALERTS = """
+    UPDATE alerts
+    SET triggered = true, triggered_time = %s, expired = NULL, expiration_time = NULL
+    WHERE alert_id = ANY(%s) AND triggered = false AND expired IS NOT TRUE
+    RETURNING alert_id, ticker, direction, price::float8, user_id;
+    """
+
+
+async def trigger_many(ids: List[int]) -> int:
+    """
+    Trigger a batch of alerts by id in a single transaction.
+    Alerts that were triggered, expired or deleted in the meantime are skipped.
+    Returns the number of alerts triggered.
+    """
+    logger.debug("Triggering %d alerts...", len(ids))
+    async with database.pool.connection() as conn, conn.cursor() as cur:
+        trigger_time = datetime.now(timezone.utc)
+        async with conn.transaction():
+            with TRIGGER_MANY_QUERY.time():
+                await cur.execute(TRIGGER_ALERTS, (trigger_time, ids))
+                triggered = await cur.fetchall()
+            await events.publish(cur, "triggered", ((r[0], r[4]) for r in triggered))
+    alert_index.remove_many(triggered)
+    shards.remove_many(triggered)
+    alert_cache.invalidate_many(r[4] for r in triggered)
+    logger.debug("%d alerts triggered at %s", len(triggered), trigger_time)
+    return len(triggered)
+
+
+async def trigger(id: int) -> None:
     """
     Triggers an alert based on its id.
     """
     logger.debug("Triggering alert #%s...", id)
-    with database.connection.cursor() as cur:
+    async with database.pool.connection() as conn, conn.cursor() as cur:
         trigger_time = datetime.now(timezone.utc)
-        cur.execute(
-            """
-                UPDATE alerts
-                SET triggered = true, triggered_time = %s, expired = NULL, expiration_time = NULL
-                WHERE alert_id = %s;
-                """,
-            (trigger_time, id),
-        )
-        database.connection.commit()
+        with TRIGGER_QUERY.time():
+            await cur.execute(
+                """
+                    UPDATE alerts
+                    SET triggered = true, triggered_time = %s, expired = NULL, expiration_time = NULL
+                    WHERE alert_id = %s
+                    RETURNING alert_id, ticker, direction, price::float8, user_id;
+                    """,
+                (trigger_time, id),
+            )
+            triggered = await cur.fetchall()
+        await events.publish(cur, "triggered", ((r[0], r[4]) for r in triggered))
+        await conn.commit()
+    alert_index.remove_many(triggered)
+    shards.remove_many(triggered)
+    alert_cache.invalidate_many(r[4] for r in triggered)
     logger.debug("Alert triggered at %s", trigger_time)
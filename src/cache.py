@@ -0,0 +1,164 @@
+"""
+In-process TTL/LRU cache with request coalescing for upstream responses.
+
+Entries expire after a per-entry time-to-live and the least recently used entry is evicted once
+the cache is full: over its entry count or, for caches given a weigh function, over its total
+weight (e.g. approximate bytes). Expired entries are dropped when found by get or at the least
+recently used end by set, unless max_stale allows get_stale to serve them for that many seconds
+past their expiry. Concurrent misses for the same key share a single upstream fetch
+(single-flight), so a burst of identical requests results in one call to the upstream service.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """
+    Bounded cache mapping keys to (expiry, value, weight) in least-recently-used order.
+    Values weighing more than max_weight on their own are not cached.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        max_weight: int = 0,
+        weigh: Optional[Callable[[Any], int]] = None,
+        max_stale: float = 0,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_weight = max_weight
+        self.weigh = weigh
+        self.max_stale = max_stale
+        self.weight = 0
+        self._stores = 0
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any, int]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        Look up a fresh entry. Returns (found, value) and updates hit/miss counters.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value, _ = entry
+            now = time.monotonic()
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, value
+            # Stale entries are kept for get_stale, if enabled, until too old
+            if now - expires_at > self.max_stale:
+                self._remove(key)
+        self.misses += 1
+        return False, None
+
+    def get_stale(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        Look up an entry whether or not it has expired, without updating counters or recency.
+        Used to fall back on old data when the upstream service is failing.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        if time.monotonic() - entry[0] > self.max_stale:
+            self._remove(key)
+            return False, None
+        return True, entry[1]
+
+    def _remove(self, key: Hashable) -> None:
+        self.weight -= self._entries.pop(key)[2]
+
+    def set(self, key: Hashable, value: Any, ttl: float) -> None:
+        """
+        Store a value for ttl seconds, evicting least recently used entries if full.
+        """
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        weight = self.weigh(value) if self.weigh is not None else 0
+        if self.max_weight and weight > self.max_weight:
+            return
+        if key in self._entries:
+            self._remove(key)
+        now = time.monotonic()
+        self._entries[key] = (now + ttl, value, weight)
+        self.weight += weight
+        while len(self._entries) > self.max_entries or (
+            self.max_weight and self.weight > self.max_weight
+        ):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+        # Drop entries too stale to serve from the least recently used end, and from
+        # everywhere once per max_entries stores, which keeps the cost per store constant
+        while self._entries:
+            oldest = next(iter(self._entries))
+            if now - self._entries[oldest][0] <= self.max_stale:
+                break
+            self._remove(oldest)
+        self._stores += 1
+        if self._stores >= self.max_entries:
+            self._stores = 0
+            for stale in [
+                key
+                for key, (expires_at, _, _) in self._entries.items()
+                if now - expires_at > self.max_stale
+            ]:
+                self._remove(stale)
+
+    def clear(self) -> None:
+        """
+        Drop every entry. Fetches in flight still complete and store their results.
+        """
+        self._entries.clear()
+        self.weight = 0
+
+    async def get_or_fetch(
+        self, key: Hashable, fetch: Callable[[], Awaitable[Any]], ttl: float
+    ) -> Any:
+        """
+        Return the cached value for key, or await fetch() to produce it.
+        Concurrent callers missing on the same key await the same fetch. Failed fetches are
+        not cached, and their exception is raised to every waiting caller.
+        """
+        found, value = self.get(key)
+        if found:
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(fetch())
+            self._inflight[key] = task
+
+            def _store(done: asyncio.Future) -> None:
+                self._inflight.pop(key, None)
+                if not done.cancelled() and done.exception() is None:
+                    self.set(key, done.result(), ttl)
+
+            task.add_done_callback(_store)
+
+        # Shield so that one disconnecting caller does not cancel the fetch for the others
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Report cache counters and occupancy.
+        """
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "weight": self.weight,
+            "max_weight": self.max_weight,
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "coalesced": self.coalesced,
+        }
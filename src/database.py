@@ -1,45 +1,80 @@
 """
-Provides functions for opening and closing a PostgreSQL connection.
+Provides functions for opening and closing a pool of PostgreSQL connections.
 
-Used with FastAPI lifecycle events to open the connection on API startup and close it on shutdown,
-instead of reconnecting on every request.
+Used with FastAPI lifecycle events to open the pool on API startup and close it on shutdown,
+instead of reconnecting on every request. Each database operation borrows a connection from
+the pool for the duration of the call, so concurrent requests are no longer serialized on a
+single socket.
 
 See: https://www.postgresql.org/docs/current/libpq-connect.html#LIBPQ-CONNSTRING
-for connection string format.
+for connection string format, and https://www.psycopg.org/psycopg3/docs/advanced/pool.html
+for pool behaviour.
 """
 
 import os
-import psycopg as postgres
+from typing import Dict
+from psycopg_pool import AsyncConnectionPool
+from src import metrics
 from src.logging import logger
 
 # Initialize to satisfy module scope before first use
-connection = None
+pool = None
 
+# Pool configuration, tunable through the environment
+POOL_MIN_SIZE = int(os.getenv("DATABASE_POOL_MIN_SIZE", "2"))
+POOL_MAX_SIZE = int(os.getenv("DATABASE_POOL_MAX_SIZE", "10"))
+POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "10"))  # Seconds to wait
+POOL_MAX_LIFETIME = float(os.getenv("DATABASE_POOL_MAX_LIFETIME", "3600"))  # Seconds
+POOL_MAX_IDLE = float(os.getenv("DATABASE_POOL_MAX_IDLE", "600"))  # Seconds
 
-def init() -> None:
+
+def conninfo() -> str:
     """
-    Open a connection to our portfolio_insights database on API startup.
+    Build the connection string for our portfolio_insights database from the environment.
     """
-    global connection
     host = os.getenv("DATABASE_HOST")
     port = os.getenv("DATABASE_PORT")
     dbname = os.getenv("DATABASE_NAME")
     username = os.getenv("DATABASE_USERNAME")
     password = os.getenv("DATABASE_PASSWORD")
+    return (
+        f"host={host} port={port} dbname={dbname} user={username} password={password}"
+    )
 
-    logger.info(f'Connecting to DB "{dbname}": {host}:{port}')
 
-    dsn = f"host={host} port={port} dbname={dbname} user={username} password={password}"
-    connection = postgres.connect(dsn)
+async def init() -> None:
+    """
+    Open a pool of connections to our portfolio_insights database on API startup.
+    """
+    global pool
+    logger.info(
+        f'Connecting to DB "{os.getenv("DATABASE_NAME")}": '
+        f'{os.getenv("DATABASE_HOST")}:{os.getenv("DATABASE_PORT")} '
+        f"(pool size {POOL_MIN_SIZE}-{POOL_MAX_SIZE})"
+    )
 
+    pool = AsyncConnectionPool(
+        conninfo(),
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
+        timeout=POOL_TIMEOUT,
+        max_lifetime=POOL_MAX_LIFETIME,
+        max_idle=POOL_MAX_IDLE,
+        # Verify a connection is still alive before handing it out, so that connections
+        # dropped by the server or a proxy are recycled instead of failing a request
+        check=AsyncConnectionPool.check_connection,
+        open=False,
+    )
+    await pool.open(wait=True, timeout=POOL_TIMEOUT)
 
-def ping() -> bool:
+
+async def ping() -> bool:
     """
     Health check for testing API connection to database.
     """
     try:
-        with connection.cursor() as cur:
-            cur.execute("SELECT 1")
+        async with pool.connection() as conn:
+            await conn.execute("SELECT 1")
         logger.info("Database ping succeeded")
         return True
     except Exception as e:
@@ -47,11 +82,24 @@ def ping() -> bool:
         return False
 
 
-def close() -> None:
+async def close() -> None:
+    """
+    Close database connection pool on API shutdown.
+    """
+    global pool
+    logger.info("Closing database connection pool")
+    if pool:
+        await pool.close()
+        pool = None
+
+
+def pool_stats() -> Dict[str, int]:
     """
-    Close database connection on API shutdown.
+    Report connection pool occupancy, e.g. pool_size, pool_available and requests_waiting.
     """
-    global connection
-    logger.info("Closing database connection")
-    if connection:
-        connection.close()
+    return pool.get_stats() if pool else {}
+
+
+metrics.CallbackGauge(
+    "db_pool", "Database connection pool occupancy and counters", "stat", pool_stats
+)
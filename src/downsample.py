@@ -0,0 +1,113 @@
+"""
+Reduces price histories to a fixed number of points for charting.
+
+LTTB (Largest-Triangle-Three-Buckets) keeps the bars that best preserve the visual shape of a
+line chart, and returns them unchanged. OHLC bucketing aggregates consecutive bars into
+open/high/low/close candles. Bars are assumed evenly spaced, so their position in the series
+is used as the x coordinate instead of parsing dates.
+
+See: https://skemman.is/bitstream/1946/15343/3/SS_MSthesis.pdf
+"""
+
+from typing import Any, Dict, List
+import numpy as np
+
+METHODS = ("lttb", "ohlc")
+
+
+def bucket_edges(n: int, buckets: int) -> np.ndarray:
+    """
+    Split n bars into contiguous, near-equal buckets, returning buckets + 1 boundaries.
+    """
+    return np.linspace(0, n, buckets + 1).astype(np.int64)
+
+
+def prices_of(history: List[Dict[str, Any]]) -> np.ndarray:
+    return np.fromiter(
+        (bar["price"] for bar in history), dtype=np.float64, count=len(history)
+    )
+
+
+def lttb_indices(y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Indices of the points selected by LTTB, always including the first and last.
+    Each bucket is scored in one vectorized step; only the walk across buckets is sequential,
+    because each choice depends on the point selected in the previous bucket.
+    """
+    n = len(y)
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+
+    # The first and last points are fixed, so the interior is split into the remaining buckets
+    edges = bucket_edges(n - 2, max_points - 2) + 1
+    starts, ends = edges[:-1], edges[1:]
+    # Centroid of each bucket, and of the single last point after the final bucket
+    sums = np.add.reduceat(y[1 : n - 1], starts - 1)
+    counts = ends - starts
+    next_x = np.append((starts + ends - 1) / 2, n - 1)[1:]
+    next_y = np.append(sums / counts, y[-1])[1:]
+    x = np.arange(n, dtype=np.float64)
+
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for bucket, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        cx, cy = next_x[bucket], next_y[bucket]
+        ax, ay = x[a], y[a]
+        # Twice the area of the triangle (a, candidate, next bucket centroid)
+        areas = np.abs(
+            (ax - cx) * (y[start:end] - ay) - (ax - x[start:end]) * (cy - ay)
+        )
+        a = start + int(areas.argmax())
+        selected[bucket + 1] = a
+    return selected
+
+
+def lttb(history: List[Dict[str, Any]], max_points: int) -> List[Dict[str, Any]]:
+    """
+    Downsample a price history to at most max_points bars for a line chart.
+    """
+    if len(history) <= max_points:
+        return history
+    indices = lttb_indices(prices_of(history), max_points)
+    return [history[i] for i in indices.tolist()]
+
+
+def ohlc(history: List[Dict[str, Any]], max_points: int) -> List[Dict[str, Any]]:
+    """
+    Aggregate a price history into at most max_points candles, each dated by its first bar.
+    """
+    n = len(history)
+    if n == 0:
+        return []
+    y = prices_of(history)
+    edges = bucket_edges(n, min(max_points, n))
+    starts, ends = edges[:-1], edges[1:]
+    columns = zip(
+        starts.tolist(),
+        y[starts].tolist(),
+        np.maximum.reduceat(y, starts).tolist(),
+        np.minimum.reduceat(y, starts).tolist(),
+        y[ends - 1].tolist(),
+    )
+    return [
+        {
+            "date": history[start]["date"],
+            "open": open_,
+            "high": high,
+            "low": low,
+            "close": close,
+        }
+        for start, open_, high, low, close in columns
+    ]
+
+
+def downsample(
+    history: List[Dict[str, Any]], max_points: int, method: str
+) -> List[Dict[str, Any]]:
+    """
+    Downsample a price history with the named method, one of METHODS.
+    """
+    if method == "ohlc":
+        return ohlc(history, max_points)
+    return lttb(history, max_points)
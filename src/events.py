@@ -0,0 +1,205 @@
+"""
+Pushes alert trigger and expiry events to subscribed clients as Server-Sent Events.
+
+Events are published with PostgreSQL NOTIFY inside the transaction that changes the alerts, so
+they are only delivered once that transaction commits. Every worker LISTENs on a dedicated
+connection and fans each notification out to its local subscribers for that user, so a client
+receives events no matter which worker made the change.
+
+Creations and deletions are published on the same channel, so that every worker can invalidate
+its cached alert listings (see src/alert_cache.py), but only trigger and expiry events are
+streamed to clients.
+
+Each subscriber has a bounded send buffer. A client too slow to drain it is sent a final
+"overflow" event and disconnected, and should refetch its alerts after reconnecting.
+
+See: https://www.postgresql.org/docs/current/sql-notify.html
+and https://html.spec.whatwg.org/multipage/server-sent-events.html
+"""
+
+import asyncio
+import json
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, Iterable, List, Set, Tuple
+import psycopg as postgres
+from src import alert_cache, database, metrics
+from src.logging import logger
+
+CHANNEL = "alert_events"
+BUFFER_SIZE = int(os.getenv("EVENTS_BUFFER_SIZE", "64"))  # Events per subscriber
+KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", "15"))  # Seconds between keepalives
+RECONNECT_DELAY = 5.0  # Seconds before re-establishing a failed LISTEN connection
+
+# Event types sent to clients; the others only invalidate cached listings
+STREAMED_EVENTS = ("triggered", "expired")
+
+# NOTIFY payloads must stay under 8000 bytes, so long id lists are split across messages
+MAX_IDS_PER_MESSAGE = 500
+
+# Initialize to satisfy module scope before first use
+task = None
+
+
+class Subscriber:
+    """
+    A single streaming client with a bounded queue of encoded events.
+    """
+
+    __slots__ = ("queue", "overflowed")
+
+    def __init__(self) -> None:
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=BUFFER_SIZE)
+        self.overflowed = False
+
+
+# Keyed by user id
+subscribers: Dict[int, Set[Subscriber]] = defaultdict(set)
+
+
+def subscribe(user_id: int) -> Subscriber:
+    subscriber = Subscriber()
+    subscribers[user_id].add(subscriber)
+    return subscriber
+
+
+def unsubscribe(user_id: int, subscriber: Subscriber) -> None:
+    user_subscribers = subscribers.get(user_id)
+    if user_subscribers is not None:
+        user_subscribers.discard(subscriber)
+        if not user_subscribers:
+            del subscribers[user_id]
+
+
+def dispatch(payload: str) -> None:
+    """
+    Invalidate the cached listings of a notification payload's user, and deliver it to their
+    local subscribers.
+    """
+    try:
+        event = json.loads(payload)
+        alert_cache.invalidate(event["user_id"])
+        user_subscribers = subscribers.get(event["user_id"])
+    except (ValueError, KeyError, TypeError):
+        logger.warning("Ignoring malformed alert event: %s", payload)
+        return
+    if not user_subscribers or event.get("type") not in STREAMED_EVENTS:
+        return
+
+    # Encode once and share the same message across all of the user's subscribers
+    message = f"event: {event['type']}\ndata: {payload}\n\n"
+    for subscriber in user_subscribers:
+        try:
+            subscriber.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            subscriber.overflowed = True
+
+
+async def stream(user_id: int) -> AsyncIterator[str]:
+    """
+    Yield Server-Sent Events for a user until the client disconnects.
+    """
+    subscriber = subscribe(user_id)
+    try:
+        yield ": connected\n\n"
+        while True:
+            try:
+                message = await asyncio.wait_for(subscriber.queue.get(), KEEPALIVE)
+            except asyncio.TimeoutError:
+                # Comment lines keep idle connections open through proxies
+                yield ": keepalive\n\n"
+                continue
+            yield message
+            if subscriber.overflowed and subscriber.queue.empty():
+                yield "event: overflow\ndata: {}\n\n"
+                return
+    finally:
+        unsubscribe(user_id, subscriber)
+
+
+async def publish(
+    cur: postgres.AsyncCursor, event_type: str, rows: Iterable[Tuple[int, int]]
+) -> None:
+    """
+    Queue notifications for (alert_id, user_id) rows on the cursor's current transaction.
+    They are delivered to listeners when the transaction commits.
+    """
+    alert_ids: Dict[int, List[int]] = defaultdict(list)
+    for alert_id, user_id in rows:
+        alert_ids[user_id].append(alert_id)
+    if not alert_ids:
+        return
+
+    time = datetime.now(timezone.utc).isoformat()
+    params = [
+        (
+            CHANNEL,
+            json.dumps(
+                {
+                    "type": event_type,
+                    "user_id": user_id,
+                    "alert_ids": ids[start : start + MAX_IDS_PER_MESSAGE],
+                    "time": time,
+                }
+            ),
+        )
+        for user_id, ids in alert_ids.items()
+        for start in range(0, len(ids), MAX_IDS_PER_MESSAGE)
+    ]
+    await cur.executemany("SELECT pg_notify(%s, %s)", params)
+
+
+async def listen() -> None:
+    """
+    Relay notifications to local subscribers, reconnecting if the connection drops.
+    """
+    while True:
+        try:
+            async with await postgres.AsyncConnection.connect(
+                database.conninfo(), autocommit=True
+            ) as conn:
+                await conn.execute(f"LISTEN {CHANNEL}")
+                # Changes made while not listening were missed
+                alert_cache.discard()
+                logger.info("Listening for alert events")
+                async for notify in conn.notifies():
+                    dispatch(notify.payload)
+        except Exception:
+            logger.exception("Alert event listener failed, reconnecting")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+
+def start() -> None:
+    """
+    Start relaying alert events on API startup.
+    """
+    global task
+    task = asyncio.create_task(listen())
+
+
+async def stop() -> None:
+    """
+    Stop relaying alert events on API shutdown.
+    """
+    global task
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        task = None
+
+
+def stats() -> Dict[str, int]:
+    """
+    Report local subscriber counts.
+    """
+    return {
+        "users": len(subscribers),
+        "subscribers": sum(len(entry) for entry in subscribers.values()),
+    }
+
+
+metrics.CallbackGauge("alert_events", "Alert event subscribers", "stat", stats)
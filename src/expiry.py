@@ -0,0 +1,226 @@
+"""
+Expires alerts whose expiration time has passed, on an asyncio task within the FastAPI app
+lifetime.
+
+Upcoming expiration times are kept in an in-memory min-heap, and the task sleeps until the
+earliest one. On waking it expires every due alert with set-based UPDATEs of up to
+EXPIRY_BATCH_SIZE rows, located through the partial index on pending expirations (see
+sql/migrations/002_add_alert_expiry_index.sql), and publishes "expired" events in the same
+transaction. No query runs between deadlines.
+
+The heap holds at most EXPIRY_HEAP_SIZE of the earliest deadlines. It is reloaded from the
+database every EXPIRY_RELOAD_INTERVAL seconds, and when it runs dry. Alerts created through this
+worker are added as they are created, so only alerts created by other workers can be expired up
+to one reload interval late. Every reload, including the first on startup, begins with a
+catch-up sweep of everything already due.
+
+Several workers can sweep at once: due rows are claimed with FOR UPDATE SKIP LOCKED, so each
+alert is expired, and its event published, exactly once.
+
+Deadlines are compared against this worker's clock both when taken off the heap and in the
+sweep's UPDATE, so every deadline taken off the heap is covered by the sweep it triggers. When
+a sweep expires fewer alerts than deadlines came due, some were deleted or triggered meanwhile,
+or skipped while another worker's sweep held them, so one more sweep runs EXPIRY_RETRY_DELAY
+seconds later in case that sweep rolled back.
+"""
+
+import asyncio
+import heapq
+import math
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+from src import alert_cache, alert_index, database, events, metrics, shards
+from src.logging import logger
+
+ENABLED = os.getenv("EXPIRY_ENABLED", "true").lower() in ("1", "true", "yes")
+BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", "10000"))  # Alerts per UPDATE
+HEAP_SIZE = int(os.getenv("EXPIRY_HEAP_SIZE", "10000"))  # Deadlines held in memory
+RELOAD_INTERVAL = float(os.getenv("EXPIRY_RELOAD_INTERVAL", "60"))  # Seconds
+# Seconds before retrying a failed sweep, or a sweep that expired fewer alerts than came due
+RETRY_DELAY = float(os.getenv("EXPIRY_RETRY_DELAY", "5"))
+
+SWEEP_QUERY = metrics.db_query("expiry.sweep")
+LOAD_QUERY = metrics.db_query("expiry.load")
+
+# Both queries match the predicate of the partial index on pending expirations
+# The cutoff is passed in rather than taken from now(), so that it matches the worker's heap
+# The batch's ids are collected into an array so the UPDATE finds them through the primary key;
+# with IN (...), the planner hash-joins the batch against a sequential scan of the table
+EXPIRE_DUE = """
+    UPDATE alerts
+    SET expired = true, update_time = now()
+    WHERE alert_id = ANY(ARRAY(
+        SELECT alert_id FROM alerts
+        WHERE expired = false AND triggered = false AND expiration_time <= %s
+        ORDER BY expiration_time
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    ))
+    RETURNING alert_id, ticker, direction, price::float8, user_id;
+    """
+UPCOMING_DEADLINES = """
+    SELECT expiration_time FROM alerts
+    WHERE expired = false AND triggered = false
+    ORDER BY expiration_time
+    LIMIT %s;
+    """
+
+# Initialize to satisfy module scope before first use
+task = None
+wakeup = None
+
+# Min-heap of upcoming expiration times, as Unix timestamps
+deadlines: List[float] = []
+# Whether deadlines later than those in the heap were left in the database
+truncated = False
+counters = {"sweeps": 0, "expired": 0, "reloads": 0, "failures": 0}
+
+
+def schedule(expiration_time: datetime) -> None:
+    """
+    Add the expiration time of a newly created alert, waking the task if it is the earliest.
+    """
+    global truncated
+    if task is None:
+        return
+    deadline = expiration_time.timestamp()
+    heapq.heappush(deadlines, deadline)
+    if deadlines[0] == deadline:
+        wakeup.set()
+    if len(deadlines) > 2 * HEAP_SIZE:
+        # Later deadlines are found again on the next reload
+        deadlines[:] = heapq.nsmallest(HEAP_SIZE, deadlines)
+        truncated = True
+
+
+async def expire_batch(cutoff: datetime) -> int:
+    """
+    Expire up to BATCH_SIZE alerts due by the cutoff in one transaction. Returns the number
+    expired.
+    """
+    async with database.pool.connection() as conn, conn.cursor() as cur:
+        async with conn.transaction():
+            with SWEEP_QUERY.time():
+                await cur.execute(EXPIRE_DUE, (cutoff, BATCH_SIZE))
+                expired = await cur.fetchall()
+            await events.publish(cur, "expired", ((r[0], r[4]) for r in expired))
+    alert_index.remove_many(expired)
+    shards.remove_many(expired)
+    alert_cache.invalidate_many(r[4] for r in expired)
+    return len(expired)
+
+
+async def sweep(now: float) -> int:
+    """
+    Expire every alert due by now, a Unix timestamp, one batch at a time. Returns the number
+    expired.
+    """
+    cutoff = datetime.fromtimestamp(now, timezone.utc)
+    total = 0
+    while True:
+        count = await expire_batch(cutoff)
+        total += count
+        if count < BATCH_SIZE:
+            break
+    counters["sweeps"] += 1
+    counters["expired"] += total
+    if total:
+        logger.info("Expired %d alerts", total)
+    return total
+
+
+async def reload() -> None:
+    """
+    Catch up on due alerts, then replace the heap with the earliest upcoming deadlines.
+    """
+    global truncated
+    await sweep(time.time())
+    async with database.pool.connection() as conn, conn.cursor() as cur:
+        with LOAD_QUERY.time():
+            await cur.execute(UPCOMING_DEADLINES, (HEAP_SIZE,))
+            rows = await cur.fetchall()
+    # Rows arrive sorted, which is already a valid heap
+    deadlines[:] = [row[0].timestamp() for row in rows]
+    truncated = len(rows) == HEAP_SIZE
+    counters["reloads"] += 1
+
+
+async def run() -> None:
+    """
+    Sleep until the next deadline or reload, and expire due alerts, until cancelled.
+    """
+    next_reload = 0.0
+    retry_at = math.inf
+    while True:
+        try:
+            # Reload early if the heap ran dry with more deadlines left in the database
+            if time.time() >= next_reload or (truncated and not deadlines):
+                await reload()
+                next_reload = time.time() + RELOAD_INTERVAL
+
+            # Cleared before computing the timeout, so a schedule() call is never missed
+            wakeup.clear()
+            wake_at = min(
+                deadlines[0] if deadlines else math.inf, next_reload, retry_at
+            )
+            try:
+                await asyncio.wait_for(wakeup.wait(), max(0.0, wake_at - time.time()))
+            except asyncio.TimeoutError:
+                pass
+
+            now = time.time()
+            due = 0
+            while deadlines and deadlines[0] <= now:
+                heapq.heappop(deadlines)
+                due += 1
+            if due or retry_at <= now:
+                expired = await sweep(now)
+                # Retried once only, since deleted or triggered alerts never expire
+                retry_at = now + RETRY_DELAY if expired < due else math.inf
+        except Exception:
+            counters["failures"] += 1
+            logger.exception("Alert expiry sweep failed")
+            await asyncio.sleep(RETRY_DELAY)
+
+
+def start() -> None:
+    """
+    Start the expiry task on API startup.
+    """
+    global task, wakeup
+    logger.info("Starting alert expiry (reload every %.0fs)", RELOAD_INTERVAL)
+    wakeup = asyncio.Event()
+    task = asyncio.create_task(run())
+
+
+async def stop() -> None:
+    """
+    Cancel the expiry task on API shutdown.
+    """
+    global task
+    if task is not None:
+        logger.info("Stopping alert expiry")
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        task = None
+    deadlines.clear()
+
+
+def stats() -> Dict[str, Any]:
+    """
+    Report expiry counters and the next deadline.
+    """
+    return {
+        "enabled": ENABLED,
+        "pending": len(deadlines),
+        "next_deadline": deadlines[0] if deadlines else None,
+        **counters,
+    }
+
+
+metrics.CallbackGauge("alert_expiry", "Alert expiry counters", "stat", lambda: counters)
@@ -1,8 +1,121 @@
+"""
+App-wide logger configuration.
+
+Log calls only enqueue records: a background QueueListener thread formats them and writes them
+to stderr, so log I/O never blocks the event loop or a request thread. Output is one JSON object
+per line by default (LOG_FORMAT=text for human-readable lines), and the level comes from
+LOG_LEVEL.
+
+High-volume call sites are rate-limited: each call site (file and line) may emit LOG_RATE_LIMIT
+records per second, with bursts of up to LOG_RATE_BURST. Dropped records are counted and the
+count is attached to the next record that gets through. Warnings and errors are never dropped.
+"""
+
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Records per second per call site, and the largest burst allowed above that rate
+RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", "10"))
+RATE_BURST = float(os.getenv("LOG_RATE_BURST", "50"))
+
+TEXT_FORMAT = (
+    "%(asctime)s [%(levelname)s] %(name)s (%(filename)s:%(lineno)d): %(message)s"
+)
+
+# Attributes present on every LogRecord; anything else was passed through extra=
+STANDARD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Format records as single-line JSON objects, including any extra= fields.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "location": f"{record.filename}:{record.lineno}",
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token-bucket rate limit per call site. Records at WARNING and above always pass.
+    """
+
+    def __init__(self, rate: float, burst: float) -> None:
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        # (pathname, lineno) -> [tokens, last refill time, suppressed count]
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            if bucket[2]:
+                record.suppressed = bucket[2]
+                bucket[2] = 0
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves all formatting to the listener thread.
+    The queue is in-process, so records do not need to be made picklable first.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(
+    JSONFormatter() if FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+)
+
+log_queue = queue.SimpleQueue()
+queue_handler = DeferredQueueHandler(log_queue)
+queue_handler.addFilter(RateLimitFilter(RATE_LIMIT, RATE_BURST))
+
+logging.basicConfig(level=LEVEL, handlers=[queue_handler])
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s [%(levelname)s] %(name)s (%(filename)s:%(lineno)d): %(message)s",
+listener = logging.handlers.QueueListener(
+    log_queue, stream_handler, respect_handler_level=True
 )
+listener.start()
+# Flush queued records on interpreter exit
+atexit.register(listener.stop)
 
 logger = logging.getLogger("portfolio_insights")
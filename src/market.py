@@ -0,0 +1,492 @@
+"""
+Provides a shared HTTP client for the Go market microservice.
+
+Used with FastAPI lifecycle events to open the client on API startup and close it on shutdown,
+so that every market call reuses pooled keep-alive connections instead of opening a new TCP
+connection per request.
+
+See: https://www.python-httpx.org/advanced/resource-limits/
+and https://www.python-httpx.org/advanced/timeouts/ for the tunables below.
+"""
+
+import asyncio
+import os
+import time
+import httpx
+from fastapi.responses import StreamingResponse
+from datetime import date, timedelta
+from src import downsample, metrics, price_store
+from src.cache import TTLCache
+from src.resilience import CircuitBreaker, CircuitOpenError, LatencyTracker, RateWindow
+from src.logging import logger
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+)
+
+# Initialize to satisfy module scope before first use
+client = None
+
+# Client configuration, tunable through the environment
+POOL_SIZE = int(os.getenv("MARKET_POOL_SIZE", "100"))
+KEEPALIVE_CONNECTIONS = int(os.getenv("MARKET_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("MARKET_KEEPALIVE_EXPIRY", "30"))  # Seconds
+CONNECT_TIMEOUT = float(os.getenv("MARKET_CONNECT_TIMEOUT", "2"))  # Seconds
+READ_TIMEOUT = float(os.getenv("MARKET_READ_TIMEOUT", "10"))  # Seconds
+HTTP2 = os.getenv("MARKET_HTTP2", "false").lower() in ("1", "true", "yes")
+
+# Latency tracking, hedging and adaptive timeouts
+LATENCY_WINDOW = int(os.getenv("MARKET_LATENCY_WINDOW", "256"))  # Samples per endpoint
+MIN_SAMPLES = 20  # Before percentiles are trusted
+HEDGE_ENABLED = os.getenv("MARKET_HEDGE_ENABLED", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+HEDGE_PERCENTILE = float(os.getenv("MARKET_HEDGE_PERCENTILE", "95"))
+HEDGE_MAX_RATIO = float(os.getenv("MARKET_HEDGE_MAX_RATIO", "0.1"))
+TIMEOUT_MULTIPLIER = float(os.getenv("MARKET_TIMEOUT_MULTIPLIER", "3"))  # Times p99
+MIN_READ_TIMEOUT = float(os.getenv("MARKET_MIN_READ_TIMEOUT", "1"))  # Seconds
+
+# Circuit breaker, and serving expired cache entries while the market service is failing
+BREAKER_WINDOW = int(os.getenv("MARKET_BREAKER_WINDOW", "50"))  # Requests
+BREAKER_MIN_REQUESTS = int(os.getenv("MARKET_BREAKER_MIN_REQUESTS", "20"))
+BREAKER_FAILURE_RATE = float(os.getenv("MARKET_BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_COOLDOWN = float(os.getenv("MARKET_BREAKER_COOLDOWN", "30"))  # Seconds
+SERVE_STALE = os.getenv("MARKET_SERVE_STALE", "true").lower() in ("1", "true", "yes")
+
+# Price history cache configuration
+STOCKS_CACHE_MAX_ENTRIES = int(os.getenv("STOCKS_CACHE_MAX_ENTRIES", "2048"))
+STOCKS_CACHE_MAX_BYTES = int(
+    os.getenv("STOCKS_CACHE_MAX_BYTES", str(256 * 1024 * 1024))
+)
+STOCKS_CACHE_INTRADAY_TTL = float(os.getenv("STOCKS_CACHE_INTRADAY_TTL", "30"))
+STOCKS_CACHE_DAILY_TTL = float(os.getenv("STOCKS_CACHE_DAILY_TTL", "900"))
+# Seconds past expiry that a history can still be served while the market service fails
+STOCKS_CACHE_MAX_STALE = float(os.getenv("STOCKS_CACHE_MAX_STALE", "3600"))
+
+# Approximate memory of one decoded bar: a two-key dict, its date string and price float
+BAR_BYTES = 300
+
+
+def history_bytes(history: Any) -> int:
+    return len(history) * BAR_BYTES if isinstance(history, list) else BAR_BYTES
+
+
+# Keyed by (ticker, startDate, interval), plus (method, max_points) for downsampled views
+stocks_cache = TTLCache(
+    STOCKS_CACHE_MAX_ENTRIES,
+    max_weight=STOCKS_CACHE_MAX_BYTES,
+    weigh=history_bytes,
+    max_stale=STOCKS_CACHE_MAX_STALE,
+)
+
+# Keyed by endpoint path
+latencies: Dict[str, LatencyTracker] = {}
+hedges = RateWindow(LATENCY_WINDOW)
+breaker = CircuitBreaker(
+    BREAKER_WINDOW, BREAKER_MIN_REQUESTS, BREAKER_FAILURE_RATE, BREAKER_COOLDOWN
+)
+counters = {"hedged": 0, "hedge_wins": 0, "stale_served": 0}
+
+# Current prices are read from the latest bar of a short daily history
+PRICE_LOOKBACK_DAYS = 7  # Covers weekends and market holidays
+PRICE_INTERVAL = "1d"
+
+
+async def init() -> None:
+    """
+    Create the shared market service client on API startup.
+    """
+    global client
+    base_url = os.getenv("GO_API_URL")
+
+    logger.info(
+        f"Connecting to market service: {base_url} "
+        f"(pool size {POOL_SIZE}, HTTP/2 {'on' if HTTP2 else 'off'})"
+    )
+
+    client = httpx.AsyncClient(
+        base_url=base_url,
+        http2=HTTP2,
+        limits=httpx.Limits(
+            max_connections=POOL_SIZE,
+            max_keepalive_connections=KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        # Pool timeout bounds how long a request waits for a free connection
+        timeout=httpx.Timeout(
+            connect=CONNECT_TIMEOUT,
+            read=READ_TIMEOUT,
+            write=READ_TIMEOUT,
+            pool=CONNECT_TIMEOUT,
+        ),
+    )
+
+
+async def close() -> None:
+    """
+    Close the shared market service client on API shutdown.
+    """
+    global client
+    logger.info("Closing market service client")
+    if client:
+        await client.aclose()
+        client = None
+
+
+def latency(endpoint: str) -> LatencyTracker:
+    tracker = latencies.get(endpoint)
+    if tracker is None:
+        tracker = latencies[endpoint] = LatencyTracker(LATENCY_WINDOW, MIN_SAMPLES)
+    return tracker
+
+
+def adaptive_timeout(tracker: LatencyTracker) -> Optional[httpx.Timeout]:
+    """
+    Read timeout scaled from the endpoint's observed p99, between MIN_READ_TIMEOUT and
+    READ_TIMEOUT. None until enough latencies have been observed.
+    """
+    p99 = tracker.percentile(99)
+    if p99 is None:
+        return None
+    read = min(READ_TIMEOUT, max(MIN_READ_TIMEOUT, p99 * TIMEOUT_MULTIPLIER))
+    return httpx.Timeout(
+        connect=CONNECT_TIMEOUT, read=read, write=READ_TIMEOUT, pool=CONNECT_TIMEOUT
+    )
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """
+    Whether an error means the market service is unhealthy, rather than that the request
+    was bad. Used for the circuit breaker and for stale fallbacks.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, (httpx.TransportError, CircuitOpenError))
+
+
+async def hedged(
+    send: Callable[[], Awaitable[httpx.Response]],
+    delay: float,
+    observe: Callable[[float], None],
+) -> httpx.Response:
+    """
+    Await send(), and if it has not completed after delay seconds, race it against a second
+    send(). Returns the first successful response.
+    The latency of the original request is passed to observe once it completes, even if the
+    hedge wins: recording the winner's latency instead would pull the percentiles that set the
+    hedge delay and timeouts down, causing more hedging. So a beaten original request is left
+    to finish, within its read timeout, and only a losing hedge is cancelled.
+    """
+    started = time.perf_counter()
+    first = asyncio.ensure_future(send())
+
+    def observe_first(task: asyncio.Future) -> None:
+        if not task.cancelled() and task.exception() is None:
+            observe(time.perf_counter() - started)
+
+    first.add_done_callback(observe_first)
+    tasks = [first]
+    keep_first = False
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        # Hedges are capped at HEDGE_MAX_RATIO of recent requests, so a slow upstream does
+        # not get its load multiplied
+        if done or hedges.rate >= HEDGE_MAX_RATIO:
+            hedges.add(False)
+            return await first
+        hedges.add(True)
+        counters["hedged"] += 1
+        tasks.append(asyncio.ensure_future(send()))
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    if task is not first:
+                        counters["hedge_wins"] += 1
+                        keep_first = True
+                    return task.result()
+        # Both requests failed; report the original error
+        return first.result()
+    finally:
+        for task in tasks:
+            if task.done() and not task.cancelled():
+                # Retrieve a losing request's error so it is not logged as unhandled
+                task.exception()
+            if task is not first or not keep_first:
+                task.cancel()
+
+
+async def get(endpoint: str, stream: bool = False, **kwargs: Any) -> httpx.Response:
+    """
+    Send a GET request to a market service endpoint, recording its latency and outcome.
+    Unless a timeout is given, the read timeout adapts to the endpoint's observed latency,
+    and requests slower than its HEDGE_PERCENTILE latency are hedged. Raises
+    CircuitOpenError without calling the service while the circuit breaker is open.
+    If stream, the request is not hedged, only the response headers have been read on
+    return, and the caller must consume the body and close the response.
+    """
+    if not breaker.allow():
+        metrics.market_request_duration_seconds.labels(endpoint, "rejected").observe(0)
+        raise CircuitOpenError("Market service circuit breaker is open")
+
+    tracker = latency(endpoint)
+    if "timeout" not in kwargs:
+        timeout = adaptive_timeout(tracker)
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+
+    async def send() -> httpx.Response:
+        request = client.build_request("GET", endpoint, **kwargs)
+        return await client.send(request, stream=stream)
+
+    started = time.perf_counter()
+    outcome = "error"
+    success = None
+    try:
+        delay = (
+            None
+            if stream or not HEDGE_ENABLED
+            else tracker.percentile(HEDGE_PERCENTILE)
+        )
+        if delay is None:
+            response = await send()
+            tracker.observe(time.perf_counter() - started)
+        else:
+            response = await hedged(send, delay, tracker.observe)
+        outcome = (
+            "ok" if response.is_success else f"http_{response.status_code // 100}xx"
+        )
+        success = response.status_code < 500
+        return response
+    except Exception as e:
+        success = not is_upstream_failure(e)
+        raise
+    finally:
+        if success is None:
+            # Cancelled before an outcome was known
+            breaker.abandon()
+        else:
+            breaker.record(success)
+        metrics.market_request_duration_seconds.labels(endpoint, outcome).observe(
+            time.perf_counter() - started
+        )
+
+
+# Upstream headers forwarded by stream_stocks; hop-by-hop headers are left to the server
+PASSTHROUGH_HEADERS = ("content-type", "content-encoding", "content-length")
+
+
+class UpstreamStreamingResponse(StreamingResponse):
+    """
+    Streaming response relaying an upstream httpx response, which is closed however sending
+    ends, including when the client disconnects before the body is iterated at all.
+    """
+
+    def __init__(self, upstream: httpx.Response, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.upstream = upstream
+
+    async def __call__(self, scope: Dict, receive: Callable, send: Callable) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # Closing an already closed response does nothing
+            await self.upstream.aclose()
+
+
+async def stream_stocks(
+    ticker: str, startDate: str, interval: str
+) -> StreamingResponse:
+    """
+    Proxy a price history from the market service without decoding it.
+    The upstream body is relayed in chunks as it arrives, still encoded, with the upstream
+    status and content headers, so memory use stays bounded whatever the history length.
+    Bypasses the price history cache.
+    """
+    params = {"ticker": ticker, "startDate": startDate, "interval": interval}
+    response = await get("/stocks", stream=True, params=params)
+    headers = {
+        name: response.headers[name]
+        for name in PASSTHROUGH_HEADERS
+        if name in response.headers
+    }
+
+    async def relay() -> AsyncIterator[bytes]:
+        # Release the upstream connection as soon as the body ends or the client disconnects
+        try:
+            async for chunk in response.aiter_raw():
+                yield chunk
+        finally:
+            await response.aclose()
+
+    return UpstreamStreamingResponse(
+        response, relay(), status_code=response.status_code, headers=headers
+    )
+
+
+def stocks_ttl(interval: str) -> float:
+    """
+    Choose how long a price history stays cached based on its bar interval.
+    Intraday bars (e.g. "1m", "15m", "1h") go stale quickly; daily and longer bars do not.
+    """
+    if interval.endswith(("m", "h")):
+        return STOCKS_CACHE_INTRADAY_TTL
+    return STOCKS_CACHE_DAILY_TTL
+
+
+async def get_stocks(
+    ticker: str,
+    startDate: str,
+    interval: str,
+    max_points: Optional[int] = None,
+    method: str = "lttb",
+) -> Any:
+    """
+    Fetch a price history from the market service, served from cache when fresh.
+    If max_points is given, the history is downsampled with the given method (see
+    src/downsample.py), and the downsampled view is cached alongside the full history.
+    If the market service is failing and SERVE_STALE is set, an expired cached copy is
+    returned instead. Otherwise raises httpx errors from the upstream request, or
+    CircuitOpenError; failed responses are not cached.
+    """
+    ttl = stocks_ttl(interval)
+    history_key = (ticker, startDate, interval)
+
+    async def fetch_range(start_date: str) -> Any:
+        params = {"ticker": ticker, "startDate": start_date, "interval": interval}
+        response = await get("/stocks", params=params)
+        response.raise_for_status()
+        return response.json()
+
+    async def fetch_history() -> Any:
+        if price_store.ENABLED:
+            return await price_store.get_history(
+                ticker, startDate, interval, fetch_range, ttl
+            )
+        return await fetch_range(startDate)
+
+    async def fetch_downsampled() -> Any:
+        history = await stocks_cache.get_or_fetch(history_key, fetch_history, ttl)
+        return downsample.downsample(history, max_points, method)
+
+    if max_points is None:
+        key, fetch = history_key, fetch_history
+    else:
+        key, fetch = history_key + (method, max_points), fetch_downsampled
+    try:
+        return await stocks_cache.get_or_fetch(key, fetch, ttl)
+    except Exception as e:
+        if not SERVE_STALE or not is_upstream_failure(e):
+            raise
+        found, value = stocks_cache.get_stale(key)
+        if not found:
+            raise
+        counters["stale_served"] += 1
+        logger.warning("Serving stale price history for %s: %s", key, repr(e))
+        return value
+
+
+async def get_price(ticker: str) -> float:
+    """
+    Fetch the latest price for a ticker from the most recent bar of its price history.
+    """
+    # Bypasses the price history cache, whose daily-interval TTL is too long for quotes
+    start_date = (date.today() - timedelta(days=PRICE_LOOKBACK_DAYS)).isoformat()
+    params = {"ticker": ticker, "startDate": start_date, "interval": PRICE_INTERVAL}
+    response = await get("/stocks", params=params)
+    response.raise_for_status()
+    return float(response.json()[-1]["price"])
+
+
+async def get_price_results(
+    tickers: Iterable[str],
+) -> Dict[str, float | Exception]:
+    """
+    Fetch latest prices for many tickers concurrently, at most POOL_SIZE at a time.
+    Each distinct ticker is fetched once, and maps to its price or the error raised.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    semaphore = asyncio.Semaphore(POOL_SIZE)
+
+    async def fetch(ticker: str) -> float:
+        async with semaphore:
+            return await get_price(ticker)
+
+    results = await asyncio.gather(
+        *(fetch(ticker) for ticker in tickers), return_exceptions=True
+    )
+    return dict(zip(tickers, results))
+
+
+async def get_prices(tickers: Iterable[str]) -> Dict[str, float]:
+    """
+    Fetch latest prices for many tickers concurrently.
+    Tickers whose price could not be fetched are logged and left out of the result.
+    """
+    prices = {}
+    for ticker, result in (await get_price_results(tickers)).items():
+        if isinstance(result, Exception):
+            logger.warning("Price lookup failed for %s: %s", ticker, result)
+        else:
+            prices[ticker] = result
+    return prices
+
+
+def stats() -> Dict[str, Any]:
+    """
+    Report circuit breaker state, hedging counters and latency percentiles per endpoint.
+    """
+    return {
+        "breaker": breaker.stats(),
+        "hedge_rate": round(hedges.rate, 4),
+        **counters,
+        "latency": {
+            endpoint: {
+                f"p{percent}": tracker.percentile(percent) for percent in (50, 95, 99)
+            }
+            for endpoint, tracker in latencies.items()
+        },
+    }
+
+
+BREAKER_STATES = (CircuitBreaker.CLOSED, CircuitBreaker.HALF_OPEN, CircuitBreaker.OPEN)
+
+
+def client_stats() -> Dict[str, float]:
+    """
+    Numeric subset of stats() for the metrics endpoint; breaker state is 0 when closed,
+    1 when half-open and 2 when open.
+    """
+    return {
+        "breaker_state": BREAKER_STATES.index(breaker.state),
+        "breaker_failure_rate": breaker.failures.rate,
+        "breaker_opened": breaker.opened,
+        "breaker_rejected": breaker.rejected,
+        "hedge_rate": hedges.rate,
+        **counters,
+    }
+
+
+metrics.CallbackGauge(
+    "stocks_cache",
+    "Price history cache occupancy and counters",
+    "stat",
+    stocks_cache.stats,
+)
+metrics.CallbackGauge(
+    "market_client",
+    "Market service circuit breaker and hedging state",
+    "stat",
+    client_stats,
+)
@@ -0,0 +1,327 @@
+"""
+Minimal Prometheus-compatible metrics, served in the text exposition format at GET /metrics.
+
+Metrics are designed to stay enabled at full load: each labelled child is created once on first
+use, histogram buckets are preallocated per child, and recording a sample is a dict lookup plus
+a couple of integer/float updates. All updates happen on the event loop thread, so no locks are
+taken.
+
+See: https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Default latency buckets in seconds, from sub-millisecond cache hits to slow upstream calls
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# Every metric, in registration order
+registry: List[Any] = []
+
+
+def escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    """
+    Base class holding one child per combination of label values.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children: Dict[Tuple, Any] = {}
+        registry.append(self)
+
+    def new_child(self) -> Any:
+        raise NotImplementedError
+
+    def labels(self, *values: Any) -> Any:
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.new_child()
+        return child
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.help}\n# TYPE {self.name} {self.kind}\n"
+        return header + "".join(line + "\n" for line in self.samples())
+
+
+class CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def new_child(self) -> CounterChild:
+        return CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{format_labels(self.labelnames, values)} {child.value}"
+            for values, child in self.children.items()
+        ]
+
+
+class GaugeChild(CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def new_child(self) -> GaugeChild:
+        return GaugeChild()
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class Timer:
+    """
+    Context manager observing the elapsed time of its block on a histogram child.
+    """
+
+    __slots__ = ("child", "started")
+
+    def __init__(self, child: "HistogramChild") -> None:
+        self.child = child
+
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.child.observe(time.perf_counter() - self.started)
+
+
+class HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        # One slot per bucket plus +Inf; made cumulative only when rendered
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self) -> Timer:
+        return Timer(self)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def new_child(self) -> HistogramChild:
+        return HistogramChild(self.buckets)
+
+    def samples(self) -> List[str]:
+        lines = []
+        bucket_labels = self.labelnames + ("le",)
+        for values, child in self.children.items():
+            cumulative = 0
+            bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, child.counts):
+                cumulative += count
+                labels = format_labels(bucket_labels, values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {child.sum}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class CallbackGauge(Metric):
+    """
+    Gauge whose values are read from a callback at scrape time, for occupancy of pools and
+    caches that already track their own state. The callback returns {label value: value}.
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelname: str,
+        callback: Callable[[], Dict[str, float]],
+    ) -> None:
+        super().__init__(name, help, (labelname,))
+        self.callback = callback
+
+    def samples(self) -> List[str]:
+        try:
+            values = self.callback()
+        except Exception:
+            return []
+        return [
+            f"{self.name}{format_labels(self.labelnames, (label,))} {value}"
+            for label, value in values.items()
+        ]
+
+
+def render() -> str:
+    """
+    Render every registered metric in the Prometheus text exposition format.
+    """
+    return "".join(metric.render() for metric in registry)
+
+
+##### Application metrics #####
+
+http_requests_in_flight = Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served"
+)
+http_request_duration_seconds = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by method, route and status code",
+    ("method", "route", "status"),
+)
+db_query_duration_seconds = Histogram(
+    "db_query_duration_seconds", "Database query latency by query", ("query",)
+)
+# Long-lived streams (Server-Sent Events) are kept out of the request metrics above, so their
+# lifetimes do not skew request latency and in-flight counts
+http_streams_open = Gauge(
+    "http_streams_open", "Long-lived HTTP streams currently open", ("route",)
+)
+http_stream_duration_seconds = Histogram(
+    "http_stream_duration_seconds",
+    "Lifetime of long-lived HTTP streams by route",
+    ("route",),
+    buckets=(1.0, 10.0, 60.0, 300.0, 900.0, 3600.0, 14400.0, 86400.0),
+)
+market_request_duration_seconds = Histogram(
+    "market_request_duration_seconds",
+    "Go market service request latency by endpoint and outcome",
+    ("endpoint", "outcome"),
+)
+
+
+def db_query(label: str) -> HistogramChild:
+    """
+    Histogram child for a database query, resolved once at import time by callers.
+    """
+    return db_query_duration_seconds.labels(label)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency per route and status code, and requests in
+    flight. Routes are labelled by their path template to keep label cardinality bounded.
+    Requests to streaming_paths are long-lived streams, recorded as open streams and stream
+    lifetimes instead.
+    """
+
+    def __init__(self, app: Callable, streaming_paths: Sequence[str] = ()) -> None:
+        self.app = app
+        self.in_flight = http_requests_in_flight.labels()
+        self.streaming_paths = frozenset(streaming_paths)
+
+    async def __call__(self, scope: Dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if scope["path"] in self.streaming_paths:
+            await self.stream(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_and_record_status(message: Dict) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        self.in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_and_record_status)
+        finally:
+            self.in_flight.dec()
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            http_request_duration_seconds.labels(
+                scope["method"], path, status_code
+            ).observe(time.perf_counter() - started)
+
+    async def stream(self, scope: Dict, receive: Callable, send: Callable) -> None:
+        path = scope["path"]
+        open_streams = http_streams_open.labels(path)
+        open_streams.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            open_streams.dec()
+            http_stream_duration_seconds.labels(path).observe(
+                time.perf_counter() - started
+            )
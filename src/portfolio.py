@@ -0,0 +1,203 @@
+"""
+Portfolio analytics over the price histories of several tickers.
+
+Histories are fetched concurrently (through the price history cache in src/market.py), then
+lined up on a common timestamp grid: the union of every history's bar times, with each asset's
+last known price carried forward over bars it lacks, starting from the first bar at which every
+asset has a price. The result is one (bars x assets) array, and every statistic is computed
+with vectorized NumPy operations on it.
+
+The portfolio is buy-and-hold: the initial value is split between the assets by weight at the
+first bar of the grid, and the holdings are not rebalanced afterwards. Returns are simple
+period-over-period returns; volatility is their sample standard deviation.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Sequence, Tuple
+import numpy as np
+from src import market
+from src.resilience import CircuitOpenError
+
+# Bars per year for intervals whose volatility can be annualized
+PERIODS_PER_YEAR = {"1d": 252, "1wk": 52, "1mo": 12}
+
+
+def timestamps(dates: Sequence[str]) -> np.ndarray:
+    """
+    Parse ISO 8601 bar dates to Unix seconds, treating dates without a UTC offset as UTC.
+    The bars of one history normally share a format and offset, so the offset is parsed once
+    from the first bar and the rest are parsed by NumPy without it. Histories whose offsets
+    differ, e.g. across a daylight saving change, fall back to parsing every bar.
+    """
+    if not dates:
+        return np.empty(0, dtype=np.int64)
+    first = datetime.fromisoformat(dates[0])
+    offset = first.utcoffset()
+    if offset is None:
+        suffix = ""
+    elif dates[0].endswith("Z"):
+        suffix = "Z"
+    else:
+        suffix = dates[0][-6:]
+    # Cheap check that every date has the first one's width and offset: each offset (or, for
+    # dates without one, each pair of date separators) occurs once per date in the joined text
+    joined = "".join(dates)
+    if suffix:
+        uniform = joined.count(suffix) == len(dates)
+    else:
+        uniform = "+" not in joined and "Z" not in joined
+        uniform = uniform and joined.count("-") == 2 * len(dates)
+    if uniform and len(joined) == len(dates[0]) * len(dates):
+        if suffix:
+            dates = [date[: -len(suffix)] for date in dates]
+        parsed = np.array(dates, dtype="datetime64[s]").astype(np.int64)
+        return parsed - int(offset.total_seconds()) if offset else parsed
+
+    parsed = []
+    for date in dates:
+        moment = datetime.fromisoformat(date)
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        parsed.append(int(moment.timestamp()))
+    return np.array(parsed, dtype=np.int64)
+
+
+def price_columns(history: List[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Convert a market service price history to arrays of bar times and prices.
+    """
+    prices = np.fromiter(
+        (bar["price"] for bar in history), dtype=np.float64, count=len(history)
+    )
+    return timestamps([bar["date"] for bar in history]), prices
+
+
+def align(
+    columns: Sequence[Tuple[np.ndarray, np.ndarray]],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Line up (times, prices) columns on the union of their bar times, carrying prices forward.
+    Returns the grid and a (bars x assets) price array, trimmed to start at the first bar at
+    which every asset has a price. Raises ValueError if there is no such bar.
+    """
+    grid = np.unique(np.concatenate([times for times, _ in columns]))
+    prices = np.full((len(grid), len(columns)), np.nan)
+    for asset, (times, values) in enumerate(columns):
+        prices[np.searchsorted(grid, times), asset] = values
+
+    # Index of the latest bar with a price, for every bar and asset
+    latest = np.where(np.isnan(prices), 0, np.arange(len(grid))[:, None])
+    np.maximum.accumulate(latest, axis=0, out=latest)
+    prices = prices[latest, np.arange(len(columns))]
+
+    complete = ~np.isnan(prices).any(axis=1)
+    if not complete.any():
+        raise ValueError("price histories do not overlap")
+    start = int(complete.argmax())
+    return grid[start:], prices[start:]
+
+
+def drawdown(values: np.ndarray) -> np.ndarray:
+    """
+    Fractional decline from the running peak, along the first axis.
+    """
+    return values / np.maximum.accumulate(values, axis=0) - 1
+
+
+def analyze(
+    tickers: Sequence[str],
+    weights: Sequence[float],
+    histories: Sequence[List[Dict[str, Any]]],
+    interval: str,
+    initial_value: float,
+) -> Dict[str, Any]:
+    """
+    Compute buy-and-hold portfolio analytics from one price history per ticker.
+    Series and matrices are returned as NumPy arrays, in ticker order; statistics that are
+    undefined, e.g. the correlation of a constant price, are NaN.
+    Raises ValueError if the histories share fewer than two bars.
+    """
+    grid, prices = align([price_columns(history) for history in histories])
+    if len(grid) < 2:
+        raise ValueError("price histories share fewer than two bars")
+    weights = np.asarray(weights, dtype=np.float64)
+    weights = weights / weights.sum()
+    periods = PERIODS_PER_YEAR.get(interval)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = prices @ (initial_value * weights / prices[0])
+        # Returns of every asset and of the portfolio, as one (bars - 1) x (assets + 1) array
+        series = np.column_stack((prices, values))
+        returns = series[1:] / series[:-1] - 1
+        drawdowns = drawdown(series)
+        volatility = returns.std(axis=0, ddof=1)
+        covariance = np.atleast_2d(np.cov(returns[:, :-1], rowvar=False))
+        deviations = np.sqrt(np.diag(covariance))
+        correlation = covariance / np.outer(deviations, deviations)
+
+    statistics = {
+        "totalReturn": series[-1] / series[0] - 1,
+        "meanReturn": returns.mean(axis=0),
+        "volatility": volatility,
+        "annualizedVolatility": (
+            volatility * np.sqrt(periods)
+            if periods
+            else np.full_like(volatility, np.nan)
+        ),
+        "maxDrawdown": drawdowns.min(axis=0),
+    }
+    # One contiguous row per asset, as orjson only encodes C-contiguous arrays
+    asset_returns = np.ascontiguousarray(returns[:, :-1].T)
+    assets = [
+        {
+            "ticker": ticker,
+            "weight": weights[asset],
+            **{name: column[asset] for name, column in statistics.items()},
+            "returns": asset_returns[asset],
+        }
+        for asset, ticker in enumerate(tickers)
+    ]
+    return {
+        "dates": np.datetime_as_string(
+            grid.astype("datetime64[s]"), timezone="UTC"
+        ).tolist(),
+        "value": values,
+        "returns": np.ascontiguousarray(returns[:, -1]),
+        "drawdown": np.ascontiguousarray(drawdowns[:, -1]),
+        **{name: column[-1] for name, column in statistics.items()},
+        "assets": assets,
+        "covariance": covariance,
+        "correlation": correlation,
+    }
+
+
+async def analytics(
+    tickers: Sequence[str],
+    weights: Sequence[float],
+    startDate: str,
+    interval: str,
+    initial_value: float,
+) -> Dict[str, Any]:
+    """
+    Fetch the price history of every ticker concurrently and analyze the portfolio.
+    Raises CircuitOpenError if the market service is unavailable, LookupError naming the
+    tickers whose history could not be fetched, and ValueError as analyze does.
+    """
+    histories = await asyncio.gather(
+        *(market.get_stocks(ticker, startDate, interval) for ticker in tickers),
+        return_exceptions=True,
+    )
+    failures = {
+        ticker: history
+        for ticker, history in zip(tickers, histories)
+        if isinstance(history, Exception)
+    }
+    if any(isinstance(error, CircuitOpenError) for error in failures.values()):
+        raise CircuitOpenError()
+    if failures:
+        raise LookupError(f"no price history for {', '.join(failures)}")
+    empty = [ticker for ticker, history in zip(tickers, histories) if not history]
+    if empty:
+        raise LookupError(f"no price history for {', '.join(empty)}")
+    return analyze(tickers, weights, histories, interval, initial_value)
@@ -0,0 +1,474 @@
+"""
+Local on-disk store of price histories, so repeat /stocks requests only fetch what is new.
+
+Each (ticker, interval) series is kept in its own directory as append-only columnar files of
+fixed-width values: bar timestamps (int64 epoch seconds), prices (float64) and the original date
+strings (32 bytes), plus a small meta.json recording the earliest date fetched and when the
+series was last refreshed. Columns are memory-mapped, so a requested range is a slice of the
+mapped arrays found with a binary search, and only the bars returned are ever read from disk.
+
+A request for a range the store already covers is served locally if the series was refreshed
+within its TTL. Otherwise only the tail from the last stored bar is fetched from the market
+service and appended, with the overlapping bars updated in place. Requests starting before the
+covered range fetch the full range and rewrite the series as a new generation of files.
+
+Writers are serialized across workers with an exclusive lock on a store-wide lock file. Readers
+never lock: appends only grow files, and rewrites publish a new generation through an atomic
+replace of meta.json, so an existing mapping is never truncated underneath a reader.
+
+The store's size is kept as a running byte count in a .usage file, updated under the lock by
+every write, so writes never scan the store. The store is only scanned at startup, if the count
+is unreadable, and once the count exceeds PRICE_STORE_MAX_BYTES, when the least recently used
+series are deleted.
+"""
+
+import asyncio
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from src import metrics
+from src.logging import logger
+
+ENABLED = os.getenv("PRICE_STORE_ENABLED", "false").lower() in ("1", "true", "yes")
+DIRECTORY = os.getenv("PRICE_STORE_DIR", "data/prices")
+MAX_BYTES = int(os.getenv("PRICE_STORE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Column file suffix and dtype; every column holds one value per bar
+COLUMNS = {"ts": np.dtype("<i8"), "price": np.dtype("<f8"), "date": np.dtype("S32")}
+DATE_WIDTH = COLUMNS["date"].itemsize
+
+# Tickers and intervals are used as path components, so anything else bypasses the store
+NAME_PATTERN = re.compile(r"^[A-Za-z0-9.^=_-]{1,32}$")
+
+# Tail fetches start a day before the last stored bar, in case the market service applies
+# startDate in another timezone; overlapping bars are matched by timestamp
+TAIL_OVERLAP = timedelta(days=1)
+
+Key = Tuple[str, str]  # (ticker, interval)
+Fetch = Callable[[str], Awaitable[List[Dict[str, Any]]]]
+
+
+class Series:
+    """
+    Memory-mapped columns of one (ticker, interval) series at a given generation.
+    """
+
+    __slots__ = ("meta", "signature", "ts", "price", "date")
+
+    def __init__(self, meta: Dict[str, Any], signature: Tuple[int, int]) -> None:
+        self.meta = meta
+        self.signature = signature
+        self.ts = self.price = self.date = None
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def slice(self, start: int) -> List[Dict[str, Any]]:
+        """
+        Bars at or after the start timestamp, in the market service's response format.
+        """
+        first = int(np.searchsorted(self.ts, start))
+        return [
+            {"date": bar_date.decode(), "price": price}
+            for bar_date, price in zip(
+                self.date[first:].tolist(), self.price[first:].tolist()
+            )
+        ]
+
+
+# Mapped series by key, and when each was last used by this worker
+series_cache: Dict[Key, Series] = {}
+last_used: Dict[Key, float] = {}
+
+counters = {"hits": 0, "tail_fetches": 0, "full_fetches": 0, "evictions": 0}
+# Bytes on disk as of the last write by this worker
+disk_bytes = 0
+USAGE_FILE = ".usage"
+
+# Serializes writers within this worker; the lock file serializes them across workers
+write_lock = threading.Lock()
+lock_file = None
+
+
+def series_directory(key: Key) -> str:
+    ticker, interval = key
+    return os.path.join(DIRECTORY, interval, ticker)
+
+
+def column_path(key: Key, column: str, generation: int) -> str:
+    return os.path.join(series_directory(key), f"{column}.{generation}")
+
+
+def meta_path(key: Key) -> str:
+    return os.path.join(series_directory(key), "meta.json")
+
+
+def init() -> None:
+    """
+    Create the store directory and open the lock file on API startup.
+    """
+    global lock_file, disk_bytes
+    if not ENABLED:
+        return
+    os.makedirs(DIRECTORY, exist_ok=True)
+    lock_file = open(os.path.join(DIRECTORY, ".lock"), "a")
+    with locked():
+        disk_bytes = sum(disk_usage().values())
+        write_usage(disk_bytes)
+    logger.info(
+        "Price store at %s (%.0f MiB used of %.0f MiB)",
+        DIRECTORY,
+        disk_bytes / 2**20,
+        MAX_BYTES / 2**20,
+    )
+
+
+def close() -> None:
+    """
+    Release mappings and the lock file on API shutdown.
+    """
+    global lock_file
+    series_cache.clear()
+    if lock_file is not None:
+        lock_file.close()
+        lock_file = None
+
+
+@contextmanager
+def locked() -> Iterator[None]:
+    with write_lock:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def map_column(key: Key, column: str, generation: int, length: int) -> np.ndarray:
+    if length == 0:
+        return np.empty(0, dtype=COLUMNS[column])
+    path = column_path(key, column, generation)
+    return np.memmap(path, dtype=COLUMNS[column], mode="r", shape=(length,))
+
+
+def open_series(key: Key) -> Optional[Series]:
+    """
+    Map the current generation of a series, reusing the existing mapping if nothing changed.
+    Returns None if the series is not stored.
+    """
+    try:
+        stat = os.stat(meta_path(key))
+        signature = (stat.st_ino, stat.st_mtime_ns)
+        cached = series_cache.get(key)
+        if cached is not None and cached.signature == signature:
+            meta = cached.meta
+        else:
+            with open(meta_path(key)) as file:
+                meta = json.load(file)
+        generation = meta["generation"]
+        # Columns can be mid-append, so only bars present in every column are visible
+        length = min(
+            os.stat(column_path(key, column, generation)).st_size // dtype.itemsize
+            for column, dtype in COLUMNS.items()
+        )
+        if cached is not None and cached.meta is meta and len(cached) == length:
+            return cached
+        # Mapped afresh rather than updated, as other callers may hold the old mapping
+        series = Series(meta, signature)
+        series.ts = map_column(key, "ts", generation, length)
+        series.price = map_column(key, "price", generation, length)
+        series.date = map_column(key, "date", generation, length)
+    except (FileNotFoundError, ValueError, KeyError):
+        # Missing, evicted or replaced mid-read; the caller refetches
+        series_cache.pop(key, None)
+        return None
+    series_cache[key] = series
+    return series
+
+
+def to_columns(history: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """
+    Convert a market service price history to column arrays.
+    Raises ValueError if a bar's date cannot be parsed or stored.
+    """
+    timestamps = []
+    for bar in history:
+        bar_date = bar["date"]
+        if len(bar_date) > DATE_WIDTH:
+            raise ValueError(f"Date too long to store: {bar_date}")
+        parsed = datetime.fromisoformat(bar_date)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        timestamps.append(int(parsed.timestamp()))
+    return {
+        "ts": np.array(timestamps, dtype=COLUMNS["ts"]),
+        "price": np.fromiter(
+            (bar["price"] for bar in history),
+            dtype=COLUMNS["price"],
+            count=len(history),
+        ),
+        "date": np.array(
+            [bar["date"].encode() for bar in history], dtype=COLUMNS["date"]
+        ),
+    }
+
+
+def write_meta(key: Key, meta: Dict[str, Any]) -> None:
+    path = meta_path(key)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as file:
+        json.dump(meta, file)
+    os.replace(temporary, path)
+
+
+def rewrite(
+    key: Key,
+    fetched: Dict[str, np.ndarray],
+    covered_from: int,
+    fetched_at: float,
+    series: Optional[Series],
+) -> int:
+    """
+    Merge fetched columns with any stored bars and write them as a new generation.
+    Fetched bars replace stored bars with the same timestamp. The caller holds the lock.
+    Returns the change in bytes on disk.
+    """
+    if series is not None:
+        covered_from = min(covered_from, series.meta["covered_from"])
+        combined = {
+            column: np.concatenate((getattr(series, column), fetched[column]))
+            for column in COLUMNS
+        }
+        # Keep the last occurrence of each timestamp, i.e. the fetched bar
+        reverse = combined["ts"][::-1]
+        _, first = np.unique(reverse, return_index=True)
+        keep = len(reverse) - 1 - first
+        fetched = {column: values[keep] for column, values in combined.items()}
+        generation = series.meta["generation"] + 1
+    else:
+        generation = 0
+    os.makedirs(series_directory(key), exist_ok=True)
+    for column, values in fetched.items():
+        values.tofile(column_path(key, column, generation))
+    write_meta(
+        key,
+        {
+            "generation": generation,
+            "covered_from": covered_from,
+            "fetched_at": fetched_at,
+        },
+    )
+    written = sum(values.nbytes for values in fetched.values())
+    if series is None:
+        return written
+    # Readers still mapping the old generation keep their mappings until they remap
+    for column in COLUMNS:
+        os.unlink(column_path(key, column, generation - 1))
+    return written - sum(getattr(series, column).nbytes for column in COLUMNS)
+
+
+def append_tail(
+    key: Key, fetched: Dict[str, np.ndarray], series: Series
+) -> Optional[int]:
+    """
+    Update the stored bars overlapping the fetched ones in place and append the rest.
+    Returns the bytes appended, or None without writing if the overlap does not line up with
+    the stored tail. The caller holds the lock.
+    """
+    stored = len(series)
+    overlap = 0
+    if stored:
+        overlap = int(np.searchsorted(fetched["ts"], series.ts[-1], side="right"))
+    first = stored - overlap
+    if first < 0 or not np.array_equal(series.ts[first:], fetched["ts"][:overlap]):
+        return None
+    generation = series.meta["generation"]
+    for column in ("price", "date"):
+        with open(column_path(key, column, generation), "r+b") as file:
+            file.seek(first * COLUMNS[column].itemsize)
+            fetched[column][:overlap].tofile(file)
+    for column in COLUMNS:
+        with open(column_path(key, column, generation), "ab") as file:
+            fetched[column][overlap:].tofile(file)
+    return sum(fetched[column][overlap:].nbytes for column in COLUMNS)
+
+
+def store(
+    key: Key, history: List[Dict[str, Any]], covered_from: int, tail: bool
+) -> None:
+    """
+    Write a fetched history to the store, then evict cold series if over the size cap.
+    A tail is appended to the stored series; anything else is merged into a new generation.
+    """
+    try:
+        fetched = to_columns(history)
+    except (KeyError, TypeError, ValueError) as e:
+        logger.warning("Not storing price history for %s: %s", key, e)
+        return
+    fetched_at = time.time()
+    with locked():
+        # Re-read under the lock, as another worker may have written in the meantime
+        series = open_series(key)
+        if tail and series is None:
+            # Evicted since the tail was requested; the caller refetches in full
+            return
+        written = append_tail(key, fetched, series) if tail else None
+        if written is not None:
+            write_meta(key, dict(series.meta, fetched_at=fetched_at))
+        else:
+            written = rewrite(key, fetched, covered_from, fetched_at, series)
+        account(key, written)
+
+
+def read_usage() -> Optional[int]:
+    try:
+        with open(os.path.join(DIRECTORY, USAGE_FILE)) as file:
+            return int(file.read())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_usage(total: int) -> None:
+    with open(os.path.join(DIRECTORY, USAGE_FILE), "w") as file:
+        file.write(str(total))
+
+
+def account(key: Key, written: int) -> None:
+    """
+    Add a write's bytes to the store-wide count, evicting cold series if it is over the cap.
+    The caller holds the lock.
+    """
+    global disk_bytes
+    total = read_usage()
+    if total is None:
+        # Missing or cut short by a crash; recounted from the files
+        total = sum(disk_usage().values())
+    else:
+        total += written
+    if total > MAX_BYTES:
+        total = evict(keep=key)
+    write_usage(total)
+    disk_bytes = total
+
+
+def disk_usage() -> Dict[Key, int]:
+    """
+    Bytes on disk per stored series.
+    """
+    usage = {}
+    for interval in os.scandir(DIRECTORY):
+        if not interval.is_dir():
+            continue
+        for ticker in os.scandir(interval.path):
+            if ticker.is_dir():
+                usage[(ticker.name, interval.name)] = sum(
+                    entry.stat().st_size for entry in os.scandir(ticker.path)
+                )
+    return usage
+
+
+def evict(keep: Key) -> int:
+    """
+    Delete the least recently used series until the store fits in MAX_BYTES.
+    Series used by other workers are ranked by when they were last refreshed.
+    The store is scanned afresh, so the running count is corrected too.
+    The caller holds the lock. Returns the bytes left on disk.
+    """
+    usage = disk_usage()
+    total = sum(usage.values())
+    if total <= MAX_BYTES:
+        return total
+
+    def recency(key: Key) -> float:
+        try:
+            refreshed = os.stat(meta_path(key)).st_mtime
+        except FileNotFoundError:
+            refreshed = 0.0
+        return max(refreshed, last_used.get(key, 0.0))
+
+    for key in sorted(usage, key=recency):
+        if total <= MAX_BYTES:
+            break
+        if key == keep:
+            continue
+        directory = series_directory(key)
+        # meta.json goes first, so readers stop finding the series before its columns go
+        for name in ["meta.json"] + sorted(set(os.listdir(directory)) - {"meta.json"}):
+            os.unlink(os.path.join(directory, name))
+        os.rmdir(directory)
+        series_cache.pop(key, None)
+        last_used.pop(key, None)
+        total -= usage[key]
+        counters["evictions"] += 1
+        logger.info("Evicted price history for %s %s from the store", *key)
+    return total
+
+
+def day_start(startDate: str) -> int:
+    day = date.fromisoformat(startDate)
+    return int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp())
+
+
+async def get_history(
+    ticker: str, startDate: str, interval: str, fetch: Fetch, max_age: float
+) -> List[Dict[str, Any]]:
+    """
+    Return the price history from startDate, fetching from the market service only the part
+    the store is missing. fetch(startDate) performs the upstream request. A stored series is
+    used as-is for max_age seconds after it was last refreshed.
+    """
+    key = (ticker, interval)
+    try:
+        if not NAME_PATTERN.match(ticker) or not NAME_PATTERN.match(interval):
+            raise ValueError("Unsupported ticker or interval")
+        start = day_start(startDate)
+    except ValueError:
+        # Leave validation to the market service
+        return await fetch(startDate)
+
+    last_used[key] = time.time()
+    series = open_series(key)
+    if series is None or start < series.meta["covered_from"]:
+        counters["full_fetches"] += 1
+        history = await fetch(startDate)
+        await asyncio.to_thread(store, key, history, start, False)
+        return history
+
+    if time.time() - series.meta["fetched_at"] >= max_age:
+        counters["tail_fetches"] += 1
+        if len(series):
+            last = datetime.fromtimestamp(int(series.ts[-1]), timezone.utc)
+            tail_start = (last - TAIL_OVERLAP).date().isoformat()
+        else:
+            tail_start = startDate
+        history = await fetch(tail_start)
+        await asyncio.to_thread(store, key, history, start, True)
+        series = open_series(key)
+        if series is None:
+            # Evicted or replaced in the meantime
+            return await fetch(startDate)
+    else:
+        counters["hits"] += 1
+    return series.slice(start)
+
+
+def stats() -> Dict[str, int]:
+    """
+    Report store size and counters.
+    """
+    return {
+        "mapped_series": len(series_cache),
+        "bytes": disk_bytes,
+        "max_bytes": MAX_BYTES,
+        **counters,
+    }
+
+
+metrics.CallbackGauge("price_store", "Local price history store", "stat", stats)
@@ -0,0 +1,380 @@
+"""
+Opt-in profiling of single requests, saved as collapsed stacks for flamegraph tools.
+
+A request is profiled when its X-Profile header equals PROFILE_TOKEN, or at random with
+probability PROFILE_SAMPLE_RATE if its path starts with one of PROFILE_PATHS. At most
+PROFILE_MAX_ACTIVE requests per worker are profiled at once. Requests that are not profiled
+cost one header lookup, plus one random number when a sample rate is set.
+
+While a request is profiled, a sampler thread records the request task's stack every
+PROFILE_INTERVAL seconds. A thread's stack only shows a coroutine while it runs, and async
+handlers spend most of their wall time suspended. So when the task is suspended, its stack is
+rebuilt from its chain of awaited coroutines. That stack ends in a pseudo-frame naming what the
+task waits on: the database (psycopg frames), the market service (httpx frames or
+src/market.py) or anything else. Tasks the request waits on through asyncio.gather, such as
+concurrent market requests, are sampled as branches under the gather. Sampling needs the GIL,
+so stretches of pure CPU work are sampled at most every sys.getswitchinterval() seconds.
+
+Each profile is written to PROFILE_DIR as <id>.folded, one "frame;frame;frame count" line per
+distinct stack, as read by flamegraph.pl, inferno or speedscope. The request's wall time is
+written next to it in <id>.json, split into time on CPU and time waiting on each kind of call.
+Only the newest PROFILE_MAX_FILES profiles are kept. List them at GET /admin/profiles.
+
+See: https://www.brendangregg.com/flamegraphs.html
+"""
+
+import asyncio
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from itertools import count
+from types import CodeType, FrameType
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from src import metrics
+from src.logging import logger
+
+# Secret for the X-Profile header and the admin endpoints; profiling by header is off if unset
+TOKEN = os.getenv("PROFILE_TOKEN", "")
+SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PATHS = tuple(filter(None, os.getenv("PROFILE_PATHS", "/").split(",")))
+INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))  # Seconds between samples
+MAX_ACTIVE = int(os.getenv("PROFILE_MAX_ACTIVE", "2"))
+DIRECTORY = os.getenv("PROFILE_DIR", "data/profiles")
+MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "100"))
+
+HEADER = b"x-profile"
+# Profile ids are used as file names
+ID_PATTERN = re.compile(r"^[0-9A-Za-z.-]{1,64}$")
+
+# Where a suspended stack's innermost matching frame comes from decides what it waits on
+WAIT_MARKERS = (
+    ("db", ("/psycopg/", "/psycopg_pool/")),
+    ("market", ("/httpx/", "/httpcore/", os.path.join("src", "market.py"))),
+)
+CATEGORIES = ("cpu", "db", "market", "other")
+STANDARD_LIBRARY = os.path.dirname(os.__file__) + os.sep
+
+# Initialize to satisfy module scope before first use
+active = 0
+sequence = count(1)
+counters = {"profiled": 0, "skipped": 0, "write_errors": 0}
+# Per code object: the frame label without its line number, and its wait category, if any
+code_labels: Dict[CodeType, Tuple[str, Optional[str]]] = {}
+
+
+def code_label(code: CodeType) -> Tuple[str, Optional[str]]:
+    label = code_labels.get(code)
+    if label is None:
+        filename = code.co_filename
+        category = next(
+            (
+                name
+                for name, markers in WAIT_MARKERS
+                if any(marker in filename for marker in markers)
+            ),
+            None,
+        )
+        # Paths relative to the working directory, the installed package root or the
+        # standard library
+        if "site-packages" + os.sep in filename:
+            filename = filename.rsplit("site-packages" + os.sep, 1)[1]
+        elif filename.startswith(STANDARD_LIBRARY):
+            filename = filename.removeprefix(STANDARD_LIBRARY)
+        elif filename.startswith(os.getcwd()):
+            filename = os.path.relpath(filename)
+        label = code_labels[code] = (f"{code.co_qualname} ({filename}", category)
+    return label
+
+
+def frame_labels(frames: List[FrameType]) -> Tuple[List[str], str]:
+    """
+    Labels of frames given outermost first, and the wait category of the innermost frame
+    that has one.
+    """
+    labels, category = [], "other"
+    for frame in frames:
+        label, frame_category = code_label(frame.f_code)
+        labels.append(f"{label}:{frame.f_lineno or frame.f_code.co_firstlineno})")
+        category = frame_category or category
+    return labels, category
+
+
+def awaited_frames(awaitable: Any) -> List[FrameType]:
+    """
+    Frames of a suspended coroutine and of the coroutines it awaits, outermost first.
+    """
+    frames = []
+    while awaitable is not None:
+        frame = (
+            getattr(awaitable, "cr_frame", None)
+            or getattr(awaitable, "gi_frame", None)
+            or getattr(awaitable, "ag_frame", None)
+        )
+        if frame is None:
+            break
+        frames.append(frame)
+        awaitable = (
+            getattr(awaitable, "cr_await", None)
+            or getattr(awaitable, "gi_yieldfrom", None)
+            or getattr(awaitable, "ag_await", None)
+        )
+    return frames
+
+
+class Profile:
+    """
+    Samples the stacks of one request's task from a background thread.
+    """
+
+    def __init__(self, task: asyncio.Task, reason: str) -> None:
+        self.task = task
+        self.reason = reason
+        self.loop_thread = threading.get_ident()
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S.%fZ")
+        self.id = f"{stamp}-{os.getpid()}-{next(sequence)}"
+        self.stacks: Counter = Counter()
+        self.times = dict.fromkeys(CATEGORIES, 0.0)
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, name=f"profile-{self.id}", daemon=True
+        )
+
+    def start(self) -> None:
+        self.started = time.perf_counter()
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Signal the sampler thread to stop, without waiting for it; see join.
+        """
+        self.duration = time.perf_counter() - self.started
+        self.stopped.set()
+
+    def join(self) -> None:
+        # Up to a sampling interval, so never called on the event loop
+        self.thread.join()
+
+    def run(self) -> None:
+        last = self.started
+        while not self.stopped.wait(INTERVAL):
+            now = time.perf_counter()
+            try:
+                self.sample(now - last)
+            except Exception:
+                # The event loop thread keeps running between reads, so a stack can change
+                # under the walk; the sample is dropped
+                pass
+            last = now
+
+    def task_stacks(
+        self, task: asyncio.Task, thread_frame: Optional[FrameType]
+    ) -> List[Tuple[List[str], str]]:
+        """
+        (labels, category) for a task, or for each pending task it gathers.
+        """
+        coro = task.get_coro()
+        root = getattr(coro, "cr_frame", None)
+        if root is None:
+            return []
+        # A running task's frames are on the event loop thread's stack, down from its coroutine
+        frames, frame = [], thread_frame
+        while frame is not None:
+            frames.append(frame)
+            if frame is root:
+                return [(frame_labels(frames[::-1])[0], "cpu")]
+            frame = frame.f_back
+
+        labels, category = frame_labels(awaited_frames(coro))
+        children = getattr(getattr(task, "_fut_waiter", None), "_children", None) or ()
+        branches = [
+            (labels + child_labels, child_category)
+            for child in children
+            if isinstance(child, asyncio.Task) and not child.done()
+            for child_labels, child_category in self.task_stacks(child, thread_frame)
+        ]
+        return branches or [(labels + [f"[wait {category}]"], category)]
+
+    def sample(self, elapsed: float) -> None:
+        thread_frame = sys._current_frames().get(self.loop_thread)
+        branches = self.task_stacks(self.task, thread_frame)
+        if not branches:
+            return
+        self.samples += 1
+        for labels, category in branches:
+            self.stacks[";".join(labels)] += 1
+        # Concurrent branches share the interval, so each category gets it at most once
+        for category in {category for _, category in branches}:
+            self.times[category] += elapsed
+
+    def metadata(self, scope: Dict, status_code: int) -> Dict[str, Any]:
+        route = scope.get("route")
+        return {
+            "id": self.id,
+            "method": scope["method"],
+            "path": scope["path"],
+            "route": route.path if route is not None else None,
+            "status": status_code,
+            "reason": self.reason,
+            "duration_ms": round(self.duration * 1000, 3),
+            "samples": self.samples,
+            **{f"{name}_ms": round(self.times[name] * 1000, 3) for name in CATEGORIES},
+        }
+
+
+def authorized(token: Optional[str | bytes]) -> bool:
+    if not TOKEN or not token:
+        return False
+    if isinstance(token, str):
+        token = token.encode()
+    return hmac.compare_digest(token, TOKEN.encode())
+
+
+def profile_reason(scope: Dict) -> Optional[str]:
+    """
+    Why a request should be profiled, or None for the common case of not profiling it.
+    """
+    if TOKEN:
+        for name, value in scope["headers"]:
+            if name == HEADER:
+                return "header" if authorized(value) else None
+    if SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE:
+        return "sample" if scope["path"].startswith(PATHS) else None
+    return None
+
+
+def path(profile_id: str, suffix: str) -> str:
+    return os.path.join(DIRECTORY, f"{profile_id}.{suffix}")
+
+
+def write(profile: Profile, scope: Dict, status_code: int) -> None:
+    """
+    Wait for a stopped profile's sampler thread, save the profile, then delete the oldest
+    profiles beyond MAX_FILES. The metadata file is written last, so listed profiles are
+    always complete.
+    """
+    profile.join()
+    metadata = profile.metadata(scope, status_code)
+    os.makedirs(DIRECTORY, exist_ok=True)
+    with open(path(profile.id, "folded"), "w") as file:
+        file.writelines(f"{stack} {n}\n" for stack, n in profile.stacks.items())
+    temporary = path(profile.id, f"{os.getpid()}.tmp")
+    with open(temporary, "w") as file:
+        json.dump(metadata, file)
+    os.replace(temporary, path(profile.id, "json"))
+
+    # Ids start with the time, so they sort oldest first across workers
+    profile_ids = sorted(
+        name.removesuffix(".json")
+        for name in os.listdir(DIRECTORY)
+        if name.endswith(".json")
+    )
+    for profile_id in profile_ids[: max(len(profile_ids) - MAX_FILES, 0)]:
+        for suffix in ("json", "folded"):
+            try:
+                os.unlink(path(profile_id, suffix))
+            except FileNotFoundError:
+                # Already deleted by another worker
+                pass
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """
+    Metadata of the saved profiles, newest first.
+    """
+    try:
+        names = sorted(os.listdir(DIRECTORY), reverse=True)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(DIRECTORY, name)) as file:
+                profiles.append(json.load(file))
+        except (FileNotFoundError, ValueError):
+            # Deleted or replaced since the listing
+            continue
+    return profiles
+
+
+def read_profile(profile_id: str) -> Optional[str]:
+    """
+    Collapsed stacks of a saved profile, or None if there is no such profile.
+    """
+    if not ID_PATTERN.match(profile_id):
+        return None
+    try:
+        with open(path(profile_id, "folded")) as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling the requests selected by profile_reason. Profiled responses
+    carry an X-Profile-Id header naming the saved profile.
+    """
+
+    def __init__(self, app: Callable) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict, receive: Callable, send: Callable) -> None:
+        global active
+        if scope["type"] != "http" or scope["path"].startswith("/admin/"):
+            await self.app(scope, receive, send)
+            return
+        reason = profile_reason(scope)
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+        if active >= MAX_ACTIVE:
+            counters["skipped"] += 1
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(asyncio.current_task(), reason)
+        status_code = 500
+
+        async def send_with_profile_id(message: Dict) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-profile-id", profile.id.encode()),
+                ]
+            await send(message)
+
+        active += 1
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profile.stop()
+            active -= 1
+            counters["profiled"] += 1
+            try:
+                await asyncio.to_thread(write, profile, scope, status_code)
+            except OSError as e:
+                counters["write_errors"] += 1
+                logger.error("Failed to save request profile %s: %s", profile.id, e)
+
+
+def stats() -> Dict[str, int]:
+    """
+    Report profiling counters.
+    """
+    return {"active": active, **counters}
+
+
+metrics.CallbackGauge("profiling", "Request profiling counters", "stat", stats)
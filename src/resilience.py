@@ -0,0 +1,152 @@
+"""
+Building blocks for calling an upstream service that may be slow or failing: a latency tracker
+for percentiles, a rolling rate window, and a circuit breaker.
+
+The circuit breaker follows the usual three states. While closed, every call is allowed and its
+outcome recorded. Once the failure rate over the last window of calls crosses a threshold, the
+breaker opens and calls are rejected immediately. After a cooldown it lets a single probe call
+through (half-open): success closes the breaker, failure opens it again.
+
+See: https://martinfowler.com/bliki/CircuitBreaker.html
+and https://research.google/pubs/the-tail-at-scale/ for hedged requests.
+"""
+
+import time
+from collections import deque
+from typing import Dict, Optional
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling an upstream service whose circuit breaker is open.
+    """
+
+
+class LatencyTracker:
+    """
+    Sliding window of the most recent latencies, in seconds, with percentile lookups.
+    """
+
+    def __init__(self, size: int, min_samples: int) -> None:
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+        # Sorted copy of the window, rebuilt lazily after new samples
+        self.ordered = None
+
+    def observe(self, latency: float) -> None:
+        self.samples.append(latency)
+        self.ordered = None
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """
+        The given percentile of the window, or None until there are enough samples.
+        """
+        if len(self.samples) < self.min_samples:
+            return None
+        if self.ordered is None:
+            self.ordered = sorted(self.samples)
+        position = min(len(self.ordered) - 1, int(len(self.ordered) * percent / 100))
+        return self.ordered[position]
+
+
+class RateWindow:
+    """
+    Fraction of true values among the last size recorded.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.values = deque(maxlen=size)
+        self.count = 0
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def add(self, value: bool) -> None:
+        if len(self.values) == self.values.maxlen:
+            self.count -= self.values[0]
+        self.values.append(value)
+        self.count += value
+
+    def clear(self) -> None:
+        self.values.clear()
+        self.count = 0
+
+    @property
+    def rate(self) -> float:
+        return self.count / len(self.values) if self.values else 0.0
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_rate of the last window calls failed (once at least min_calls were
+    seen), and allows a probe call cooldown seconds later.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(
+        self, window: int, min_calls: int, failure_rate: float, cooldown: float
+    ) -> None:
+        self.failures = RateWindow(window)
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go ahead. Every allowed call must be followed by record() or
+        abandon().
+        """
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.cooldown:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self.probing:
+                self.rejected += 1
+                return False
+            self.probing = True
+        return True
+
+    def record(self, success: bool) -> None:
+        if self.state == self.HALF_OPEN:
+            self.probing = False
+            if success:
+                self.state = self.CLOSED
+                self.failures.clear()
+            else:
+                self.trip()
+            return
+        self.failures.add(not success)
+        if (
+            self.state == self.CLOSED
+            and len(self.failures) >= self.min_calls
+            and self.failures.rate >= self.failure_rate
+        ):
+            self.trip()
+
+    def abandon(self) -> None:
+        """
+        Release an allowed call that ended without an outcome, e.g. because it was cancelled.
+        """
+        if self.state == self.HALF_OPEN:
+            self.probing = False
+
+    def trip(self) -> None:
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.opened += 1
+
+    def stats(self) -> Dict[str, float | str]:
+        return {
+            "state": self.state,
+            "failure_rate": round(self.failures.rate, 4),
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
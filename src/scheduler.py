@@ -0,0 +1,180 @@
+"""
+Runs alert evaluation periodically on an asyncio task within the FastAPI app lifetime.
+
+Cycles are aligned to fixed slots of EVALUATION_INTERVAL seconds, each delayed by up to
+EVALUATION_JITTER seconds. A cycle is awaited before the next one is scheduled, so cycles never
+overlap; when a cycle overruns, the slots it overlapped are skipped rather than queued.
+
+With several uvicorn workers, only the worker holding a PostgreSQL session-level advisory lock
+runs evaluation. The lock is held on a dedicated connection, so if the leader dies or loses its
+connection, another worker acquires the lock on its next slot.
+
+See: https://www.postgresql.org/docs/current/explicit-locking.html#ADVISORY-LOCKS
+"""
+
+import asyncio
+import math
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Dict
+import psycopg as postgres
+from src import alerts, database, metrics
+from src.logging import logger
+
+ENABLED = os.getenv("EVALUATION_ENABLED", "true").lower() in ("1", "true", "yes")
+INTERVAL = float(os.getenv("EVALUATION_INTERVAL", "60"))  # Seconds between cycles
+JITTER = float(os.getenv("EVALUATION_JITTER", "5"))  # Maximum random delay per cycle
+
+# Arbitrary application-wide key identifying the evaluation leader lock
+LEADER_LOCK_KEY = 0x50494E53
+
+# Initialize to satisfy module scope before first use
+task = None
+lock_connection = None
+
+# Recent cycle measurements, for sizing the interval against real load
+cycles = deque(maxlen=100)
+counters = {"cycles": 0, "skipped_slots": 0, "failures": 0}
+cycle_duration = metrics.Histogram(
+    "alert_evaluation_duration_seconds", "Alert evaluation cycle duration"
+).labels()
+
+
+async def is_leader() -> bool:
+    """
+    Hold or try to acquire the evaluation leader lock.
+    """
+    global lock_connection
+    if lock_connection is not None:
+        try:
+            # Confirm the session holding the lock is still alive
+            await lock_connection.execute("SELECT 1")
+            return True
+        except postgres.Error:
+            logger.warning("Lost evaluation leader connection")
+            await release()
+
+    connection = await postgres.AsyncConnection.connect(
+        database.conninfo(), autocommit=True
+    )
+    try:
+        cur = await connection.execute(
+            "SELECT pg_try_advisory_lock(%s)", (LEADER_LOCK_KEY,)
+        )
+        acquired = (await cur.fetchone())[0]
+    except postgres.Error:
+        await connection.close()
+        raise
+    if not acquired:
+        await connection.close()
+        return False
+    logger.info("Acquired evaluation leader lock")
+    lock_connection = connection
+    return True
+
+
+async def release() -> None:
+    """
+    Release the leader lock by closing the session that holds it.
+    """
+    global lock_connection
+    if lock_connection is not None:
+        await lock_connection.close()
+        lock_connection = None
+
+
+async def run_cycle() -> None:
+    """
+    Run and record a single evaluation cycle.
+    """
+    started = time.perf_counter()
+    result = await alerts.evaluate()
+    duration = time.perf_counter() - started
+    counters["cycles"] += 1
+    cycle_duration.observe(duration)
+    cycles.append({"started": time.time(), "duration": duration, **result})
+    logger.info(
+        "Evaluation cycle took %.3fs: %d alerts, %d triggered",
+        duration,
+        result["alerts"],
+        result["triggered"],
+    )
+    if duration > INTERVAL:
+        logger.warning(
+            "Evaluation cycle overran its %.0fs interval by %.3fs",
+            INTERVAL,
+            duration - INTERVAL,
+        )
+
+
+async def run() -> None:
+    """
+    Evaluate alerts once per slot until cancelled.
+    """
+    next_slot = time.monotonic()
+    while True:
+        delay = next_slot - time.monotonic() + random.uniform(0, JITTER)
+        await asyncio.sleep(max(0.0, delay))
+
+        try:
+            if await is_leader():
+                await run_cycle()
+        except Exception:
+            counters["failures"] += 1
+            logger.exception("Evaluation cycle failed")
+
+        # Skip slots that passed while this cycle was running instead of queueing them
+        next_slot += INTERVAL
+        now = time.monotonic()
+        if next_slot < now:
+            missed = math.ceil((now - next_slot) / INTERVAL)
+            counters["skipped_slots"] += missed
+            next_slot += missed * INTERVAL
+
+
+def start() -> None:
+    """
+    Start the evaluation loop on API startup.
+    """
+    global task
+    logger.info(
+        "Starting alert evaluation every %.0fs (jitter %.0fs)", INTERVAL, JITTER
+    )
+    task = asyncio.create_task(run())
+
+
+async def stop() -> None:
+    """
+    Cancel the evaluation loop and release leadership on API shutdown.
+    """
+    global task
+    if task is not None:
+        logger.info("Stopping alert evaluation")
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        task = None
+    await release()
+
+
+def stats() -> Dict[str, Any]:
+    """
+    Report scheduler configuration, counters and recent cycles.
+    """
+    return {
+        "enabled": ENABLED,
+        "leader": lock_connection is not None,
+        "interval": INTERVAL,
+        "jitter": JITTER,
+        **counters,
+        "recent_cycles": list(cycles),
+    }
+
+
+metrics.CallbackGauge(
+    "alert_evaluation", "Alert evaluation scheduler counters", "stat", lambda: counters
+)
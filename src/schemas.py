@@ -6,15 +6,14 @@ This module includes schemas used for validation and serialization in FastAPI en
 
 from pydantic import BaseModel, field_validator
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 
-# Used in POST /alerts for automatic validation and parsing
-class Alert(BaseModel):
+# Used in POST /check-alert/batch, and as the base of Alert
+class AlertCheck(BaseModel):
     ticker: str
     price: float
     direction: str
-    expiration_time: Optional[datetime]  # ISO 8601 string will be automatically parsed
 
     # Validate direction to be either 'above' or 'below'
     # Also enforced in database
@@ -34,6 +33,11 @@ class Alert(BaseModel):
             raise ValueError("ticker must be between 1 and 10 characters")
         return v.upper()  # Normalize to uppercase
 
+
+# Used in POST /alerts for automatic validation and parsing
+class Alert(AlertCheck):
+    expiration_time: Optional[datetime]  # ISO 8601 string will be automatically parsed
+
     # Validate expiration time is in the future
     @field_validator("expiration_time")
     @classmethod
@@ -92,7 +96,6 @@ class UserResponse(BaseModel):
     @classmethod
     def convert_datetime_to_int(cls, v):
         if isinstance(v, datetime):
-            print("Converting datetime to int...")
             return int(v.timestamp())
         return v
 
@@ -102,3 +105,106 @@ class AlertResponse(BaseModel):  # Alert creation/deletion response
     message: str
     new_alert_id: Optional[int] = None
     deleted_alert_id: Optional[int] = None
+
+
+# Per-item error in a batch alert creation/deletion
+class AlertBatchError(BaseModel):
+    index: int  # Position of the failing item in the request
+    detail: str
+
+
+class AlertBatchResponse(BaseModel):  # Batch alert creation/deletion response
+    message: str
+    new_alert_ids: Optional[List[Optional[int]]] = (
+        None  # In input order, None if failed
+    )
+    deleted_alert_ids: Optional[List[int]] = None
+    errors: List[AlertBatchError] = []
+
+
+# Same fields as the Go service's /check-alert response
+class AlertCheckResult(BaseModel):
+    valid: bool
+    currentPrice: float
+    message: str
+
+
+class AlertCheckBatchResponse(BaseModel):  # Batch alert check response
+    results: List[Optional[AlertCheckResult]]  # In input order, None if failed
+    errors: List[AlertBatchError] = []
+
+
+# Largest number of tickers in one portfolio analytics request
+MAX_PORTFOLIO_HOLDINGS = 100
+
+
+# Used in POST /portfolio/analytics
+class PortfolioHolding(BaseModel):
+    ticker: str
+    weight: float  # Relative; weights are normalized to sum to 1
+
+    @field_validator("ticker")
+    @classmethod
+    def validate_ticker(cls, v):
+        if not 1 <= len(v) <= 10:
+            raise ValueError("ticker must be between 1 and 10 characters")
+        return v.upper()  # Normalize to uppercase
+
+    @field_validator("weight")
+    @classmethod
+    def validate_weight(cls, v):
+        if not v > 0:
+            raise ValueError("weight must be positive")
+        return v
+
+
+class PortfolioAnalyticsRequest(BaseModel):
+    holdings: List[PortfolioHolding]
+    startDate: str
+    interval: str = "1d"
+    initialValue: float = 1.0
+
+    @field_validator("holdings")
+    @classmethod
+    def validate_holdings(cls, v):
+        if not 1 <= len(v) <= MAX_PORTFOLIO_HOLDINGS:
+            raise ValueError(
+                f"holdings must contain between 1 and {MAX_PORTFOLIO_HOLDINGS} tickers"
+            )
+        if len({holding.ticker for holding in v}) < len(v):
+            raise ValueError("holdings must not repeat a ticker")
+        return v
+
+    @field_validator("initialValue")
+    @classmethod
+    def validate_initial_value(cls, v):
+        if not v > 0:
+            raise ValueError("initialValue must be positive")
+        return v
+
+
+# Statistics are null where undefined, e.g. the volatility of a single return
+class PortfolioAssetAnalytics(BaseModel):
+    ticker: str
+    weight: float  # Normalized
+    totalReturn: Optional[float]
+    meanReturn: Optional[float]  # Per bar
+    volatility: Optional[float]  # Per bar
+    annualizedVolatility: Optional[float]  # Daily, weekly and monthly intervals only
+    maxDrawdown: Optional[float]
+    returns: List[Optional[float]]  # Per bar, one fewer than dates
+
+
+class PortfolioAnalyticsResponse(BaseModel):
+    dates: List[str]  # Common bar times, in UTC
+    value: List[float]  # Buy-and-hold portfolio value at each date
+    returns: List[Optional[float]]
+    drawdown: List[float]
+    totalReturn: Optional[float]
+    meanReturn: Optional[float]
+    volatility: Optional[float]
+    annualizedVolatility: Optional[float]
+    maxDrawdown: Optional[float]
+    assets: List[PortfolioAssetAnalytics]  # In request order
+    covariance: List[List[Optional[float]]]  # Of asset returns, in asset order
+    correlation: List[List[Optional[float]]]
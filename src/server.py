@@ -14,20 +14,55 @@ from src.logging import logger
 logger.info("Starting Portfolio Insights backend")
 logger.info("Importing modules...")
 
-from fastapi import FastAPI, Request, HTTPException, status, Depends
+from fastapi import (
+    FastAPI,
+    Header,
+    Request,
+    Response,
+    HTTPException,
+    status,
+    Depends,
+    Query,
+    Body,
+)
 from fastapi.exceptions import RequestValidationError
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 import httpx
-from src import alerts, database, users
+from src import (
+    alert_cache,
+    alerts,
+    database,
+    events,
+    expiry,
+    market,
+    metrics,
+    portfolio,
+    price_store,
+    profiling,
+    scheduler,
+    shards,
+    users,
+)
+from src.resilience import CircuitOpenError
 from src.schemas import (
     Alert,
     Token,
     AlertResponse,
+    AlertBatchError,
+    AlertBatchResponse,
+    AlertCheck,
+    AlertCheckBatchResponse,
+    AlertCheckResult,
+    PortfolioAnalyticsRequest,
+    PortfolioAnalyticsResponse,
     UserRegister,
     UserResponse,
 )
-from typing import List, Dict
+from pydantic import ValidationError
+from typing import Any, List, Dict, Literal, Optional
+import asyncio
 import os
 from dotenv import load_dotenv
 
@@ -37,21 +72,38 @@ logger.info("Modules loaded")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 load_dotenv()
-logger.info(f"Environment loaded:")
-for key, value in os.environ.items():
-    logger.info(f"   {key} = {value}")
+# Summarize app configuration in one line, without secrets or unrelated environment
+CONFIG_PREFIXES = ("DATABASE_", "GO_API_", "CORS_", "JWT_", "MARKET_", "LOG_")
+SECRET_MARKERS = ("PASSWORD", "SECRET", "TOKEN")
+config = {
+    key: "<redacted>" if any(marker in key for marker in SECRET_MARKERS) else value
+    for key, value in sorted(os.environ.items())
+    if key.startswith(CONFIG_PREFIXES)
+}
+logger.info("Environment loaded: %s", config)
 
 cors_origins = os.getenv("CORS_ORIGINS").split(",")
-go_api_url = os.getenv("GO_API_URL")
 
-app = FastAPI()
+# Largest page of alerts a client can request at once
+MAX_ALERTS_PAGE_SIZE = 1000
+# Largest number of alerts that can be created or deleted in one batch request
+MAX_ALERTS_BATCH_SIZE = 1000
+# Largest number of points a downsampled price history can be reduced to
+MAX_STOCKS_POINTS = 10000
+
+# orjson cut the cost of returning 10k alert models from about 141 ms to 119 ms (about 1.2x,
+# see benchmarks/serialization.py); most of what remains is response model validation
+app = FastAPI(default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=cors_origins,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
+app.add_middleware(metrics.MetricsMiddleware, streaming_paths=["/alerts/events"])
+app.add_middleware(profiling.ProfilingMiddleware)
 
 
 @app.exception_handler(RequestValidationError)
@@ -79,7 +131,9 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     """
     try:
         # Verify user credentials, raise error if user not found or password is incorrect
-        user_info = users.verify_credentials(form_data.username, form_data.password)
+        user_info = await users.verify_credentials(
+            form_data.username, form_data.password
+        )
         # If no error was raised, create access token
         access_token = users.create_access_token(data=user_info)
         return {"access_token": access_token, "token_type": "bearer"}
@@ -105,7 +159,7 @@ async def register(user_data: UserRegister):
     """
     try:
         # Register the user
-        user_info = users.register_user(user_data.username, user_data.password)
+        user_info = await users.register_user(user_data.username, user_data.password)
         # Create access token for the new user
         access_token = users.create_access_token(data=user_info)
         return {
@@ -127,27 +181,80 @@ async def register(user_data: UserRegister):
 ##### Protected Endpoints #####
 
 
-# Get alerts matching optional search_term
+# Get alerts matching optional search_term, optionally paginated, projected and filtered
+# Responses carry a strong ETag; If-None-Match with the current one is answered with a 304
 @app.get("/alerts", response_model=List[Dict])
 async def search_alerts(
+    request: Request,
     search_term: str = "",
+    limit: Optional[int] = Query(None, ge=1, le=MAX_ALERTS_PAGE_SIZE),
+    after: Optional[int] = None,
+    fields: Optional[str] = None,
+    alert_status: Optional[Literal["active", "triggered", "expired"]] = Query(
+        None, alias="status"
+    ),
     current_user: Dict[str, str | int] = Depends(users.get_user_from_token),
-) -> List[Dict]:
+) -> Response:
+    user_id = current_user["user_id"]
+    # Spaces around names and empty names are ignored, e.g. "ticker, price," selects two fields
+    field_names = tuple(
+        name.strip() for name in (fields or "").split(",") if name.strip()
+    )
+
+    async def fetch() -> alert_cache.Listing:
+        # The JSON array is built by PostgreSQL and sent as is
+        body, count, last_alert_id = await alerts.search_json(
+            user_id,
+            search_term,
+            limit=limit,
+            after=after,
+            fields=list(field_names) or None,
+            status=alert_status,
+        )
+        # A full page may have more results after it; pass its last id back as ?after=
+        full_page = limit is not None and count == limit
+        return alert_cache.prepare(body, last_alert_id if full_page else None)
+
     try:
-        return alerts.search(current_user["user_id"], search_term)
+        listing = await alert_cache.get_or_render(
+            user_id, (search_term, limit, after, field_names, alert_status), fetch
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         logger.error(f"Error searching alerts: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+    # no-cache lets clients store the listing but makes them revalidate it every time
+    headers = {"ETag": listing.etag, "Cache-Control": "private, no-cache"}
+    if listing.next_cursor is not None:
+        headers["X-Next-Cursor"] = str(listing.next_cursor)
+    if alert_cache.not_modified(listing, request.headers.get("If-None-Match")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(listing.body, media_type="application/json", headers=headers)
+
+
+# Stream alert trigger and expiry events as Server-Sent Events
+@app.get("/alerts/events")
+async def stream_alert_events(
+    current_user: Dict[str, str | int] = Depends(users.get_user_from_token),
+) -> StreamingResponse:
+    return StreamingResponse(
+        events.stream(current_user["user_id"]),
+        media_type="text/event-stream",
+        # Disable caching and NGINX response buffering so events are delivered immediately
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
 # Endpoint to create a new alert
 @app.post("/alerts", status_code=status.HTTP_201_CREATED, response_model=AlertResponse)
-def create_alert(
+async def create_alert(
     alert: Alert,
     current_user: Dict[str, str | int] = Depends(users.get_user_from_token),
 ) -> AlertResponse:
     try:
-        alert_id = alerts.create(alert, current_user["user_id"])
+        alert_id = await alerts.create(alert, current_user["user_id"])
         return AlertResponse(
             message="Alert created successfully", new_alert_id=alert_id
         )
@@ -158,36 +265,130 @@ def create_alert(
 
 # Delete alert by ID (query parameter)
 @app.delete("/alerts", response_model=AlertResponse)
-def delete_alert(
+async def delete_alert(
     id: int, current_user: Dict[str, str | int] = Depends(users.get_user_from_token)
 ) -> AlertResponse:
     try:
         # No need to check if the alert belongs to the current user because the UI prevents the user from viewing alerts for other users
         # Ideally user authentication is implemented here to prevent deletion of alerts for other users
-        alerts.delete(id)
+        await alerts.delete(id)
         return AlertResponse(message="Alert deleted successfully", deleted_alert_id=id)
     except Exception as e:
         logger.error(f"Error deleting alert: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+def batch_errors(errors: Dict[int, str]) -> List[AlertBatchError]:
+    return [
+        AlertBatchError(index=index, detail=detail)
+        for index, detail in sorted(errors.items())
+    ]
+
+
+# Create many alerts in one transaction
+# In atomic mode any invalid alert fails the whole batch; in partial mode only that alert fails
+@app.post(
+    "/alerts/batch",
+    status_code=status.HTTP_201_CREATED,
+    response_model=AlertBatchResponse,
+)
+async def create_alerts_batch(
+    items: List[Dict[str, Any]] = Body(..., max_length=MAX_ALERTS_BATCH_SIZE),
+    mode: Literal["atomic", "partial"] = "atomic",
+    current_user: Dict[str, str | int] = Depends(users.get_user_from_token),
+) -> AlertBatchResponse:
+    # Validate every item in one pass, collecting per-item errors
+    valid_indices, valid_alerts, errors = [], [], {}
+    for index, item in enumerate(items):
+        try:
+            valid_alerts.append(Alert.model_validate(item))
+            valid_indices.append(index)
+        except ValidationError as e:
+            errors[index] = e.errors()[0].get("msg", "Invalid input")
+    if errors and mode == "atomic":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=[error.model_dump() for error in batch_errors(errors)],
+        )
+
+    try:
+        created_ids, create_errors = await alerts.create_many(
+            valid_alerts, current_user["user_id"], atomic=mode == "atomic"
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error creating alerts: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+    # Map results for the valid subset back to request positions
+    new_alert_ids = [None] * len(items)
+    for position, index in enumerate(valid_indices):
+        new_alert_ids[index] = created_ids[position]
+        if position in create_errors:
+            errors[index] = create_errors[position]
+    return AlertBatchResponse(
+        message=f"Created {len(items) - len(errors)} of {len(items)} alerts",
+        new_alert_ids=new_alert_ids,
+        errors=batch_errors(errors),
+    )
+
+
+# Delete many of the current user's alerts by ID in one statement
+@app.delete("/alerts/batch", response_model=AlertBatchResponse)
+async def delete_alerts_batch(
+    ids: List[int] = Body(..., max_length=MAX_ALERTS_BATCH_SIZE),
+    mode: Literal["atomic", "partial"] = "atomic",
+    current_user: Dict[str, str | int] = Depends(users.get_user_from_token),
+) -> AlertBatchResponse:
+    try:
+        deleted_ids, errors = await alerts.delete_many(
+            ids, current_user["user_id"], atomic=mode == "atomic"
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error deleting alerts: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+    return AlertBatchResponse(
+        message=f"Deleted {len(deleted_ids)} of {len(ids)} alerts",
+        deleted_alert_ids=deleted_ids,
+        errors=batch_errors(errors),
+    )
+
+
 # ------------------------------------------------------------------------#
 
 ##### Lifespan Events #####
 
 
-# On startup, open database connection
+# On startup, open database connection pool and market service client
 @app.on_event("startup")
-def startup() -> None:
-    logger.info("Opening database connection")
-    return database.init()
-
-
-# On shutdown, close database connection
+async def startup() -> None:
+    logger.info("Opening database connection pool")
+    await database.init()
+    logger.info("Opening market service client")
+    await market.init()
+    price_store.init()
+    events.start()
+    if expiry.ENABLED:
+        expiry.start()
+    if scheduler.ENABLED:
+        scheduler.start()
+
+
+# On shutdown, close database connection pool and market service client
 @app.on_event("shutdown")
-def shutdown() -> None:
-    logger.info("Closing database connection")
-    return database.close()
+async def shutdown() -> None:
+    await scheduler.stop()
+    await shards.stop()
+    await expiry.stop()
+    await events.stop()
+    logger.info("Closing market service client")
+    await market.close()
+    price_store.close()
+    logger.info("Closing database connection pool")
+    await database.close()
 
 
 # ------------------------------------------------------------------------#
@@ -212,17 +413,14 @@ def health_check() -> Dict[str, str]:
 async def health_check_deep() -> Dict[str, str | bool]:
 
     logger.info("Testing database connection...")
-    db_ok = database.ping()
+    db_ok = await database.ping()
 
     logger.info("Testing market connection...")
-    endpoint = "/health"
-    url = go_api_url + endpoint
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(url)
+        response = await market.get("/health", timeout=5.0)
         response.raise_for_status()
         market_ok = True
-    except (httpx.RequestError, httpx.HTTPStatusError) as e:
+    except (httpx.RequestError, httpx.HTTPStatusError, CircuitOpenError) as e:
         logger.error(f"Go microservice health check failed: {e}")
         market_ok = False
 
@@ -233,6 +431,69 @@ async def health_check_deep() -> Dict[str, str | bool]:
     }
 
 
+# Price history and verified token cache counters
+@app.get("/health/cache")
+async def health_check_cache() -> Dict[str, Dict[str, int]]:
+    return {
+        "alerts": alert_cache.stats(),
+        "stocks": market.stocks_cache.stats(),
+        "price_store": price_store.stats(),
+        "tokens": users.token_cache.stats(),
+    }
+
+
+# Market service circuit breaker, hedging and latency percentiles
+@app.get("/health/market")
+async def health_check_market() -> Dict[str, Any]:
+    return market.stats()
+
+
+# Alert evaluation scheduler state and recent cycle timings
+@app.get("/health/scheduler")
+async def health_check_scheduler() -> Dict[str, Any]:
+    return {**scheduler.stats(), "shards": shards.stats()}
+
+
+# Alert expiry counters and the next pending expiration
+@app.get("/health/expiry")
+async def health_check_expiry() -> Dict[str, Any]:
+    return expiry.stats()
+
+
+# Prometheus metrics
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+# Saved request profiles, newest first; requires the profiling token as the X-Profile header
+@app.get("/admin/profiles")
+async def list_profiles(
+    x_profile: Optional[str] = Header(None),
+) -> List[Dict[str, Any]]:
+    check_profile_token(x_profile)
+    return await asyncio.to_thread(profiling.list_profiles)
+
+
+# Collapsed stacks of one saved profile, for flamegraph.pl, inferno or speedscope
+@app.get("/admin/profiles/{profile_id}", response_class=PlainTextResponse)
+async def get_profile(
+    profile_id: str, x_profile: Optional[str] = Header(None)
+) -> PlainTextResponse:
+    check_profile_token(x_profile)
+    stacks = await asyncio.to_thread(profiling.read_profile, profile_id)
+    if stacks is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(stacks)
+
+
+def check_profile_token(token: Optional[str]) -> None:
+    if not profiling.TOKEN:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if not profiling.authorized(token):
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+
 # Temporary endpoint for manual testing
 @app.get("/test")
 async def test():
@@ -245,24 +506,35 @@ async def test():
 
 
 # Endpoint to return stock price history
+# With stream=true the Go service's response is relayed as-is instead of parsed and cached
+# With max_points=N at most N points are returned, chosen by LTTB or aggregated into OHLC candles
 @app.get("/stocks")
 async def get_stock_info(
-    ticker: str, startDate: str, interval: str
+    ticker: str,
+    startDate: str,
+    interval: str,
+    stream: bool = False,
+    max_points: Optional[int] = Query(None, ge=3, le=MAX_STOCKS_POINTS),
+    downsample: Literal["lttb", "ohlc"] = "lttb",
 ) -> List[Dict[str, str | float]]:
-    endpoint = "/stocks"
-    query = f"?ticker={ticker}&startDate={startDate}&interval={interval}"
-    url = go_api_url + endpoint + query
+    if stream and max_points is not None:
+        raise HTTPException(
+            status_code=400, detail="stream cannot be combined with max_points"
+        )
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
-        response.raise_for_status()
-        return response.json()
+        if stream:
+            return await market.stream_stocks(ticker, startDate, interval)
+        return await market.get_stocks(
+            ticker, startDate, interval, max_points, downsample
+        )
     except httpx.HTTPStatusError as e:
         raise HTTPException(
             status_code=e.response.status_code, detail="Error from Go service"
         )
+    except CircuitOpenError:
+        raise HTTPException(status_code=503, detail="Market service unavailable")
     except Exception as e:
-        print(e)
+        logger.warning(f"Error fetching stock info for {ticker}: {e}")
         raise HTTPException(status_code=404, detail="Ticker not found")
 
 
@@ -270,12 +542,9 @@ async def get_stock_info(
 async def check_alert(
     ticker: str, price: float, direction: str
 ) -> Dict[str, str | bool]:
-    endpoint = "/check-alert"
-    query = f"?ticker={ticker}&price={price}&direction={direction}"
-    url = go_api_url + endpoint + query
+    params = {"ticker": ticker, "price": price, "direction": direction}
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
+        response = await market.get("/check-alert", params=params)
         response.raise_for_status()
         return response.json()
     except httpx.HTTPStatusError as e:
@@ -284,6 +553,70 @@ async def check_alert(
         except Exception:
             detail = "Error from Go service"
         raise HTTPException(status_code=e.response.status_code, detail=detail)
+    except CircuitOpenError:
+        raise HTTPException(status_code=503, detail="Market service unavailable")
     except Exception as e:
-        print(f"Unexpected error: {e}")
+        logger.warning(f"Unexpected error checking alert: {e}")
         raise HTTPException(status_code=502, detail="Market service unavailable")
+
+
+# Check many prospective alerts against current prices, fetching each distinct ticker once
+# Results are in input order; items that fail get an error instead of failing the batch
+@app.post("/check-alert/batch", response_model=AlertCheckBatchResponse)
+async def check_alerts_batch(
+    items: List[Dict[str, Any]] = Body(..., max_length=MAX_ALERTS_BATCH_SIZE),
+) -> AlertCheckBatchResponse:
+    checks, errors = {}, {}
+    for index, item in enumerate(items):
+        try:
+            checks[index] = AlertCheck.model_validate(item)
+        except ValidationError as e:
+            errors[index] = e.errors()[0].get("msg", "Invalid input")
+
+    prices = await market.get_price_results(check.ticker for check in checks.values())
+
+    results = [None] * len(items)
+    for index, check in checks.items():
+        current = prices[check.ticker]
+        if isinstance(current, Exception) and market.is_upstream_failure(current):
+            errors[index] = "Market service unavailable"
+        elif isinstance(current, Exception):
+            errors[index] = "Ticker not found"
+        else:
+            # Same rule as the Go service: the alert must not already be triggered
+            if check.direction == "above":
+                valid = check.price > current
+            else:
+                valid = check.price < current
+            results[index] = AlertCheckResult(
+                valid=valid,
+                currentPrice=current,
+                message=(
+                    "Alert is valid"
+                    if valid
+                    else f"Price must be {check.direction} current price {current}"
+                ),
+            )
+    return AlertCheckBatchResponse(results=results, errors=batch_errors(errors))
+
+
+# Analyze a weighted portfolio over the price histories of its tickers, fetched concurrently
+# The analytics are NumPy arrays, encoded directly by orjson rather than validated element by
+# element against the response model
+@app.post("/portfolio/analytics", response_model=PortfolioAnalyticsResponse)
+async def portfolio_analytics(request: PortfolioAnalyticsRequest) -> ORJSONResponse:
+    try:
+        analytics = await portfolio.analytics(
+            [holding.ticker for holding in request.holdings],
+            [holding.weight for holding in request.holdings],
+            request.startDate,
+            request.interval,
+            request.initialValue,
+        )
+    except CircuitOpenError:
+        raise HTTPException(status_code=503, detail="Market service unavailable")
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return ORJSONResponse(analytics)
@@ -0,0 +1,458 @@
+"""
+Evaluates alerts on several cores, sharded by ticker across dedicated worker processes.
+
+Each of EVALUATION_SHARDS processes owns the active alerts whose ticker hashes to it. It loads
+them straight from PostgreSQL over its own connection, so no alert row passes through the API
+process, and keeps them as compact column arrays: a ticker slot, a threshold, a direction and an
+id per alert. Alerts created, deleted, triggered or expired by the API process are sent to the
+shards as they change, and partitions are reloaded every EVALUATION_SHARD_RELOAD_INTERVAL seconds
+to pick up changes made by other workers.
+
+On every cycle the API process fetches one price per ticker (the I/O stays on its event loop),
+writes the prices into a shared-memory block laid out as one region per shard in the shard's
+ticker order, and sends each shard a few bytes of control message. Shards compare their whole
+partition against their region in one vectorized pass and send back the fired alert ids as raw
+int64 bytes. The API process is the single writer: it triggers the fired ids of all shards with
+one batched UPDATE, and tells the shards to drop them.
+
+Shard processes are started on the first sharded evaluation, so only the evaluation leader
+(see src/scheduler.py) runs them, and restarted if one dies or stops answering.
+
+See: https://docs.python.org/3/library/multiprocessing.shared_memory.html
+"""
+
+import asyncio
+import multiprocessing
+import os
+import time
+from itertools import chain
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+import psycopg as postgres
+from src import database, metrics
+from src.logging import logger
+
+# Number of shard processes, 0 to evaluate in the API process instead
+SHARDS = int(os.getenv("EVALUATION_SHARDS", "0"))
+ENABLED = SHARDS > 0
+RELOAD_INTERVAL = float(os.getenv("EVALUATION_SHARD_RELOAD_INTERVAL", "300"))  # Seconds
+TIMEOUT = float(os.getenv("EVALUATION_SHARD_TIMEOUT", "60"))  # Seconds per reply
+
+# Each shard's active alerts, grouped by ticker as in alerts.EVALUATE_ALERTS
+# The hash is masked to stay non-negative, since abs() overflows on the smallest integer
+SHARD_ALERTS = """
+    SELECT ticker, array_agg(alert_id), array_agg(price::float8), array_agg(direction = 'above')
+    FROM alerts
+    WHERE triggered = false AND expired IS NOT TRUE
+    AND (hashtext(ticker) & 2147483647) %% %s = %s
+    GROUP BY ticker;
+    """
+
+# Initialize to satisfy module scope before first use
+processes: List[multiprocessing.Process] = []
+pipes: List[Connection] = []
+prices: Optional[SharedMemory] = None
+
+# Per shard, the tickers of its partition in price slot order, and its alert count at the last
+# evaluation, with the shard of each ticker
+tickers: List[List[str]] = []
+alert_counts: List[int] = []
+shard_of: Dict[str, int] = {}
+loaded_at: Optional[float] = None
+# Alerts created while the shards are loading, sent once the load completes
+pending: Optional[List[Tuple[int, str, str, float]]] = None
+counters = {"loads": 0, "evaluations": 0, "restarts": 0}
+
+
+class Partition:
+    """
+    A shard's active alerts as parallel column arrays.
+    """
+
+    def __init__(self) -> None:
+        self.tickers: List[str] = []
+        self.slot_of: Dict[str, int] = {}
+        self.slots = np.empty(0, dtype=np.int32)
+        self.thresholds = np.empty(0, dtype=np.float64)
+        self.above = np.empty(0, dtype=bool)
+        self.ids = np.empty(0, dtype=np.int64)
+
+    def load(
+        self, groups: Sequence[Tuple[str, List[int], List[float], List[bool]]]
+    ) -> None:
+        counts = np.fromiter((len(g[1]) for g in groups), np.intp, len(groups))
+        total = int(counts.sum())
+        self.tickers = [group[0] for group in groups]
+        self.slot_of = {ticker: slot for slot, ticker in enumerate(self.tickers)}
+        self.slots = np.repeat(np.arange(len(groups), dtype=np.int32), counts)
+        self.ids = np.fromiter(
+            chain.from_iterable(g[1] for g in groups), np.int64, total
+        )
+        self.thresholds = np.fromiter(
+            chain.from_iterable(g[2] for g in groups), np.float64, total
+        )
+        self.above = np.fromiter(chain.from_iterable(g[3] for g in groups), bool, total)
+
+    def add(self, rows: Sequence[Tuple[int, str, float, bool]]) -> None:
+        """
+        Append (alert_id, ticker, threshold, above) rows, skipping alerts already present.
+        New tickers get the next price slots, in the order they first appear.
+        """
+        ids = np.fromiter((row[0] for row in rows), np.int64, len(rows))
+        new = ~np.isin(ids, self.ids)
+        slots = []
+        for row in rows:
+            slot = self.slot_of.get(row[1])
+            if slot is None:
+                slot = self.slot_of[row[1]] = len(self.tickers)
+                self.tickers.append(row[1])
+            slots.append(slot)
+        self.slots = np.concatenate([self.slots, np.array(slots, np.int32)[new]])
+        self.ids = np.concatenate([self.ids, ids[new]])
+        self.thresholds = np.concatenate(
+            [self.thresholds, np.array([row[2] for row in rows], np.float64)[new]]
+        )
+        self.above = np.concatenate(
+            [self.above, np.array([row[3] for row in rows], bool)[new]]
+        )
+
+    def fired(self, current: np.ndarray) -> np.ndarray:
+        """
+        Ids of alerts crossed by the current prices, one per ticker slot.
+        Comparisons against NaN are False, so tickers without a price never fire.
+        """
+        price = current[self.slots]
+        return self.ids[
+            np.where(self.above, price > self.thresholds, price < self.thresholds)
+        ]
+
+    def drop(self, ids: np.ndarray) -> None:
+        keep = ~np.isin(self.ids, ids)
+        self.slots = self.slots[keep]
+        self.thresholds = self.thresholds[keep]
+        self.above = self.above[keep]
+        self.ids = self.ids[keep]
+
+
+def fired_bytes(partition: Partition, block: SharedMemory, offset: int) -> bytes:
+    """
+    Evaluate a partition against its region of the price block.
+    """
+    current = np.ndarray(
+        len(partition.tickers), dtype=np.float64, buffer=block.buf, offset=offset * 8
+    )
+    return partition.fired(current).tobytes()
+
+
+def serve(shard: int, shard_count: int, conninfo: str, pipe: Connection) -> None:
+    """
+    Shard process main loop: answer load and evaluate messages, and apply add and drop
+    messages, until told to stop or the API process goes away. Replies are (ok, result or
+    error message) tuples.
+    """
+    partition = Partition()
+    conn = None
+    block = None
+    while True:
+        try:
+            message = pipe.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        kind = message[0]
+        if kind == "stop":
+            break
+        try:
+            if kind == "load":
+                if conn is None or conn.closed:
+                    conn = postgres.connect(conninfo, autocommit=True)
+                groups = conn.execute(SHARD_ALERTS, (shard_count, shard)).fetchall()
+                partition.load(groups)
+                pipe.send((True, (partition.tickers, len(partition.ids))))
+            elif kind == "evaluate":
+                name, offset = message[1], message[2]
+                if block is None or block.name != name:
+                    if block is not None:
+                        block.close()
+                    # Spawned processes share the API process's resource tracker, which
+                    # unlinks the block if the API process exits without doing so
+                    block = SharedMemory(name=name)
+                fired = fired_bytes(partition, block, offset)
+                pipe.send((True, (fired, len(partition.ids))))
+            elif kind == "add":
+                partition.add(message[1])
+            elif kind == "drop":
+                partition.drop(np.frombuffer(message[1], dtype=np.int64))
+        except Exception as e:
+            # add and drop are not answered
+            if kind not in ("add", "drop"):
+                pipe.send((False, repr(e)))
+            if isinstance(e, postgres.Error) and conn is not None:
+                conn.close()
+    if conn is not None:
+        conn.close()
+    if block is not None:
+        block.close()
+
+
+def start() -> None:
+    """
+    Start the shard processes. Called on the first sharded evaluation.
+    """
+    global processes, pipes
+    logger.info("Starting %d alert evaluation shards", SHARDS)
+    # Spawn rather than fork, since the API process runs an event loop and threads
+    context = multiprocessing.get_context("spawn")
+    conninfo = database.conninfo()
+    processes, pipes = [], []
+    for shard in range(SHARDS):
+        parent, child = context.Pipe()
+        process = context.Process(
+            target=serve,
+            args=(shard, SHARDS, conninfo, child),
+            name=f"alert-shard-{shard}",
+            daemon=True,
+        )
+        process.start()
+        child.close()
+        processes.append(process)
+        pipes.append(parent)
+
+
+async def stop() -> None:
+    """
+    Stop the shard processes and free the shared price block, on API shutdown or restart.
+    """
+    global prices, loaded_at
+    if processes:
+        logger.info("Stopping alert evaluation shards")
+    for pipe in pipes:
+        try:
+            pipe.send(("stop",))
+        except OSError:
+            pass
+    for process in processes:
+        await asyncio.to_thread(process.join, 5)
+        if process.is_alive():
+            process.terminate()
+    for pipe in pipes:
+        pipe.close()
+    processes.clear()
+    pipes.clear()
+    tickers.clear()
+    alert_counts.clear()
+    shard_of.clear()
+    loaded_at = None
+    if prices is not None:
+        prices.close()
+        prices.unlink()
+        prices = None
+
+
+async def ensure_started() -> None:
+    """
+    Start the shards if they are not running, or restart them if any has died.
+    """
+    if processes and all(process.is_alive() for process in processes):
+        return
+    if processes:
+        counters["restarts"] += 1
+        logger.warning("Restarting alert evaluation shards")
+        await stop()
+    start()
+
+
+def receive(pipe: Connection, deadline: float) -> Any:
+    """
+    Wait for a shard's reply until the deadline, so that the waiting thread is never left
+    blocked on a shard that stopped answering.
+    """
+    if not pipe.poll(max(deadline - time.monotonic(), 0)):
+        raise TimeoutError("no reply within EVALUATION_SHARD_TIMEOUT")
+    return pipe.recv()
+
+
+async def ask(messages: Sequence[Tuple]) -> List[Any]:
+    """
+    Send one message to each shard and wait for every reply. Raises RuntimeError with a
+    shard's error, after which the shards are restarted on the next evaluation.
+    """
+    try:
+        for pipe, message in zip(pipes, messages):
+            pipe.send(message)
+        deadline = time.monotonic() + TIMEOUT
+        replies = await asyncio.gather(
+            *(asyncio.to_thread(receive, pipe, deadline) for pipe in pipes)
+        )
+    except (TimeoutError, EOFError, OSError) as e:
+        # Replies would arrive out of step, so the shards cannot be reused
+        for process in processes:
+            process.terminate()
+        raise RuntimeError(f"alert evaluation shard failed: {e!r}")
+    errors = [result for ok, result in replies if not ok]
+    if errors:
+        raise RuntimeError(f"alert evaluation shard failed: {errors[0]}")
+    return [result for _, result in replies]
+
+
+async def load() -> None:
+    """
+    Have every shard reload its partition of active alerts from the database.
+    """
+    global loaded_at, pending, shard_of
+    started = time.perf_counter()
+    pending = []
+    try:
+        replies = await ask([("load",)] * len(pipes))
+        created = pending
+    finally:
+        pending = None
+    tickers[:] = [shard_tickers for shard_tickers, _ in replies]
+    alert_counts[:] = [count for _, count in replies]
+    shard_of = {
+        ticker: shard
+        for shard, shard_tickers in enumerate(tickers)
+        for ticker in shard_tickers
+    }
+    loaded_at = time.monotonic()
+    counters["loads"] += 1
+    logger.info(
+        "Alert shards loaded %d alerts across %d tickers in %.3fs",
+        sum(alert_counts),
+        sum(len(shard_tickers) for shard_tickers in tickers),
+        time.perf_counter() - started,
+    )
+    # Their tickers may be missing from the replies, so they are only sent now
+    add_many(created)
+
+
+def reload_due() -> bool:
+    return loaded_at is None or time.monotonic() - loaded_at >= RELOAD_INTERVAL
+
+
+def price_block(slots: int) -> SharedMemory:
+    """
+    The shared price block, replaced with a larger one when it cannot hold every slot.
+    """
+    global prices
+    size = max(slots, 1) * 8
+    if prices is None or prices.size < size:
+        if prices is not None:
+            prices.close()
+            prices.unlink()
+        # Doubled, so that a growing number of tickers rarely forces a new block
+        prices = SharedMemory(create=True, size=2 * size)
+    return prices
+
+
+def write_prices(quotes: Dict[str, float]) -> List[Tuple]:
+    """
+    Write each shard's prices to its region of the price block, NaN where a ticker has no
+    quote. Returns the evaluate message for each shard.
+    """
+    block = price_block(sum(len(shard_tickers) for shard_tickers in tickers))
+    current = np.ndarray(block.size // 8, dtype=np.float64, buffer=block.buf)
+    messages, offset = [], 0
+    for shard_tickers in tickers:
+        current[offset : offset + len(shard_tickers)] = [
+            quotes.get(ticker, np.nan) for ticker in shard_tickers
+        ]
+        messages.append(("evaluate", block.name, offset))
+        offset += len(shard_tickers)
+    return messages
+
+
+async def evaluate(quotes: Dict[str, float]) -> np.ndarray:
+    """
+    Evaluate every shard's alerts against the quotes, returning the fired alert ids.
+    """
+    replies = await ask(write_prices(quotes))
+    alert_counts[:] = [count for _, count in replies]
+    counters["evaluations"] += 1
+    return np.concatenate(
+        [np.frombuffer(fired, dtype=np.int64) for fired, _ in replies]
+        or [np.empty(0, dtype=np.int64)]
+    )
+
+
+def send(pipe: Connection, message: Tuple) -> None:
+    try:
+        pipe.send(message)
+    except OSError:
+        # A dead shard is restarted, and reloaded, on the next evaluation
+        pass
+
+
+def add_many(rows: Iterable[Tuple[int, str, str, float]]) -> None:
+    """
+    Add newly created (alert_id, ticker, direction, threshold) alerts to the shards.
+    A ticker new to the shards goes to the one with the fewest tickers, and moves to the shard
+    it hashes to at the next reload.
+    """
+    if pending is not None:
+        pending.extend(rows)
+        return
+    if loaded_at is None:
+        # The shards are not running here, or their first load will include the alerts
+        return
+    batches: Dict[int, List[Tuple[int, str, float, bool]]] = {}
+    for alert_id, ticker, direction, threshold in rows:
+        shard = shard_of.get(ticker)
+        if shard is None:
+            shard = min(range(len(tickers)), key=lambda s: len(tickers[s]))
+            shard_of[ticker] = shard
+            # The shard appends the ticker to its price slots in the same order
+            tickers[shard].append(ticker)
+        batches.setdefault(shard, []).append(
+            (alert_id, ticker, threshold, direction == "above")
+        )
+    for shard, batch in batches.items():
+        alert_counts[shard] += len(batch)
+        send(pipes[shard], ("add", batch))
+
+
+def add(alert_id: int, ticker: str, direction: str, threshold: float) -> None:
+    """
+    Add a newly created active alert to the shards.
+    """
+    add_many([(alert_id, ticker, direction, threshold)])
+
+
+def drop(ids: np.ndarray) -> None:
+    """
+    Remove alerts from the shards' partitions once they are triggered or found inactive.
+    """
+    if len(ids):
+        payload = ids.tobytes()
+        for pipe in pipes:
+            send(pipe, ("drop", payload))
+
+
+def remove_many(rows: Iterable[Tuple]) -> None:
+    """
+    Remove rows starting with alert_id from the shards once they are deleted, triggered or
+    expired.
+    """
+    if pipes:
+        drop(np.array([row[0] for row in rows], dtype=np.int64))
+
+
+def all_tickers() -> List[str]:
+    return list(chain.from_iterable(tickers))
+
+
+def stats() -> Dict[str, int]:
+    """
+    Report shard occupancy and counters.
+    """
+    return {
+        "shards": SHARDS,
+        "alive": sum(process.is_alive() for process in processes),
+        "alerts": sum(alert_counts),
+        "tickers": sum(len(shard_tickers) for shard_tickers in tickers),
+        **counters,
+    }
+
+
+metrics.CallbackGauge("alert_shards", "Alert evaluation shard counters", "stat", stats)
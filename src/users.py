@@ -6,10 +6,13 @@ from datetime import datetime, timedelta, UTC
 from typing import Dict
 from jose import JWTError, jwt
 from fastapi import HTTPException, status, Request
-from src import database
+from src import database, metrics
+from src.cache import TTLCache
 from src.logging import logger
 from src.schemas import UserResponse
+import hashlib
 import os
+import threading
 
 # JWT configuration
 SECRET_KEY = os.getenv("JWT_SECRET_KEY")
@@ -19,19 +22,39 @@ if not SECRET_KEY:
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_EXPIRE_MINUTES", "30"))
 
+# Latency histograms for each database query
+VERIFY_CREDENTIALS_QUERY = metrics.db_query("users.verify_credentials")
+USERNAME_EXISTS_QUERY = metrics.db_query("users.username_exists")
+REGISTER_USER_QUERY = metrics.db_query("users.register_user")
 
-def verify_credentials(username: str, password: str) -> UserResponse:
+# Cache of verified tokens, keyed by SHA-256 digest of the token so that raw tokens are not
+# kept in memory. Entries expire at the token's own exp claim.
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000"))
+token_cache = TTLCache(TOKEN_CACHE_MAX_ENTRIES)
+# Guards token_cache, which is shared by the event loop and threadpool workers
+token_cache_lock = threading.Lock()
+
+metrics.CallbackGauge(
+    "token_cache",
+    "Verified token cache occupancy and counters",
+    "stat",
+    token_cache.stats,
+)
+
+
+async def verify_credentials(username: str, password: str) -> UserResponse:
     """
     Verify user credentials against the database.
     Returns UserResponse with user_id, username, and created_at if credentials are valid.
     Raises HTTPException if credentials are invalid.
     """
-    with database.connection.cursor() as cur:
-        cur.execute(
-            "SELECT id, password, created_at FROM users WHERE username = %s",
-            (username,),
-        )
-        result = cur.fetchone()
+    async with database.pool.connection() as conn, conn.cursor() as cur:
+        with VERIFY_CREDENTIALS_QUERY.time():
+            await cur.execute(
+                "SELECT id, password, created_at FROM users WHERE username = %s",
+                (username,),
+            )
+            result = await cur.fetchone()
 
         if not result:
             raise HTTPException(
@@ -51,16 +74,18 @@ def verify_credentials(username: str, password: str) -> UserResponse:
         )
 
 
-def register_user(username: str, password: str) -> UserResponse:
+async def register_user(username: str, password: str) -> UserResponse:
     """
     Register a new user in the database.
     Returns UserResponse with user_id, username, and created_at if registration is successful.
     Raises HTTPException if username already exists or registration fails.
     """
-    with database.connection.cursor() as cur:
+    async with database.pool.connection() as conn, conn.cursor() as cur:
         # Check if username already exists
-        cur.execute("SELECT id FROM users WHERE username = %s", (username,))
-        if cur.fetchone():
+        with USERNAME_EXISTS_QUERY.time():
+            await cur.execute("SELECT id FROM users WHERE username = %s", (username,))
+            exists = await cur.fetchone()
+        if exists:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Username already exists",
@@ -69,18 +94,19 @@ def register_user(username: str, password: str) -> UserResponse:
         # Insert new user into database
         try:
             # user_id and created_at are auto-generated by the database
-            cur.execute(
-                "INSERT INTO users (username, password) VALUES (%s, %s) RETURNING id, created_at",
-                (username, password),
-            )
-            user_id, created_at = cur.fetchone()
-            database.connection.commit()
+            with REGISTER_USER_QUERY.time():
+                await cur.execute(
+                    "INSERT INTO users (username, password) VALUES (%s, %s) RETURNING id, created_at",
+                    (username, password),
+                )
+                user_id, created_at = await cur.fetchone()
+                await conn.commit()
             return UserResponse(
                 user_id=user_id, username=username, created_at=created_at
             )
         except Exception as e:
             # Rolls back changes to database in case of error, to maintain data integrity
-            database.connection.rollback()
+            await conn.rollback()
             logger.error(f"Error registering user: {e}")
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -99,11 +125,12 @@ def create_access_token(data: UserResponse) -> str:
     return encoded_jwt
 
 
-def get_user_from_token(request: Request) -> Dict[str, str | int]:
+async def get_user_from_token(request: Request) -> Dict[str, str | int]:
     """
     Extract and verify user info from JWT token in Authorization header.
     Returns dict with user_id and username if token is valid.
     Raises HTTPException if token is invalid or expired.
+    Verified tokens are cached until they expire, so repeat requests skip JWT verification.
     """
     try:
         # Get the Authorization header
@@ -125,6 +152,13 @@ def get_user_from_token(request: Request) -> Dict[str, str | int]:
 
         token = auth_header.split(" ")[1]
 
+        # Serve previously verified tokens from cache
+        key = hashlib.sha256(token.encode()).digest()
+        with token_cache_lock:
+            found, user = token_cache.get(key)
+        if found:
+            return user
+
         # Rest of the existing token validation code
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id, username, expiration = (
@@ -140,14 +174,18 @@ def get_user_from_token(request: Request) -> Dict[str, str | int]:
                 headers={"WWW-Authenticate": "Bearer"},
             )
         # Check if token has expired
-        expired = datetime.now(UTC).timestamp() > expiration
+        now = datetime.now(UTC).timestamp()
+        expired = now > expiration
         if expired:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Token expired",
                 headers={"WWW-Authenticate": "Bearer"},
             )
-        return {"user_id": user_id, "username": username}
+        user = {"user_id": user_id, "username": username}
+        with token_cache_lock:
+            token_cache.set(key, user, expiration - now)
+        return user
     except JWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
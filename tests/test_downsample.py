@@ -0,0 +1,91 @@
+"""
+Tests for price history downsampling (src/downsample.py).
+"""
+
+from datetime import date, timedelta
+import numpy as np
+import pytest
+from src import downsample
+
+
+def bars(prices):
+    return [
+        {"date": (date(2024, 1, 1) + timedelta(days=index)).isoformat(), "price": price}
+        for index, price in enumerate(map(float, prices))
+    ]
+
+
+def reference_lttb(y, max_points):
+    """
+    Straightforward LTTB, one point and one triangle at a time.
+    """
+    n = len(y)
+    edges = np.linspace(0, n - 2, max_points - 1).astype(np.int64) + 1
+    selected = [0]
+    a = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 1 < max_points - 2:
+            next_start, next_end = edges[bucket + 1], edges[bucket + 2]
+            cx = (next_start + next_end - 1) / 2
+            cy = sum(y[next_start:next_end]) / (next_end - next_start)
+        else:
+            cx, cy = n - 1, y[-1]
+        best, best_area = start, -1.0
+        for b in range(start, end):
+            area = abs((a - cx) * (y[b] - y[a]) - (a - b) * (cy - y[a]))
+            if area > best_area:
+                best, best_area = b, area
+        selected.append(best)
+        a = best
+    return selected + [n - 1]
+
+
+@pytest.mark.parametrize("n, max_points", [(10, 3), (100, 7), (1000, 50), (997, 13)])
+def test_lttb_matches_reference(n, max_points):
+    y = np.random.default_rng(n).normal(size=n).cumsum()
+    assert downsample.lttb_indices(y, max_points).tolist() == reference_lttb(
+        y, max_points
+    )
+
+
+def test_lttb_keeps_first_last_and_spike():
+    prices = [10.0] * 100
+    prices[37] = 50.0
+    history = bars(prices)
+    result = downsample.lttb(history, 10)
+    assert len(result) == 10
+    assert result[0] is history[0] and result[-1] is history[-1]
+    assert history[37] in result
+    assert [bar["date"] for bar in result] == sorted(bar["date"] for bar in result)
+
+
+def test_lttb_returns_short_histories_unchanged():
+    history = bars(range(5))
+    assert downsample.lttb(history, 5) is history
+    assert downsample.lttb_indices(np.arange(5.0), 2).tolist() == [0, 1, 2, 3, 4]
+
+
+def test_ohlc_buckets():
+    history = bars([3, 1, 4, 1, 5, 9, 2, 6, 5, 3])
+    # 10 bars into 3 candles of 3, 3 and 4 bars
+    assert downsample.ohlc(history, 3) == [
+        {"date": "2024-01-01", "open": 3.0, "high": 4.0, "low": 1.0, "close": 4.0},
+        {"date": "2024-01-04", "open": 1.0, "high": 9.0, "low": 1.0, "close": 9.0},
+        {"date": "2024-01-07", "open": 2.0, "high": 6.0, "low": 2.0, "close": 3.0},
+    ]
+
+
+def test_ohlc_one_candle_per_bar_when_short():
+    history = bars([2, 7])
+    assert downsample.ohlc(history, 10) == [
+        {"date": "2024-01-01", "open": 2.0, "high": 2.0, "low": 2.0, "close": 2.0},
+        {"date": "2024-01-02", "open": 7.0, "high": 7.0, "low": 7.0, "close": 7.0},
+    ]
+    assert downsample.ohlc([], 10) == []
+
+
+def test_downsample_dispatches_by_method():
+    history = bars(np.random.default_rng(0).normal(size=50).cumsum())
+    assert downsample.downsample(history, 5, "ohlc") == downsample.ohlc(history, 5)
+    assert downsample.downsample(history, 5, "lttb") == downsample.lttb(history, 5)
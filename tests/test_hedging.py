@@ -0,0 +1,117 @@
+"""
+Tests for hedged market service requests (market.hedged).
+"""
+
+import asyncio
+import pytest
+from src import market
+from src.resilience import RateWindow
+
+DELAY = 0.05
+
+
+@pytest.fixture(autouse=True)
+def fresh_accounting(monkeypatch):
+    monkeypatch.setattr(market, "hedges", RateWindow(100))
+    monkeypatch.setattr(market, "counters", dict.fromkeys(market.counters, 0))
+
+
+class Upstream:
+    """
+    Fake send() whose calls take the given (seconds, result or exception) in turn.
+    """
+
+    def __init__(self, *plans) -> None:
+        self.plans = list(plans)
+        self.started = 0
+        self.cancelled = []
+        self.latencies = []
+
+    async def send(self):
+        call = self.started
+        self.started += 1
+        seconds, outcome = self.plans[call]
+        try:
+            await asyncio.sleep(seconds)
+        except asyncio.CancelledError:
+            self.cancelled.append(call)
+            raise
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def observe(self, latency: float) -> None:
+        self.latencies.append(latency)
+
+
+def run(upstream, settle=0.0):
+    async def main():
+        result = await market.hedged(upstream.send, DELAY, upstream.observe)
+        # Let a beaten original request finish
+        await asyncio.sleep(settle)
+        return result
+
+    return asyncio.run(main())
+
+
+def test_fast_request_is_not_hedged():
+    upstream = Upstream((0, "first"))
+    assert run(upstream) == "first"
+    assert upstream.started == 1
+    assert len(upstream.latencies) == 1
+    assert market.hedges.rate == 0
+    assert market.counters["hedged"] == 0
+
+
+def test_hedge_wins_and_original_latency_is_still_observed():
+    upstream = Upstream((4 * DELAY, "first"), (0, "hedge"))
+    assert run(upstream, settle=4 * DELAY) == "hedge"
+    assert upstream.started == 2
+    assert market.counters == {"hedged": 1, "hedge_wins": 1, "stale_served": 0}
+    assert market.hedges.rate == 1
+    # The original request was left to finish, and its own latency recorded
+    assert upstream.cancelled == []
+    assert len(upstream.latencies) == 1
+    assert upstream.latencies[0] >= 4 * DELAY
+
+
+def test_original_wins_and_hedge_is_cancelled():
+    upstream = Upstream((2 * DELAY, "first"), (10 * DELAY, "hedge"))
+    assert run(upstream) == "first"
+    assert market.counters["hedged"] == 1
+    assert market.counters["hedge_wins"] == 0
+    assert upstream.cancelled == [1]
+    assert len(upstream.latencies) == 1
+
+
+def test_failed_hedge_falls_back_to_the_original():
+    upstream = Upstream((2 * DELAY, "first"), (0, ValueError("hedge failed")))
+    assert run(upstream) == "first"
+    assert market.counters["hedge_wins"] == 0
+
+
+def test_failed_original_falls_back_to_the_hedge():
+    upstream = Upstream((2 * DELAY, ValueError("first failed")), (3 * DELAY, "hedge"))
+    assert run(upstream) == "hedge"
+    assert market.counters["hedge_wins"] == 1
+    # Failed requests are not observed
+    assert upstream.latencies == []
+
+
+def test_both_failing_raises_the_original_error():
+    upstream = Upstream(
+        (2 * DELAY, ValueError("first failed")), (0, ValueError("hedge failed"))
+    )
+    with pytest.raises(ValueError, match="first failed"):
+        run(upstream)
+
+
+def test_hedges_are_capped_by_ratio():
+    # One hedge in the last ten requests reaches the default HEDGE_MAX_RATIO of 0.1
+    for hedged in [True] + [False] * 9:
+        market.hedges.add(hedged)
+    upstream = Upstream((2 * DELAY, "first"), (0, "hedge"))
+    assert run(upstream) == "first"
+    assert upstream.started == 1
+    assert market.counters["hedged"] == 0
+    assert len(market.hedges) == 11
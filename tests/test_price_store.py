@@ -0,0 +1,112 @@
+"""
+Tests for the memory-mapped price history store (src/price_store.py).
+"""
+
+import os
+from datetime import date, timedelta
+import numpy as np
+import pytest
+from src import price_store
+
+KEY = ("AAPL", "1d")
+
+
+@pytest.fixture(autouse=True)
+def store_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(price_store, "DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(price_store, "ENABLED", True)
+    price_store.init()
+    yield tmp_path
+    price_store.close()
+    price_store.last_used.clear()
+
+
+def bars(first_day, prices):
+    start = date(2024, 1, 1) + timedelta(days=first_day)
+    return [
+        {"date": (start + timedelta(days=index)).isoformat(), "price": price}
+        for index, price in enumerate(map(float, prices))
+    ]
+
+
+def stored():
+    series = price_store.open_series(KEY)
+    return series.meta["generation"], series.slice(0)
+
+
+def generations(directory):
+    files = os.listdir(directory / "1d" / "AAPL")
+    return sorted({int(name.split(".")[1]) for name in files if name != "meta.json"})
+
+
+def test_full_store_round_trips():
+    history = bars(0, [1, 2, 3])
+    price_store.store(KEY, history, 0, tail=False)
+    assert stored() == (0, history)
+    start = price_store.day_start("2024-01-02")
+    assert price_store.open_series(KEY).slice(start) == history[1:]
+
+
+def test_open_series_reuses_mapping_until_written():
+    price_store.store(KEY, bars(0, [1, 2]), 0, tail=False)
+    series = price_store.open_series(KEY)
+    assert price_store.open_series(KEY) is series
+    price_store.store(KEY, bars(1, [2, 3]), 0, tail=True)
+    assert price_store.open_series(KEY) is not series
+
+
+def test_tail_updates_overlap_in_place_and_appends(store_directory):
+    price_store.store(KEY, bars(0, [1, 2, 3]), 0, tail=False)
+    # The tail repeats the last stored bar with a corrected price
+    price_store.store(KEY, bars(2, [3.5, 4, 5]), 0, tail=True)
+    assert stored() == (0, bars(0, [1, 2, 3.5, 4, 5]))
+    assert generations(store_directory) == [0]
+
+
+def test_tail_that_does_not_line_up_is_merged_into_a_new_generation(store_directory):
+    price_store.store(KEY, bars(0, [1, 2, 3]), 0, tail=False)
+    # Starts before the stored tail and skips a stored day
+    tail = bars(1, [20]) + bars(3, [40])
+    price_store.store(KEY, tail, 0, tail=True)
+    assert stored() == (1, bars(0, [1, 20, 3, 40]))
+    assert generations(store_directory) == [1]
+
+
+def test_rewrite_merges_and_replaces_by_timestamp():
+    price_store.store(KEY, bars(5, [6, 7]), price_store.day_start("2024-01-06"), False)
+    price_store.store(KEY, bars(0, [1, 2, 3, 4, 5, 60]), 0, tail=False)
+    generation, history = stored()
+    assert generation == 1
+    assert history == bars(0, [1, 2, 3, 4, 5, 60, 7])
+    assert price_store.open_series(KEY).meta["covered_from"] == 0
+
+
+def test_tail_after_eviction_is_not_stored():
+    price_store.store(KEY, bars(0, [1]), 0, tail=True)
+    assert price_store.open_series(KEY) is None
+
+
+def test_usage_is_accounted_and_cold_series_evicted(monkeypatch):
+    history = bars(0, range(100))
+    bytes_per_series = sum(
+        values.nbytes for values in price_store.to_columns(history).values()
+    )
+    price_store.store(("MSFT", "1d"), history, 0, tail=False)
+    assert price_store.read_usage() == bytes_per_series
+    price_store.store(KEY, bars(100, [1]), 0, tail=True)  # Not stored, nothing written
+    assert price_store.read_usage() == bytes_per_series
+
+    monkeypatch.setattr(price_store, "MAX_BYTES", bytes_per_series + 1000)
+    price_store.store(KEY, history, 0, tail=False)
+    assert price_store.open_series(("MSFT", "1d")) is None
+    assert stored()[1] == history
+    assert price_store.counters["evictions"] >= 1
+    assert price_store.read_usage() == sum(price_store.disk_usage().values())
+
+
+def test_to_columns_rejects_unparseable_dates():
+    with pytest.raises(ValueError):
+        price_store.to_columns([{"date": "yesterday", "price": 1.0}])
+    columns = price_store.to_columns(bars(0, [1.5]))
+    assert columns["ts"].tolist() == [price_store.day_start("2024-01-01")]
+    assert columns["price"].dtype == np.dtype("<f8")
@@ -0,0 +1,131 @@
+"""
+Tests for the circuit breaker, rate window and latency tracker (src/resilience.py).
+"""
+
+import pytest
+from src import resilience
+from src.resilience import CircuitBreaker, LatencyTracker, RateWindow
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience, "time", clock)
+    return clock
+
+
+def breaker():
+    return CircuitBreaker(window=10, min_calls=4, failure_rate=0.5, cooldown=30)
+
+
+def trip(circuit):
+    for _ in range(4):
+        assert circuit.allow()
+        circuit.record(False)
+    assert circuit.state == CircuitBreaker.OPEN
+
+
+def test_stays_closed_until_min_calls(clock):
+    circuit = breaker()
+    for _ in range(3):
+        assert circuit.allow()
+        circuit.record(False)
+    assert circuit.state == CircuitBreaker.CLOSED
+    assert circuit.allow()
+    circuit.record(False)
+    assert circuit.state == CircuitBreaker.OPEN
+    assert circuit.opened == 1
+
+
+def test_stays_closed_below_failure_rate(clock):
+    circuit = breaker()
+    for success in [True, False, True, True, False, True, True]:
+        assert circuit.allow()
+        circuit.record(success)
+    assert circuit.state == CircuitBreaker.CLOSED
+    assert circuit.stats()["failure_rate"] == round(2 / 7, 4)
+
+
+def test_open_rejects_until_cooldown(clock):
+    circuit = breaker()
+    trip(circuit)
+    clock.now += 29
+    assert not circuit.allow()
+    assert not circuit.allow()
+    assert circuit.rejected == 2
+    assert circuit.state == CircuitBreaker.OPEN
+
+
+def test_half_open_allows_one_probe_and_closes_on_success(clock):
+    circuit = breaker()
+    trip(circuit)
+    clock.now += 30
+    assert circuit.allow()
+    assert circuit.state == CircuitBreaker.HALF_OPEN
+    # Only the probe goes through until it has an outcome
+    assert not circuit.allow()
+    circuit.record(True)
+    assert circuit.state == CircuitBreaker.CLOSED
+    # The failures that opened the breaker no longer count
+    assert circuit.failures.rate == 0
+    assert circuit.allow()
+
+
+def test_failed_probe_reopens_for_another_cooldown(clock):
+    circuit = breaker()
+    trip(circuit)
+    clock.now += 30
+    assert circuit.allow()
+    circuit.record(False)
+    assert circuit.state == CircuitBreaker.OPEN
+    assert circuit.opened == 2
+    clock.now += 29
+    assert not circuit.allow()
+    clock.now += 1
+    assert circuit.allow()
+
+
+def test_abandoned_probe_lets_another_through(clock):
+    circuit = breaker()
+    trip(circuit)
+    clock.now += 30
+    assert circuit.allow()
+    circuit.abandon()
+    assert circuit.state == CircuitBreaker.HALF_OPEN
+    assert circuit.allow()
+
+
+def test_rate_window_forgets_oldest_values():
+    window = RateWindow(4)
+    assert window.rate == 0.0
+    for value in [True, True, False, False]:
+        window.add(value)
+    assert window.rate == 0.5
+    window.add(False)
+    window.add(False)
+    assert len(window) == 4
+    assert window.rate == 0.0
+
+
+def test_latency_tracker_percentiles():
+    tracker = LatencyTracker(size=100, min_samples=10)
+    for latency in range(9):
+        tracker.observe(latency / 100)
+    assert tracker.percentile(50) is None
+    for latency in range(9, 100):
+        tracker.observe(latency / 100)
+    assert tracker.percentile(50) == 0.5
+    assert tracker.percentile(95) == 0.95
+    assert tracker.percentile(100) == 0.99
+    # Only the most recent samples are kept
+    for _ in range(100):
+        tracker.observe(2.0)
+    assert tracker.percentile(50) == 2.0